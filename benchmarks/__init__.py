@@ -0,0 +1,7 @@
+'''
+Benchmarks of the front detection kernels
+
+python -m benchmarks runs the suite on synthetic fields (benchmarks/synthetic.py) at several resolutions
+and writes the timings and peak memory as json, to compare between commits.
+The bench_*.py scripts compare single kernels against their original (reference) versions.
+'''
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+'''
+Benchmark suite of the front detection kernels on synthetic fields (no input files needed)
+
+Times smooth_grid, geo_gradient, compute_dist_grids, hewson_1998 (float64 and float32), simmonds_et_al_2012, mask_zero_contour,
+clean_fronts and clean_fronts_multi on global grids of several resolutions, and measures the peak memory of
+each kernel (tracemalloc, in a separate run). The results are written as json with the git commit, so the runs
+of two commits can be compared.
+
+Usage:
+  python -m benchmarks --out results_new.json
+  python -m benchmarks --grids 2,0.5x0.625 --kernels hewson_1998,smooth_grid --compare results_old.json
+'''
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+from benchmarks.synthetic import RESOLUTIONS, synthetic_fields
+
+def prepare(resolution, seed=0):
+    # synthetic fields, smoothed like in the pipeline, and the fronts used by the clean up kernels
+    f = synthetic_fields(resolution, seed=seed)
+    lat, lon = f['lat'], f['lon']
+    smoothed = fd.smooth_grid(np.stack((f['theta'], f['u'], f['v'], f['prev_u'], f['prev_v'])), iter=10)
+    f['theta_s'], f['u_s'], f['v_s'], f['prev_u_s'], f['prev_v_s'] = smoothed
+    f['wf'] = fd.hewson_1998(lat, lon, f['theta_s'], f['u_s'], f['v_s'])['wf']
+    f['cf'] = fd.simmonds_et_al_2012(lat, lon, f['prev_u_s'], f['prev_v_s'], f['u_s'], f['v_s'])['cf']
+    # single precision copies, for the float32 kernels
+    for name in ('theta_s', 'u_s', 'v_s'):
+      f[name + '32'] = f[name].astype(np.float32)
+    return f
+
+# name -> function of the prepared fields
+KERNELS = {
+    'smooth_grid': lambda f: fd.smooth_grid(f['theta'], iter=10, center_weight=4),
+    'geo_gradient': lambda f: fd.geo_gradient(f['lat'], f['lon'], f['theta_s']),
+    'compute_dist_grids': lambda f: fd.compute_dist_grids(f['lat'], f['lon']),
+    'hewson_1998': lambda f: fd.hewson_1998(f['lat'], f['lon'], f['theta_s'], f['u_s'], f['v_s']),
+    'hewson_1998_float32': lambda f: fd.hewson_1998(f['lat'], f['lon'], f['theta_s32'], f['u_s32'], f['v_s32'], dtype=np.float32),
+    'simmonds_et_al_2012': lambda f: fd.simmonds_et_al_2012(f['lat'], f['lon'], f['prev_u_s'], f['prev_v_s'], f['u_s'], f['v_s']),
+    'mask_zero_contour': lambda f: fd.mask_zero_contour(f['lat'], f['lon'], f['u_s']),
+    'clean_fronts': lambda f: fd.clean_fronts(f['wf'], f['cf'], f['lon'], f['lat'], f['center_lon'][0], f['center_lat'][0]),
+    'clean_fronts_multi': lambda f: fd.clean_fronts_multi(f['wf'], f['cf'], f['lon'], f['lat'], f['center_lon'], f['center_lat']),
+    'expand_fronts': lambda f: fd.expand_fronts(np.where(f['cf'] > 0, -10., np.nan), 3),
+}
+
+def time_kernel(func, fields, min_time=1., min_repeats=3, max_repeats=50):
+    # repeats until min_time is spent (at least min_repeats times), after one warm up call
+    func(fields)
+    times = []
+    t_total = time.perf_counter()
+    while (len(times) < min_repeats) or ((time.perf_counter() - t_total < min_time) and (len(times) < max_repeats)):
+        t0 = time.perf_counter()
+        func(fields)
+        times.append(time.perf_counter() - t0)
+    return np.asarray(times)
+
+def peak_memory(func, fields):
+    # peak of the memory allocated during one call
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    func(fields)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - start
+
+def git_info():
+    repo = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    try:
+        commit = subprocess.check_output(['git', '-C', repo, 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+        dirty = bool(subprocess.check_output(['git', '-C', repo, 'status', '--porcelain', '--untracked-files=no'], stderr=subprocess.DEVNULL).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+def run(grids, kernels, min_time=1., memory=True, seed=0):
+    commit, dirty = git_info()
+    out = {
+        'meta': {
+            'date': dt.datetime.now().isoformat(),
+            'commit': commit,
+            'dirty': dirty,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+        },
+        'results': [],
+    }
+
+    for grid in grids:
+        fields = prepare(grid, seed=seed)
+        for name in kernels:
+            times = time_kernel(KERNELS[name], fields, min_time=min_time)
+            result = {
+                'kernel': name,
+                'grid': grid,
+                'shape': list(fields['lat'].shape),
+                'repeats': int(times.size),
+                'min': float(times.min()),
+                'median': float(np.median(times)),
+                'mean': float(times.mean()),
+                'peak_bytes': int(peak_memory(KERNELS[name], fields)) if (memory) else None,
+            }
+            out['results'].append(result)
+            print('%-20s %-10s %-12s min %9.4fs  median %9.4fs  peak %s'%(name, grid, 'x'.join(map(str, result['shape'])),
+                result['min'], result['median'], '%.1fMB'%(result['peak_bytes']/1e6) if (memory) else '-'))
+            sys.stdout.flush()
+
+    return out
+
+def compare(new, old):
+    # ratios of the median times and peak memory of the same kernel/grid
+    old_results = dict(((r['kernel'], r['grid']), r) for r in old['results'])
+    print('\ncompared to %s (%s)'%(old['meta'].get('commit'), old['meta'].get('date')))
+    for r in new['results']:
+        o = old_results.get((r['kernel'], r['grid']))
+        if (o is None):
+            continue
+        mem = ''
+        if (r['peak_bytes']) and (o['peak_bytes']):
+            mem = 'memory x%.2f'%(r['peak_bytes']/float(o['peak_bytes']))
+        print('%-20s %-10s time x%.2f (%.4fs -> %.4fs)  %s'%(r['kernel'], r['grid'], r['median']/o['median'], o['median'], r['median'], mem))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite of the front detection kernels on synthetic fields')
+    parser.add_argument('--grids', default=','.join(RESOLUTIONS), help='comma separated grids, of %s'%(', '.join(RESOLUTIONS)))
+    parser.add_argument('--kernels', default=','.join(KERNELS), help='comma separated kernels, of %s'%(', '.join(KERNELS)))
+    parser.add_argument('--min-time', type=float, default=1., help='minimum time spent timing each kernel (s)')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic fields')
+    parser.add_argument('--out', default=None, help='json file for the results')
+    parser.add_argument('--compare', default=None, help='json results of another run to compare with')
+    args = parser.parse_args()
+
+    grids = [g for g in args.grids.split(',') if g]
+    kernels = [k for k in args.kernels.split(',') if k]
+    for name in kernels:
+        if (name not in KERNELS):
+            parser.error('unknown kernel %s'%(name))
+    for grid in grids:
+        if (grid not in RESOLUTIONS):
+            parser.error('unknown grid %s'%(grid))
+
+    out = run(grids, kernels, min_time=args.min_time, memory=not args.no_memory, seed=args.seed)
+
+    if (args.out):
+        with open(args.out, 'w') as f:
+            json.dump(out, f, indent=2)
+    if (args.compare):
+        with open(args.compare, 'r') as f:
+            compare(out, json.load(f))
+
+if __name__ == '__main__':
+    main()
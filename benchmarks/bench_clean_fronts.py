@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+Benchmark of clean_fronts (labeled reductions) against the original loop version (clean_fronts_loop)
+on a global 0.5x0.625 grid with hundreds of front clusters, also checks both give the same front lists
+then clean_fronts_multi (all the cyclone centers of a time step at once, distance matrix and kd-tree)
+against calling clean_fronts for each center
+
+Usage: python benchmarks/bench_clean_fronts.py [num_clusters] [num_centers]
+'''
+import os
+import sys
+import time
+import numpy as np
+from scipy.ndimage import label
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+
+def synthetic_fronts(shape, num_clusters, seed=0):
+    # short random walks on the grid, roughly like front segments
+    rng = np.random.RandomState(seed)
+    fronts = np.zeros(shape)
+    for i in range(num_clusters):
+        r, c = rng.randint(0, shape[0]), rng.randint(0, shape[1])
+        for step in range(rng.randint(1, 15)):
+            fronts[r, c] = 1.
+            r = min(max(r + rng.randint(-1, 2), 0), shape[0]-1)
+            c = min(max(c + rng.randint(0, 2), 0), shape[1]-1)
+    return fronts
+
+def same_lists(a, b):
+    to_float = lambda x: [[float(v) for v in x[0]], [float(v) for v in x[1]]]
+    return [to_float(x) for x in a] == [to_float(x) for x in b]
+
+if __name__ == '__main__':
+    num_clusters = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_centers = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    lon, lat = np.meshgrid(np.arange(-180, 180, .625), np.arange(-90, 90.1, .5))
+    wf = synthetic_fronts(lat.shape, num_clusters, seed=1)
+    cf = synthetic_fronts(lat.shape, num_clusters, seed=2)
+    print('warm clusters %d, cold clusters %d'%(label(wf)[1], label(cf)[1]))
+
+    for cyc_center_lon, cyc_center_lat in [(-40., 45.), (150., 86.)]:
+        t0 = time.perf_counter()
+        wf_list, cf_list = fd.clean_fronts(wf, cf, lon, lat, cyc_center_lon, cyc_center_lat)
+        t_new = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        wf_loop, cf_loop = fd.clean_fronts_loop(wf, cf, lon, lat, cyc_center_lon, cyc_center_lat)
+        t_loop = time.perf_counter() - t0
+
+        print('center (%g, %g): vectorized %.4fs, loop %.4fs, speedup %.1fx, same lists %s (%d warm, %d cold)'
+            %(cyc_center_lon, cyc_center_lat, t_new, t_loop, t_loop/t_new,
+              same_lists(wf_list, wf_loop) and same_lists(cf_list, cf_loop), len(wf_list), len(cf_list)))
+
+    rng = np.random.RandomState(3)
+    center_lon = rng.uniform(-180, 180, num_centers)
+    center_lat = rng.uniform(-85, 85, num_centers)
+
+    t0 = time.perf_counter()
+    single = [fd.clean_fronts(wf, cf, lon, lat, c_lon, c_lat) for c_lon, c_lat in zip(center_lon, center_lat)]
+    t_single = time.perf_counter() - t0
+
+    for use_kdtree in (False, True):
+        t0 = time.perf_counter()
+        wf_lists, cf_lists = fd.clean_fronts_multi(wf, cf, lon, lat, center_lon, center_lat, use_kdtree=use_kdtree)
+        t_multi = time.perf_counter() - t0
+
+        same = all(same_lists(wf_lists[i], s[0]) and same_lists(cf_lists[i], s[1]) for i, s in enumerate(single))
+        print('%d centers, kdtree %s: multi %.4fs, per center %.4fs, speedup %.1fx, same lists %s'
+            %(num_centers, use_kdtree, t_multi, t_single, t_single/t_multi, same))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+'''
+Benchmark of expand_fronts (row spans for all the rows at once) against the original loop version (expand_fronts_loop)
+on global grids, also checks both expand the fronts the same way (the last columns are left without fronts,
+expand_fronts_loop fails on rows touching the first column with a front near the last one),
+then a batch of time steps in one call, and the periodic spans
+
+Usage: python benchmarks/bench_expand_fronts.py [num_pixels] [num_times]
+'''
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+
+def synthetic_fronts(shape, num_pixels, seed=0):
+    # cold front (-10) and warm front (10) points, no cold front on the last columns
+    rng = np.random.RandomState(seed)
+    fronts = np.full(shape, np.nan)
+    fronts[rng.rand(*shape) < .01] = -10.
+    fronts[rng.rand(*shape) < .01] = 10.
+    fronts[..., -(num_pixels+1):][fronts[..., -(num_pixels+1):] == -10] = np.nan
+    return fronts
+
+if __name__ == '__main__':
+    num_pixels = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    num_times = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    for grid, (dlat, dlon) in [('2.5', (2.5, 2.5)), ('0.5x0.625', (.5, .625)), ('0.25', (.25, .25))]:
+        shape = (int(round(180/dlat)) + 1, int(round(360/dlon)))
+        fronts = synthetic_fronts((num_times,) + shape, num_pixels)
+
+        t0 = time.perf_counter()
+        loop = [fd.expand_fronts_loop(f.copy(), num_pixels) for f in fronts]
+        t_loop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        new = [fd.expand_fronts(f.copy(), num_pixels) for f in fronts]
+        t_new = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        batch = fd.expand_fronts(fronts.copy(), num_pixels)
+        t_batch = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        periodic = fd.expand_fronts(fronts.copy(), num_pixels, periodic=True)
+        t_periodic = time.perf_counter() - t0
+
+        same = all(np.array_equal(a, b, equal_nan=True) for a, b in zip(loop, new)) and np.array_equal(np.stack(new), batch, equal_nan=True)
+        print('grid %-10s (%dx%d) x %d steps: loop %.4fs, vectorized %.4fs (%.1fx), batch %.4fs (%.1fx), periodic %.4fs, same fronts %s'
+            %(grid, shape[0], shape[1], num_times, t_loop, t_new, t_loop/t_new, t_batch, t_loop/t_batch, t_periodic, same))
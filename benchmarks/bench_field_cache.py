@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+'''
+Benchmark of the FieldCache on a k1/k2 sensitivity sweep of hewson_1998, on synthetic fields
+
+Without the cache every variant smooths theta, u, v and computes the hewson_1998 fields again,
+with the cache the first variant stores them and the others read them back memory mapped.
+Also checks that the fronts are the same, and that several instances on the same folder (the copies sent
+to the worker processes) keep it close to max_bytes.
+
+Usage: python benchmarks/bench_field_cache.py [grid] [num_steps] [num_variants]
+'''
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+from front_detection.cache import FieldCache
+from benchmarks.synthetic import synthetic_fields
+
+def sweep(raw, in_file, variants, cache=None):
+    # fronts of each (k1, k2) variant for all the time steps, smoothing and hewson_1998_fields done per variant
+    lat, lon = raw[0]['lat'], raw[0]['lon']
+    geometry = fd.get_grid_geometry(lat, lon)
+    params = {'smooth_iter': 10, 'center_weight': 4}
+    out = []
+    for k1, k2 in variants:
+      num_fronts = 0
+      for t_ind, f in enumerate(raw):
+        def smoothed():
+          return dict(zip(('theta', 'u', 'v'), fd.smooth_grid(np.stack((f['theta'], f['u'], f['v'])), iter=10)))
+        if (cache is None):
+          step = smoothed()
+          fields = fd.hewson_1998_fields(lat, lon, step['theta'], geometry=geometry)
+        else:
+          step = cache.get_many(dict((name, cache.key(in_file, t_ind, name, **params)) for name in ('theta', 'u', 'v')), smoothed)
+          step.update({'file': in_file, 't_step': t_ind, 'lat': lat, 'lon': lon, 'params': params})
+          fields = cache.hewson_fields(step, 'theta', geometry=geometry)
+        fronts = fd.hewson_1998_masks(fields, step['u'], step['v'], geometry, k1=k1, k2=k2)
+        num_fronts += int(np.nansum(fronts['wf']) + np.nansum(fronts['cf']))
+      out.append(num_fronts)
+    return out
+
+def check_shared(root, num_instances=4, max_bytes=4*2**20, num_puts=64, entry_size=2**16):
+    # copies of one cache writing in turn to the same folder, like the workers of run_climatology, the folder
+    # can only go over max_bytes by about one entry per instance. Entries written again are not counted twice
+    cache = FieldCache(root, max_bytes=max_bytes)
+    copies = [pickle.loads(pickle.dumps(cache)) for i in range(num_instances)]
+    data = np.zeros(entry_size//8)
+    largest = 0
+    for i in range(num_puts):
+      for c_ind, c in enumerate(copies):
+        c.put('entry_%d_%d'%(c_ind, i), data)
+        largest = max(largest, cache.size())
+    for i in range(num_puts):
+      cache.put('entry_again', data)
+    entry_bytes = os.path.getsize(cache._path('entry_again'))
+    print('%d instances, max_bytes %.1fMB: largest folder %.1fMB'%(num_instances, max_bytes/1e6, largest/1e6))
+    assert largest <= max_bytes + num_instances*entry_bytes, 'shared cache folder reached %d bytes'%(largest)
+    assert cache._bytes == cache.size(), 'entries written again counted %d bytes, %d on disk'%(cache._bytes, cache.size())
+
+if __name__ == '__main__':
+    grid = sys.argv[1] if len(sys.argv) > 1 else '0.5x0.625'
+    num_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    num_variants = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    raw = [synthetic_fields(grid, seed=seed) for seed in range(num_steps)]
+    variants = [(fd.HEWSON_K1*scale, fd.HEWSON_K2*scale) for scale in np.linspace(.8, 1.2, num_variants)]
+    print('grid %s (%dx%d), %d time steps, %d (k1, k2) variants'%(grid, raw[0]['lat'].shape[0], raw[0]['lat'].shape[1], num_steps, num_variants))
+
+    root = tempfile.mkdtemp(prefix='field_cache_')
+    try:
+      # the cache keys need an input file, the synthetic fields have none
+      in_file = os.path.join(root, 'input')
+      open(in_file, 'w').close()
+      cache = FieldCache(os.path.join(root, 'cache'))
+
+      t0 = time.perf_counter()
+      ref = sweep(raw, in_file, variants)
+      t_ref = time.perf_counter() - t0
+
+      t0 = time.perf_counter()
+      cold = sweep(raw, in_file, variants, cache=cache)
+      t_cold = time.perf_counter() - t0
+
+      t0 = time.perf_counter()
+      warm = sweep(raw, in_file, variants, cache=cache)
+      t_warm = time.perf_counter() - t0
+
+      print('no cache       %8.3fs'%(t_ref))
+      print('empty cache    %8.3fs  (%.1fx)'%(t_cold, t_ref/t_cold))
+      print('filled cache   %8.3fs  (%.1fx)'%(t_warm, t_ref/t_warm))
+      print('cache size %.1fMB, %d hits, %d misses, same fronts %s'%(cache.size()/1e6, cache.hits, cache.misses, ref == cold == warm))
+
+      check_shared(os.path.join(root, 'shared'))
+    finally:
+      shutil.rmtree(root)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+'''
+Float32 against float64 hewson_1998, on the synthetic fields of benchmarks/synthetic.py
+
+Validation: for several seeds and grids, the warm/cold front masks of the float32 path are compared with the
+float64 reference, raw and after filter_front_clusters: number of points of each, points in only one of them,
+and points of one with no point of the other within 1 grid cell. The rows next to the poles are reported
+apart (|lat| >= 80), the grid distances go to 0 there and the float64 masks pick up rounding noise. The run fails
+if the masks differ on more than 0.1% of the points away from the 2 rows next to each pole, or 0.1% have no match
+within 1 grid cell there.
+Benchmark: time and peak memory (tracemalloc) of both on the 0.25 degree grid.
+
+Usage: python benchmarks/bench_float32.py [num_seeds] [grids (comma separated)]
+'''
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.ndimage import binary_dilation
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+from benchmarks.synthetic import synthetic_fields
+
+POLAR_LAT = 80.
+# rows next to each pole where the float64 masks pick up rounding noise, and the fraction of the float64 points
+# that may differ away from them (flips of single points at the thresholds)
+POLE_ROWS = 2
+MAX_DIFF = 1e-3
+
+def smoothed_fields(resolution, seed):
+    f = synthetic_fields(resolution, seed=seed)
+    f['theta'], f['u'], f['v'] = fd.smooth_grid(np.stack((f['theta'], f['u'], f['v'])), iter=10)
+    return f
+
+def run_hewson(f, dtype):
+    return fd.hewson_1998(f['lat'], f['lon'], f['theta'].astype(dtype), f['u'].astype(dtype), f['v'].astype(dtype), dtype=dtype)
+
+def compare_masks(ref, new, sel):
+    # counts, points in only one of the masks, and points with no match within 1 cell (periodic in lon)
+    ref = (np.asarray(ref) > 0)
+    new = (np.asarray(new) > 0)
+    s = np.ones((3, 3), dtype=bool)
+    near_ref = binary_dilation(np.pad(ref, ((0, 0), (1, 1)), mode='wrap'), structure=s)[:, 1:-1]
+    near_new = binary_dilation(np.pad(new, ((0, 0), (1, 1)), mode='wrap'), structure=s)[:, 1:-1]
+    return {
+        'ref': int(ref[sel].sum()),
+        'new': int(new[sel].sum()),
+        'xor': int((ref ^ new)[sel].sum()),
+        'far': int((ref & ~near_new)[sel].sum() + (new & ~near_ref)[sel].sum()),
+    }
+
+def validate(grids, seeds):
+    print('%-10s %4s %-8s %-4s %-6s %7s %7s %6s %6s'%('grid', 'seed', 'stage', 'type', 'rows', 'float64', 'float32', 'xor', '>1cell'))
+    totals = {}
+    for grid in grids:
+      for seed in seeds:
+        f = smoothed_fields(grid, seed)
+        ref = run_hewson(f, np.double)
+        new = run_hewson(f, np.float32)
+        assert (new['wf'].dtype == bool) and (new['cf'].dtype == bool)
+
+        # the clean up of the pipeline, on the warm and cold fronts of hewson_1998
+        clean_ref = dict(zip(('wf', 'cf'), fd.filter_front_clusters(ref['wf'], ref['cf'])))
+        clean_new = dict(zip(('wf', 'cf'), fd.filter_front_clusters(new['wf'], new['cf'])))
+
+        polar = (np.abs(f['lat']) >= POLAR_LAT)
+        pole_rows = np.zeros(f['lat'].shape, dtype=bool)
+        pole_rows[:POLE_ROWS] = pole_rows[-POLE_ROWS:] = True
+        for stage, r, n in (('raw', ref, new), ('filtered', clean_ref, clean_new)):
+          for name in ('wf', 'cf'):
+            for rows, sel in (('mid', ~polar), ('polar', polar)):
+              stats = compare_masks(r[name], n[name], sel)
+              print('%-10s %4d %-8s %-4s %-6s %7d %7d %6d %6d'%(grid, seed, stage, name, rows,
+                  stats['ref'], stats['new'], stats['xor'], stats['far']))
+              key = (stage, rows)
+              total = totals.setdefault(key, dict.fromkeys(stats, 0))
+              for k in stats:
+                total[k] += stats[k]
+            stats = compare_masks(r[name], n[name], ~pole_rows)
+            total = totals.setdefault((stage, 'inner'), dict.fromkeys(stats, 0))
+            for k in stats:
+              total[k] += stats[k]
+
+    print('\ntotals')
+    for (stage, rows), total in sorted(totals.items()):
+      print('%-8s %-6s float64 %7d float32 %7d xor %6d (%.2f%% of the float64 points) >1 cell %6d'%(stage, rows,
+          total['ref'], total['new'], total['xor'], 100.*total['xor']/max(total['ref'], 1), total['far']))
+
+    # away from the rows next to the poles the float32 masks are the float64 ones, up to single points
+    for stage in ('raw', 'filtered'):
+      total = totals[(stage, 'inner')]
+      assert total['xor'] <= MAX_DIFF*total['ref'], '%s float32 masks differ on %d of %d points'%(stage, total['xor'], total['ref'])
+      assert total['far'] <= MAX_DIFF*total['ref'], '%s float32 masks have %d of %d points with no match within 1 cell'%(stage,
+          total['far'], total['ref'])
+
+def measure(func, repeats=3):
+    # best time of repeats calls, and the peak memory of one more call
+    times = []
+    for i in range(repeats):
+      t0 = time.perf_counter()
+      func()
+      times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    func()
+    peak_bytes = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return min(times), peak_bytes
+
+def benchmark(resolution='0.25'):
+    f = smoothed_fields(resolution, 0)
+    print('\nhewson_1998 on the %s grid (%dx%d)'%(resolution, f['lat'].shape[0], f['lat'].shape[1]))
+    geometry = fd.get_grid_geometry(f['lat'], f['lon'])
+    results = {}
+    for dtype in (np.double, np.float32):
+      theta, u, v = (f[name].astype(dtype) for name in ('theta', 'u', 'v'))
+      # the geometry distances of the dtype are cached on the first call
+      fd.hewson_1998(f['lat'], f['lon'], theta, u, v, geometry=geometry, dtype=dtype)
+      results[dtype] = measure(lambda: fd.hewson_1998(f['lat'], f['lon'], theta, u, v, geometry=geometry, dtype=dtype))
+      print('%-8s %8.3fs  peak %8.1fMB'%(np.dtype(dtype).name, results[dtype][0], results[dtype][1]/1e6))
+    print('float32: speedup %.2fx, memory /%.2f'%(results[np.double][0]/results[np.float32][0],
+        results[np.double][1]/float(results[np.float32][1])))
+
+if __name__ == '__main__':
+    num_seeds = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    grids = sys.argv[2].split(',') if len(sys.argv) > 2 else ['2', '0.5x0.625']
+    validate(grids, range(num_seeds))
+    benchmark('0.25')
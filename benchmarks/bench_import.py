@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+Import time and memory of the front_detection package, and the start up time of a pool of spawned workers
+
+Each import is timed in a fresh interpreter. 'eager' also imports what the package used to import
+at the top (matplotlib.pyplot, Basemap, netCDF4, pdb, glob), so it shows the previous cost.
+Basemap is skipped if it is not installed.
+The workers are started with the spawn context (a new interpreter each, like on macOS/Windows or with forkserver).
+
+Usage: python benchmarks/bench_import.py [repeats] [num_workers]
+'''
+import concurrent.futures as cf_futures
+import importlib
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+
+HEAVY = ('matplotlib', 'mpl_toolkits.basemap', 'netCDF4')
+
+def _installed(module):
+    try:
+      importlib.import_module(module)
+    except ImportError:
+      return False
+    return True
+
+# name -> modules imported, in order
+VARIANTS = {
+    'core': ['front_detection'],
+    'eager': ['matplotlib.pyplot', 'mpl_toolkits.basemap', 'netCDF4', 'pdb', 'glob', 'front_detection'],
+    'pipeline': ['front_detection.pipeline'],
+}
+
+_CHILD = '''
+import sys, time, resource
+sys.path.insert(0, %r)
+t0 = time.perf_counter()
+for module in %r:
+  __import__(module)
+elapsed = time.perf_counter() - t0
+heavy = [m for m in %r if m in sys.modules]
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(sys.modules), ','.join(heavy) or '-')
+'''
+
+def import_cost(modules, repeats=5):
+    # median import time (s), max rss (kB), number of modules and heavy modules loaded, in fresh interpreters
+    runs = []
+    for i in range(repeats):
+      out = subprocess.check_output([sys.executable, '-c', _CHILD%(REPO, modules, HEAVY)]).decode().split()
+      runs.append(out)
+    return np.median([float(r[0]) for r in runs]), np.median([int(r[1]) for r in runs]), int(runs[-1][2]), runs[-1][3]
+
+def _worker_init(modules):
+    for module in modules:
+      importlib.import_module(module)
+
+def _worker_ready(i):
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def spawn_cost(modules, num_workers):
+    # time until all the spawned workers have imported modules and run one task, and their mean max rss (kB)
+    t0 = time.perf_counter()
+    with cf_futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn'),
+        initializer=_worker_init, initargs=(modules,)) as executor:
+      rss = list(executor.map(_worker_ready, range(num_workers)))
+    return time.perf_counter() - t0, np.mean(rss)
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    variants = dict(VARIANTS)
+    if (not _installed('mpl_toolkits.basemap')):
+      print('Basemap is not installed, eager only imports matplotlib, netCDF4, pdb and glob')
+      variants['eager'] = [m for m in variants['eager'] if (m != 'mpl_toolkits.basemap')]
+
+    print('%-10s %10s %10s %8s  %s'%('import', 'time', 'max rss', 'modules', 'heavy modules loaded'))
+    results = {}
+    for name, modules in variants.items():
+      results[name] = import_cost(modules, repeats=repeats)
+      elapsed, rss, num_modules, heavy = results[name]
+      print('%-10s %9.3fs %8.1fMB %8d  %s'%(name, elapsed, rss/1e3, num_modules, heavy))
+    print('core vs eager: import %.1fx faster, %.1fMB less per process'%(results['eager'][0]/results['core'][0],
+        (results['eager'][1] - results['core'][1])/1e3))
+
+    print('\n%d spawned workers'%(num_workers))
+    for name in ('core', 'eager'):
+      elapsed, rss = spawn_cost(variants[name], num_workers)
+      print('%-10s ready in %6.3fs, %8.1fMB max rss per worker'%(name, elapsed, rss/1e3))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''
+Benchmark of the five point mean axis and eq6 divergence of hewson_1998_fields, MeanAxisStencil (fused stencil on
+neighbour views) against the original version with the 5 layer stacks (mean_axis_divergence_stacked),
+time and peak memory (tracemalloc) on synthetic fields, then the trig free MeanAxisStencil (no arctan, cos, sin),
+also checks eq6 is the same and the trig free terms are within rounding (fails the run otherwise)
+
+Usage: python benchmarks/bench_mean_axis.py [grid] [num_times]
+'''
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+from benchmarks.synthetic import synthetic_fields
+
+def five_point_sum(stencil, arr):
+    # sum of arr over the center and its 4 neighbours (nans as 0)
+    zeroed = np.where(np.isnan(arr), 0, arr).astype(stencil.dtype)
+    return stencil._add_neighbours(zeroed, np.copy(zeroed))
+
+def scaled_diff(a, b, scale, where=True):
+    ok = np.isfinite(a) & np.isfinite(b) & (scale > 0) & where
+    return np.max(np.abs(a[ok] - b[ok])/scale[ok]) if ok.any() else 0.
+
+def check_trig_free(stencil, out, free, mu_x, mu_y, distX, distY):
+    # differences scaled by the size of the terms they come from: sum of |mu| over the 5 points (S), over 2 grid lengths
+    # for eq6, the largest D_mean for D_mean. beta_mean and eq6 are left out where sumq is within rounding of 0 (beta_mean
+    # near 0 or pi, same axis but the resolved vectors, and eq6, change sign). Where |mu| overflows (float32, polar rows)
+    # the terms with angles are inf and eq6 nan, the trig free ones stay finite
+    eps = np.finfo(stencil.dtype).eps
+    S = five_point_sum(stencil, fd.norm(mu_x, mu_y))
+    conditioned = np.abs(out['sumq']) > 64*eps*S
+    overflow = five_point_sum(stencil, (~np.isfinite(out['sump'])).astype(stencil.dtype)) > 0
+    D_max = np.nanmax(out['D_mean'][np.isfinite(out['D_mean'])])
+    diff = {
+        'sump': scaled_diff(out['sump'], free['sump'], S),
+        'sumq': scaled_diff(out['sumq'], free['sumq'], S),
+        'D_mean': scaled_diff(out['D_mean'], free['D_mean'], np.full(S.shape, D_max)),
+        'eq6': scaled_diff(out['eq6'], free['eq6'], 100*five_point_sum(stencil, S)/(2*np.minimum(distX, distY)), where=conditioned),
+        'cos_beta': scaled_diff(out['cos_beta'], free['cos_beta'], np.ones(S.shape), where=conditioned),
+        'sin_beta': scaled_diff(out['sin_beta'], free['sin_beta'], np.ones(S.shape), where=conditioned),
+    }
+    for key in ('sump', 'sumq', 'D_mean', 'eq6'):
+      assert diff[key] < 256*eps, 'trig free %s differs by %.1e'%(key, diff[key])
+    for key in ('cos_beta', 'sin_beta'):
+      assert diff[key] < 4096*eps, 'trig free %s differs by %.1e'%(key, diff[key])
+    nan_diff = (np.isnan(out['eq6']) != np.isnan(free['eq6']))
+    assert not (nan_diff & ~overflow).any(), 'trig free eq6 nan on %d points without overflow'%((nan_diff & ~overflow).sum())
+    diff['left_out'] = 1. - conditioned.mean()
+    diff['nan_diff'] = int(nan_diff.sum())
+    diff['overflow'] = int((~np.isfinite(out['sump'])).sum())
+    return diff
+
+def measure(func, repeats=3):
+    # best time of repeats calls, and the peak memory of one more call
+    times = []
+    for i in range(repeats):
+      t0 = time.perf_counter()
+      out = func()
+      times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    func()
+    peak_bytes = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return out, min(times), peak_bytes
+
+if __name__ == '__main__':
+    grid = sys.argv[1] if len(sys.argv) > 1 else '0.25'
+    num_times = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    theta = []
+    for seed in range(num_times):
+      f = synthetic_fields(grid, seed=seed)
+      theta.append(fd.smooth_grid(f['theta'], iter=10))
+    lat, lon = f['lat'], f['lon']
+    theta = np.stack(theta) if (num_times > 1) else theta[0]
+    geometry = fd.get_grid_geometry(lat, lon)
+    print('grid %s (%dx%d), %d time steps'%(grid, lat.shape[0], lat.shape[1], num_times))
+
+    for dtype in (np.double, np.float32):
+      fields = fd.hewson_1998_fields(lat, lon, theta, geometry=geometry, dtype=dtype)
+      mu_x, mu_y = fields['mu_x'], fields['mu_y']
+      distX, distY = geometry.distances(dtype)[:2]
+      stencil = fd.MeanAxisStencil(mu_x.shape, periodic=geometry.periodic, dtype=dtype)
+
+      ref, t_ref, m_ref = measure(lambda: fd.mean_axis_divergence_stacked(mu_x, mu_y, distX, distY, periodic=geometry.periodic, dtype=dtype))
+      out, t_new, m_new = measure(lambda: stencil.compute(mu_x, mu_y, distX, distY))
+
+      same = np.array_equal(ref['eq6'], out['eq6'], equal_nan=True)
+      name = np.dtype(dtype).name
+      print('%-8s stacked %8.3fs  peak %8.1fMB'%(name, t_ref, m_ref/1e6))
+      print('%-8s stencil %8.3fs  peak %8.1fMB  speedup %.2fx  memory /%.1f  same eq6 %s'%(name, t_new, m_new/1e6,
+          t_ref/t_new, m_ref/float(max(m_new, 1)), same))
+      assert same, 'MeanAxisStencil eq6 differs from mean_axis_divergence_stacked'
+
+      out = dict((key, np.copy(value)) for key, value in out.items())
+      trig_free = fd.MeanAxisStencil(mu_x.shape, periodic=geometry.periodic, dtype=dtype, trig_free=True)
+      free, t_free, m_free = measure(lambda: trig_free.compute(mu_x, mu_y, distX, distY))
+      print('%-8s trig free %6.3fs  peak %8.1fMB  speedup %.2fx (stacked), %.2fx (stencil)'%(name, t_free, m_free/1e6, t_ref/t_free, t_new/t_free))
+
+      diff = check_trig_free(stencil, out, free, mu_x, mu_y, distX, distY)
+      print('%-8s trig free vs stencil: max scaled diff sump %.1e, sumq %.1e, D_mean %.1e, eq6 %.1e'%(name,
+          diff['sump'], diff['sumq'], diff['D_mean'], diff['eq6']))
+      print('%-8s   cos, sin beta_mean %.1e, %.1e (%.2f%% of the points within rounding of sumq = 0 left out),'
+          ' eq6 nan on %d points less (%d points with |mu| overflowing)'%(name, diff['cos_beta'], diff['sin_beta'],
+          100.*diff['left_out'], diff['nan_diff'], diff['overflow']))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+'''
+Benchmark of smooth_grid (GridSmoother) against the original loop version (smooth_grid_loop)
+also checks that both give the same values, bit for bit
+
+Usage: python benchmarks/bench_smooth_grid.py [num_repeats]
+'''
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+
+def time_it(func, *args, repeats=3, **kwargs):
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        out = func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return out, min(times)
+
+def loop_fields(fields, **kwargs):
+    return np.stack([fd.smooth_grid_loop(field, **kwargs) for field in fields])
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    rng = np.random.RandomState(0)
+    for res_lat, res_lon in [(2., 2.5), (.5, .625)]:
+        lon, lat = np.meshgrid(np.arange(-180, 180, res_lon), np.arange(-90, 90.1, res_lat))
+
+        # the five fields smoothed per time step in example.py (u, v, previous u, v, theta850, theta1km)
+        fields = 280. + 10*rng.randn(5, *lat.shape)
+        fields[rng.rand(*fields.shape) < .01] = np.nan
+
+        out_new, t_new = time_it(fd.smooth_grid, fields, iter=10, center_weight=4, repeats=repeats)
+        out_old, t_old = time_it(loop_fields, fields, iter=10, center_weight=4, repeats=repeats)
+        same = np.array_equal(out_new, out_old, equal_nan=True)
+
+        print('grid %gx%g, 5 fields x 10 iterations: batched %.4fs, loop %.4fs, speedup %.1fx, identical %s'
+            %(res_lat, res_lon, t_new, t_old, t_old/t_new, same))
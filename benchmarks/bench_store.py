@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''
+Benchmark of the chunked FrontArrayStore, on synthetic fronts and diagnostics of a global grid:
+writing the days from worker processes at the same time (each day has its own chunks, no locks),
+size on disk, and reading a spatial/temporal subset (only the chunks it overlaps) against reading everything,
+also checks the data read back is the data written
+
+Usage: python benchmarks/bench_store.py [grid] [num_days] [num_workers]
+'''
+import concurrent.futures as cf_futures
+import datetime as dt
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from front_detection.store import FrontArrayStore
+from benchmarks.synthetic import RESOLUTIONS, grid as make_grid
+
+START_DATE = dt.date(2007, 1, 1)
+STEPS_PER_DAY = 4
+DIAGNOSTICS = ('m1', 'eq7')
+
+def synthetic_day(i_day, shape):
+    # fronts on about 2% of the points (in short zonal runs, so they compress like real fronts) and smooth diagnostics
+    rng = np.random.RandomState(i_day)
+    result = {'date': START_DATE + dt.timedelta(days=i_day), 'steps': np.arange(STEPS_PER_DAY)}
+    for name in ('wf', 'cf'):
+      starts = rng.rand(STEPS_PER_DAY, *shape) < .004
+      result[name] = np.uint8(starts | np.roll(starts, 1, axis=-1) | np.roll(starts, 2, axis=-1) | np.roll(starts, 3, axis=-1))
+    lon = np.linspace(0, 2*np.pi, shape[1])
+    for k, name in enumerate(DIAGNOSTICS):
+      phase = rng.uniform(0, 2*np.pi, (STEPS_PER_DAY, 1, 1))
+      result[name] = np.float32(np.sin(lon*(k+2) + phase) * np.linspace(-1, 1, shape[0])[:, None])
+    return result
+
+def write_days(root, days, shape):
+    # what a pipeline worker does, the store is opened (not created) in the worker
+    store = FrontArrayStore(root)
+    for i_day in days:
+      store.write(synthetic_day(i_day, shape))
+    return len(days)
+
+def disk_size(root):
+    return sum(os.path.getsize(os.path.join(dir_path, name)) for dir_path, dir_names, file_names in os.walk(root) for name in file_names)
+
+if __name__ == '__main__':
+    grid = sys.argv[1] if len(sys.argv) > 1 else '0.5x0.625'
+    num_days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    num_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    lat, lon = make_grid(*RESOLUTIONS[grid])
+    lat, lon = lat[:, 0], lon[0, :]
+    shape = (lat.size, lon.size)
+    end_date = START_DATE + dt.timedelta(days=num_days-1)
+    print('grid %s (%dx%d), %d days of %d steps, wf, cf and %s'%(grid, shape[0], shape[1], num_days, STEPS_PER_DAY, ', '.join(DIAGNOSTICS)))
+
+    tmp_dir = tempfile.mkdtemp(prefix='front_store_')
+    try:
+      for workers in (1, num_workers):
+        root = os.path.join(tmp_dir, 'fronts_%d.zarr'%(workers))
+        FrontArrayStore(root, START_DATE, end_date, lat, lon, steps_per_day=STEPS_PER_DAY, diagnostics=DIAGNOSTICS)
+        t0 = time.perf_counter()
+        with cf_futures.ProcessPoolExecutor(max_workers=workers) as executor:
+          # interleaved days, so the workers write next to each other
+          list(executor.map(write_days, [root]*workers, [range(i, num_days, workers) for i in range(workers)], [shape]*workers))
+        elapsed = time.perf_counter() - t0
+        store = FrontArrayStore(root)
+        print('%d worker(s): written in %.2fs (%.3fs per day), %d days done'%(workers, elapsed, elapsed/num_days, len(store.done_dates())))
+
+      raw = num_days*STEPS_PER_DAY*shape[0]*shape[1]*(2 + 4*len(DIAGNOSTICS))
+      print('size on disk %.1fMB, uncompressed %.1fMB'%(disk_size(root)/1e6, raw/1e6))
+
+      t0 = time.perf_counter()
+      full = store['cf'][:]
+      t_full = time.perf_counter() - t0
+      t0 = time.perf_counter()
+      sub = store.read('cf', START_DATE + dt.timedelta(days=2), START_DATE + dt.timedelta(days=8), lat_range=(20, 60), lon_range=(-100, 0))
+      t_sub = time.perf_counter() - t0
+
+      ref = np.stack([synthetic_day(i_day, shape)['cf'] for i_day in range(num_days)]).reshape(full.shape)
+      lat_ind = np.where((lat >= 20) & (lat <= 60))[0]
+      lon_ind = np.where((lon >= -100) & (lon <= 0))[0]
+      same = np.array_equal(full, ref) and np.array_equal(sub['cf'], full[2*STEPS_PER_DAY:9*STEPS_PER_DAY, lat_ind][:, :, lon_ind])
+      same &= all(np.array_equal(store[name][:].reshape(-1, *shape)[5], synthetic_day(1, shape)[name][1]) for name in DIAGNOSTICS)
+      print('read all cf %.3fs, a week over (20, 60)N (100, 0)W %.4fs (%.0fx), same data %s'%(t_full, t_sub, t_full/t_sub, same))
+    finally:
+      shutil.rmtree(tmp_dir)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''
+Benchmark of hewson_1998_sweep (all the (k1, k2) pairs in one pass) against one hewson_1998 call per pair,
+on synthetic fields, also checks both give the same fronts for every pair
+
+Usage: python benchmarks/bench_sweep.py [grid] [num_k1] [num_k2]
+'''
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+from benchmarks.synthetic import synthetic_fields
+
+if __name__ == '__main__':
+    grid = sys.argv[1] if len(sys.argv) > 1 else '0.5x0.625'
+    num_k1 = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    num_k2 = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    f = synthetic_fields(grid)
+    lat, lon = f['lat'], f['lon']
+    theta, u, v = fd.smooth_grid(np.stack((f['theta'], f['u'], f['v'])), iter=10)
+    geometry = fd.get_grid_geometry(lat, lon)
+    k1_values = np.linspace(.5, 1.5, num_k1) * fd.HEWSON_K1
+    k2_values = np.linspace(.5, 1.5, num_k2) * fd.HEWSON_K2
+    print('grid %s (%dx%d), %dx%d (k1, k2) pairs'%(grid, lat.shape[0], lat.shape[1], num_k1, num_k2))
+
+    t0 = time.perf_counter()
+    sweep = fd.hewson_1998_sweep(lat, lon, theta, u, v, k1_values, k2_values, geometry=geometry)
+    t_sweep = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    sweep_masks = fd.hewson_1998_sweep(lat, lon, theta, u, v, k1_values, k2_values, geometry=geometry, masks=True)
+    t_masks = time.perf_counter() - t0
+
+    same = True
+    t0 = time.perf_counter()
+    for i, k1 in enumerate(k1_values):
+      for j, k2 in enumerate(k2_values):
+        fronts = fd.hewson_1998(lat, lon, theta, u, v, geometry=geometry, k1=k1, k2=k2)
+        for name in ('wf', 'cf'):
+          mask = (fronts[name] > 0)
+          same &= np.array_equal(mask, sweep_masks[name][i, j]) and (mask.sum() == sweep[name + '_count'][i, j])
+    t_loop = time.perf_counter() - t0
+
+    print('one hewson_1998 per pair %8.3fs'%(t_loop))
+    print('hewson_1998_sweep        %8.3fs  (%.1fx)'%(t_sweep, t_loop/t_sweep))
+    print('with the masks           %8.3fs  (%.1fx)'%(t_masks, t_loop/t_masks))
+    print('same fronts for all the pairs %s'%(same))
+    print('\nwarm front points (k1 rows, k2 columns)')
+    print('        ' + ' '.join('%7.2f'%(k2) for k2 in k2_values))
+    for i, k1 in enumerate(k1_values):
+      print('%7.3f ' %(k1) + ' '.join('%7d'%(count) for count in sweep['wf_count'][i]))
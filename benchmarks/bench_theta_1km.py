@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+'''
+Benchmark of temp_pres_at_height (1km T/p/theta) against the masked array version from example.py
+on a global 0.5x0.625 grid with the MERRA-2 levels from 1000 to 400 hPa, time and peak memory (tracemalloc),
+also checks both give the same theta1km, and runs a batch of time steps in one call
+
+Usage: python benchmarks/bench_theta_1km.py [num_times]
+'''
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+
+def theta_1km_masked(H, T, lev):
+    # the original example.py code, (lev, lat, lon) only
+    H1km_diff = np.abs(H - 1000.)
+    min_val = np.broadcast_to(np.nanmin(H1km_diff, axis=0), H.shape)
+    idx = (H1km_diff == min_val)
+    T_3d = np.ma.masked_array(T, mask=~idx, fill_value=np.nan)
+    t1km = np.nanmin(T_3d.filled(), axis=0)
+    pres = np.repeat(lev[:, np.newaxis], H.shape[1], axis=-1)
+    pres = np.repeat(pres[:, :, np.newaxis], H.shape[2], axis=-1)
+    pres = np.ma.masked_array(pres, mask=~idx, fill_value=np.nan)
+    p1km = np.nanmin(pres, axis=0)
+    return fd.theta_from_temp_pres(t1km, p1km)
+
+def synthetic_levels(shape, num_times, seed=0):
+    # heights roughly following the standard atmosphere, with surface pressure/topography so some levels are nan
+    rng = np.random.RandomState(seed)
+    lev = np.asarray([1000, 975, 950, 925, 900, 875, 850, 825, 800, 775, 750, 725, 700, 650, 600, 550, 500, 450, 400.])
+    z = 44330.*(1 - (lev/1013.25)**0.1903)
+    H = z[None, :, None, None] + rng.uniform(-300, 300, (num_times, 1) + shape)
+    T = 288. - 0.0065*H + rng.uniform(-10, 10, (num_times, 1) + shape)
+    below_ground = (lev[None, :, None, None] > rng.uniform(600, 1050, (num_times, 1) + shape))
+    H[below_ground] = np.nan
+    T[below_ground] = np.nan
+    return H, T, lev
+
+def peak(func, *args, **kwargs):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak_bytes
+
+if __name__ == '__main__':
+    num_times = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    shape = (361, 576)
+    H, T, lev = synthetic_levels(shape, num_times)
+    print('grid %dx%d, %d levels, %d time steps'%(shape[0], shape[1], lev.size, num_times))
+
+    ref, t_ref, m_ref = peak(theta_1km_masked, H[0], T[0], lev)
+    new, t_new, m_new = peak(fd.temp_pres_at_height, H[0], T[0], lev)
+    same = np.array_equal(ref, new['theta1km'], equal_nan=True)
+    print('one step: masked %.4fs %.1fMB, take_along_axis %.4fs %.1fMB, speedup %.1fx, memory /%.1f, same theta1km %s'
+        %(t_ref, m_ref/1e6, t_new, m_new/1e6, t_ref/t_new, m_ref/float(m_new), same))
+
+    batch, t_batch, m_batch = peak(fd.temp_pres_at_height, H, T, lev)
+    same = all(np.array_equal(theta_1km_masked(H[i], T[i], lev), batch['theta1km'][i], equal_nan=True) for i in range(num_times))
+    print('batch of %d: %.4fs %.1fMB, same theta1km %s'%(num_times, t_batch, m_batch/1e6, same))
+
+    interp, t_interp, m_interp = peak(fd.temp_pres_at_height, H, T, lev, interpolate=True)
+    print('batch of %d interpolated: %.4fs %.1fMB, mean |theta interp - closest| %.3fK'
+        %(num_times, t_interp, m_interp/1e6, np.nanmean(np.abs(interp['theta1km'] - batch['theta1km']))))
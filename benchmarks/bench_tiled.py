@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+'''
+Benchmark of hewson_1998_tiled (latitude bands on a thread pool) against hewson_1998 on the whole grid,
+time and peak memory (tracemalloc) for several numbers of worker threads, on synthetic fields,
+also checks the stitched fronts are the same as the global ones
+
+Usage: python benchmarks/bench_tiled.py [grid] [workers (comma separated)] [num_tiles]
+'''
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+from benchmarks.synthetic import synthetic_fields
+
+def measure(func, repeats=3):
+    # best time of repeats calls, and the peak memory of one more call
+    times = []
+    for i in range(repeats):
+      t0 = time.perf_counter()
+      out = func()
+      times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    func()
+    peak_bytes = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return out, min(times), peak_bytes
+
+if __name__ == '__main__':
+    grid = sys.argv[1] if len(sys.argv) > 1 else '0.25'
+    cpus = os.cpu_count() or 1
+    workers = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else sorted(set([1, 2, 4, cpus]))
+    num_tiles = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    f = synthetic_fields(grid)
+    lat, lon = f['lat'], f['lon']
+    theta, u, v = fd.smooth_grid(np.stack((f['theta'], f['u'], f['v'])), iter=10)
+    geometry = fd.get_grid_geometry(lat, lon)
+    tiles = fd.GridTiles(lat, lon, num_tiles=num_tiles)
+    print('grid %s (%dx%d), %d bands of about %d rows (+%d halo rows each side), %d cpus'%(grid, lat.shape[0], lat.shape[1],
+        len(tiles), lat.shape[0]//len(tiles), tiles.halo, cpus))
+
+    ref, t_ref, m_ref = measure(lambda: fd.hewson_1998(lat, lon, theta, u, v, geometry=geometry))
+    print('%-22s %8.3fs  peak %8.1fMB'%('hewson_1998', t_ref, m_ref/1e6))
+
+    for num_workers in workers:
+      out, t_tile, m_tile = measure(lambda: fd.hewson_1998_tiled(tiles, theta, u, v, num_workers=num_workers))
+      same = all(np.array_equal(ref[name], out[name], equal_nan=True) for name in ('wf', 'cf'))
+      print('%-22s %8.3fs  peak %8.1fMB  speedup %.2fx  memory /%.1f  same fronts %s'%('tiled, %d workers'%(num_workers),
+          t_tile, m_tile/1e6, t_ref/t_tile, m_ref/float(m_tile), same))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+Benchmark of FrontTracker on a sequence of synthetic time steps (the hewson_1998 fronts of the synthetic fields,
+moved east by one grid column per time step, without the rows next to the poles), time per step,
+peak memory (tracemalloc, stays flat with the number of time steps) and candidate pairs of the ClusterIndex
+against all the pairs of clusters
+
+Usage: python benchmarks/bench_tracking.py [grid] [num_steps]
+'''
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import front_detection as fd
+from front_detection import tracking
+from benchmarks.synthetic import synthetic_fields
+
+if __name__ == '__main__':
+    grid = sys.argv[1] if len(sys.argv) > 1 else '0.5x0.625'
+    num_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    f = synthetic_fields(grid)
+    lat, lon = f['lat'], f['lon']
+    theta, u, v = fd.smooth_grid(np.stack((f['theta'], f['u'], f['v'])), iter=10)
+    fronts = fd.hewson_1998(lat, lon, theta, u, v)
+    # (the many small clusters hewson_1998 finds on the polar rows are left out, see benchmarks/synthetic.py)
+    for name in ('wf', 'cf'):
+      fronts[name] = (fronts[name] > 0) & (np.abs(lat) < 80)
+    print('grid %s (%dx%d), %d time steps'%(grid, lat.shape[0], lat.shape[1], num_steps))
+
+    out_file = os.path.join(tempfile.mkdtemp(prefix='tracks_'), 'tracks.csv')
+    tracker = tracking.FrontTracker(lat, lon, out_file=out_file)
+    date = dt.datetime(2007, 1, 1)
+    num_candidates = num_pairs = 0
+    peaks = []
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for t_ind in range(num_steps):
+      step = dict((name, np.roll(fronts[name], t_ind, axis=1)) for name in ('wf', 'cf'))
+      prev_state = dict(tracker.state)
+      tracker.update(date + dt.timedelta(hours=6*t_ind), step)
+      for name, state in prev_state.items():
+        clusters = tracker.state[name]['clusters']
+        num_candidates += state['index'].candidates(clusters, max_dist=tracker.max_dist, margin=tracker.margin, cell_km=tracker.cell_km)[0].size
+        num_pairs += state['clusters']['num']*clusters['num']
+      peaks.append(tracemalloc.get_traced_memory()[1])
+    elapsed = time.perf_counter() - t0
+    tracemalloc.stop()
+    tracker.close()
+
+    print('%.4fs per time step, peak memory %.1fMB after %d steps, %.1fMB after %d steps'%(elapsed/num_steps,
+        peaks[num_steps//4]/1e6, num_steps//4 + 1, peaks[-1]/1e6, num_steps))
+    print('candidate pairs %d of %d (%.1f%%)'%(num_candidates, num_pairs, 100.*num_candidates/max(num_pairs, 1)))
+    print('%d tracks written to %s'%(tracker.num_finished, out_file))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+'''
+Benchmark of the native zero contour rasterizer (mask_zero_contour) against
+the original matplotlib contour version (mask_zero_contour_mpl)
+
+Usage: python benchmarks/bench_zero_contour.py [num_repeats]
+'''
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import matplotlib
+matplotlib.use('Agg')
+import front_detection as fd
+
+def synthetic_field(latGrid, lonGrid, seed=0):
+    # smooth wave pattern with some noise and missing values, similar to the eq7 field
+    rng = np.random.RandomState(seed)
+    data = np.sin(np.deg2rad(latGrid)*6) * np.cos(np.deg2rad(lonGrid)*4) + .3*rng.randn(*latGrid.shape)
+    data[rng.rand(*latGrid.shape) < .02] = np.nan
+    return data
+
+def time_it(func, *args, repeats=3):
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        out = func(*args)
+        times.append(time.perf_counter() - t0)
+    return out, min(times)
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    for res_lat, res_lon in [(2., 2.5), (.5, .625)]:
+        lon, lat = np.meshgrid(np.arange(-180, 180, res_lon), np.arange(-90, 90.1, res_lat))
+        data = synthetic_field(lat, lon)
+
+        zc_native, t_native = time_it(fd.mask_zero_contour, lat, lon, data, repeats=repeats)
+        zc_mpl, t_mpl = time_it(fd.mask_zero_contour_mpl, lat, lon, data, repeats=repeats)
+        num_diff = int(np.sum(zc_native != zc_mpl))
+
+        print('grid %gx%g %s: native %.4fs, matplotlib %.4fs, speedup %.1fx, cells differing %d'
+            %(res_lat, res_lon, str(lat.shape), t_native, t_mpl, t_mpl/t_native, num_diff))
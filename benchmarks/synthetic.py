@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+'''
+Synthetic global fields with known frontal zones, for the benchmarks (no input files needed)
+
+theta is a meridional gradient plus sharp tanh steps across a set of front lines (great circle arcs),
+u, v are the winds of a few cyclones (gaussian vortices) on a westerly flow, and the previous time step
+winds are the same cyclones moved to the west, so simmonds_et_al_2012 finds wind shifts.
+Everything is reproducible from the seed.
+(hewson_1998 also finds fronts on the rows next to the poles, where the grid distances go to 0,
+as it does with the analyses)
+'''
+import numpy as np
+
+# name -> (dlat, dlon) of the benchmark grids
+RESOLUTIONS = {
+    '2': (2., 2.),
+    '0.5x0.625': (.5, .625),
+    '0.25': (.25, .25),
+}
+
+def grid(dlat, dlon):
+    lon, lat = np.meshgrid(np.arange(-180, 180, dlon), np.arange(-90, 90 + dlat/2., dlat))
+    return lat, lon
+
+def _lon_diff(lon, lon0):
+    # longitude difference wrapped to [-180, 180)
+    return (lon - lon0 + 180.) % 360. - 180.
+
+def synthetic_fields(resolution='2', num_cyclones=6, seed=0):
+    ''' returns a dict with the lat, lon grids, theta, u, v, prev_u, prev_v (lat, lon) fields,
+    front (mask of the grid cells on the front lines), and the cyclone center lat, lon '''
+
+    dlat, dlon = RESOLUTIONS.get(resolution, resolution) if isinstance(resolution, str) else resolution
+    lat, lon = grid(dlat, dlon)
+    rng = np.random.RandomState(seed)
+
+    # cyclones in the mid latitudes of both hemispheres
+    c_lat = rng.uniform(35, 65, num_cyclones) * np.where(np.arange(num_cyclones) % 2 == 0, 1, -1)
+    c_lon = rng.uniform(-180, 180, num_cyclones)
+
+    # background: warm tropics, cold poles
+    theta = 300. - 40.*np.sin(np.deg2rad(lat))**2
+    front = np.zeros(lat.shape, dtype=bool)
+    u = 10.*np.cos(np.deg2rad(lat))**2
+    v = np.zeros(lat.shape)
+    prev_u = np.copy(u)
+    prev_v = np.copy(v)
+
+    width = 2. # deg, width of the frontal zones
+    for i in range(num_cyclones):
+      hemis = np.sign(c_lat[i])
+
+      # cold front to the south(north)-west, warm front to the east of each cyclone
+      for angle, length, step in ((-120., 20., 16.), (10., 15., 12.)):
+        ang = np.deg2rad(angle)
+        # distance (deg) from the front line, and position along it
+        x = _lon_diff(lon, c_lon[i])*np.cos(np.deg2rad(c_lat[i]))
+        y = (lat - c_lat[i])*hemis
+        along = x*np.cos(ang) + y*np.sin(ang)
+        across = -x*np.sin(ang) + y*np.cos(ang)
+        on_line = (along > 0) & (along < length)
+        # the step fades away from the line, so the frontal zone is local
+        taper = np.clip(1 - np.abs(along - length/2.)/(length/2.), 0, 1) * np.exp(-.5*(across/(4*width))**2)
+        theta += step*np.tanh(-across/width)*taper*on_line
+        front |= on_line & (np.abs(across) < max(dlat, dlon))
+
+      # cyclonic vortex now and 6 hours before (moved 5 degrees to the west)
+      for lon0, uu, vv in ((c_lon[i], u, v), (c_lon[i] - 5., prev_u, prev_v)):
+        dx = _lon_diff(lon, lon0)*np.cos(np.deg2rad(lat))
+        dy = lat - c_lat[i]
+        w = 25.*np.exp(-(dx**2 + dy**2)/(2*8.**2))
+        uu += -hemis*w*dy/8.
+        vv += hemis*w*dx/8.
+
+    # small scale noise, so the fields are not too smooth
+    # (going to 0 at the poles, where the grid distances are 0, like the smooth polar rows of the analyses)
+    taper = np.cos(np.deg2rad(lat))**2
+    theta += rng.normal(0, .2, lat.shape)*taper
+    u += rng.normal(0, .5, lat.shape)*taper
+    v += rng.normal(0, .5, lat.shape)*taper
+    prev_u += rng.normal(0, .5, lat.shape)*taper
+    prev_v += rng.normal(0, .5, lat.shape)*taper
+
+    return {
+      'lat': lat,
+      'lon': lon,
+      'theta': theta,
+      'u': u,
+      'v': v,
+      'prev_u': prev_u,
+      'prev_v': prev_v,
+      'front': front,
+      'center_lat': c_lat,
+      'center_lon': c_lon,
+    }
@@ -2,6 +2,7 @@
 import numpy as np 
 import front_detection as fd
 from front_detection import catherine
+from front_detection import reader
 from scipy.ndimage import label, generate_binary_structure
 import glob
 from netCDF4 import Dataset
@@ -35,30 +36,23 @@ slv_id.close()
 
 
 # loading in merra2 inst6_3d_ana_Np data
-ncid = Dataset('/localdrive/drive10/merra2/inst6_3d_ana_Np/MERRA2_300.inst6_3d_ana_Np.20070101.nc4', 'r')
+in_file = '/localdrive/drive10/merra2/inst6_3d_ana_Np/MERRA2_300.inst6_3d_ana_Np.20070101.nc4'
+ncid = Dataset(in_file, 'r')
 ncid.set_auto_mask(False)
-in_lon = ncid.variables['lon'][:]
-in_lat = ncid.variables['lat'][:]
-in_lev = ncid.variables['lev'][:]
-in_time = np.asarray(ncid.variables['time'][:], dtype=float)
-
 in_slp = ncid.variables['SLP']
-T = ncid.variables['T']
-U = ncid.variables['U']
-V = ncid.variables['V']
-geoH = ncid.variables['H']
-
-# creating the cdt grid 
-lon, lat = np.meshgrid(in_lon, in_lat)
-
-lev850 = np.where(in_lev == 850)[0][0]
 
 print(' Completed!')
 
-for t_step in range(1, in_time.shape[0]):
+# the reader yields the smoothed theta850, theta1km, u850, v850 and previous time step winds 
+# for each time step (from the 2nd one), reading the next time step in the background
+# have to smooth the input data, catherine smooths it 10 times, so do I
+# weighting the center point 4x as heavier 
+for step in reader.read_steps(in_file, smooth_iter=10, center_weight=4):
 
-  # creating a datetime variable for the current time step
-  date = dt.datetime(2007, 1, 1) + dt.timedelta(minutes=in_time[t_step])
+  t_step = step['t_step']
+  date = step['date']
+  lat = step['lat']
+  lon = step['lon']
 
   # getting catherinees fronts for the time step
   cath_wf, cath_cf, cath_slp, cath_lat, cath_lon = catherine.fronts_for_date(lat, lon, date.year, date.month, date.day, date.hour)
@@ -101,37 +95,10 @@ for t_step in range(1, in_time.shape[0]):
   # plt.savefig('./images/slp_compare.png', dpi=300.)
   # plt.close('all')
 
-  # extracting the current and previous time step U & V wind speeds for the fronts
-  # have to smooth the input data, catherine smooths it 10 times, so do I
-  # weighting the center point 4x as heavier 
-  prev_u850 = fd.smooth_grid(U[t_step-1, lev850, :, :], iter=10, center_weight=4)
-  u850 = fd.smooth_grid(U[t_step, lev850, :, :], iter=10, center_weight=4) 
-
-  prev_v850 = fd.smooth_grid(V[t_step-1, lev850, :, :], iter=10, center_weight=4)
-  v850 = fd.smooth_grid(V[t_step, lev850, :, :], iter=10, center_weight=4) 
- 
-  # getting the temperature at 850 hPa
-  t850 = T[t_step, lev850, :, :]
-  t850[t850 > 1000] = np.nan
-  theta850 = fd.theta_from_temp_pres(t850, 850)
-  theta850 = fd.smooth_grid(theta850, iter=10, center_weight=4) 
-
-  # getting the 1km values of temperature
-  # the code below is a work around to speed up the code, isntead of running a nest for loop
-
-  # getting the height values from MERRA2
-  H = geoH[t_step, :, :, :]/9.8
-  H1km_diff = np.abs(H - 1000.) # getting the difference between Height and 1km, to get the min value
-  min_val = np.broadcast_to(np.nanmin(H1km_diff, axis=0), (H.shape[0], H.shape[1], H.shape[2])) # getting a min_val array to mask out the main array to find the closest minimum value
-  idx = (H1km_diff == min_val) # getting the index mask of all the minimum values 
-  T_3d = np.ma.masked_array(T[t_step, :, :, :], mask=~idx, fill_value=np.nan) # creating a temperature 3d array
-  t1km = np.nanmin(T_3d.filled(),axis=0)  # getting the 1km value by finding the minimum value
-  pres = np.repeat(in_lev[:, np.newaxis], H.shape[1], axis=-1) # creating the pressure level into 3d array
-  pres = np.repeat(pres[:, :, np.newaxis], H.shape[2], axis=-1) # creating the pressure level into 3d array 
-  pres = np.ma.masked_array(pres, mask=~idx, fill_value=np.nan) # masking out pressure values using minimum 1km mask
-  p1km = np.nanmin(pres, axis=0) # getting the pressure at 1km
-  theta1km = fd.theta_from_temp_pres(t1km, p1km) # computing the theta value at 1km
-  theta1km = fd.smooth_grid(theta1km, iter=10, center_weight=4) # smoothing out the theta value
+  prev_u850, prev_v850 = step['prev_u850'], step['prev_v850']
+  u850, v850 = step['u850'], step['v850']
+  theta850 = step['theta850']
+  theta1km = step['theta1km']
  
   # computing the simmonds fronts
   f_sim = fd.simmonds_et_al_2012(lat, lon, prev_u850, prev_v850, u850, v850) 
@@ -151,34 +118,8 @@ for t_step in range(1, in_time.shape[0]):
   cf = np.copy(cf_sim)
  
   ## Cleaning up the fronts
-  s = generate_binary_structure(2,2)
-  w_label, w_num = label(wf, structure=s)
-  c_label, c_num = label(cf, structure=s)
-
-  # keeping only clusters with 3 or more 
-  for i_w in range(1, w_num+1):
-    ind = np.argwhere(w_label == i_w)
-    if (len(ind) < 3):
-      wf[w_label == i_w] = 0.
-
-  # cleaning up the cold fronts and picking only the eastern most point
-  # cf_old = np.copy(cf)
-  for i_c in range(1, c_num+1):
-    x_ind, y_ind = np.where(c_label == i_c)
-
-    if (len(x_ind) < 3):
-      cf[c_label == i_c] = 0.
-      # cf_old[c_label == i_c] = 0.
-      continue
-
-    # quick scatched up way to keep only eastern most points
-    # optimize this later
-    for uni_x in set(x_ind):
-      y_for_uni_x = y_ind[(x_ind == uni_x)]
-      remove_y = y_for_uni_x[y_for_uni_x != np.nanmax(y_for_uni_x)]
-      if (remove_y.size > 0):
-        for y in remove_y: 
-          cf[uni_x, y] = 0.
+  # keeping only clusters with 3 or more points, and only the eastern most points of the cold fronts
+  wf, cf = fd.filter_front_clusters(wf, cf, min_size=3)
 
   llat = 0
   ulat = 90
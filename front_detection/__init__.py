@@ -11,28 +11,309 @@ Last Modified: March 22nd, 2019
 
 '''
 import numpy as np
-import matplotlib.pyplot as plt
 import math
+from scipy import ndimage
 from scipy.ndimage import label, generate_binary_structure
-from netCDF4 import Dataset
-import pdb
-from mpl_toolkits.basemap import Basemap
-import matplotlib as mpl
+from scipy.spatial import cKDTree
 import os
-import glob
-
-def four_corner_shift(arr, shift_len=1):
-    up = np.pad(arr, ((shift_len, 0), (0, 0)), mode='constant', constant_values=np.nan)[:-shift_len, :]
-    down = np.pad(arr, ((0, shift_len), (0, 0)), mode='constant', constant_values=np.nan)[shift_len:, :]
-    left = np.roll(arr, -1, axis=1)
-    right = np.roll(arr, 1, axis=1)
+import hashlib
+import weakref
+import importlib
+import concurrent.futures as cf_futures
+from collections import OrderedDict
+
+from front_detection import instrument
+
+# the package itself only needs numpy/scipy, matplotlib/Basemap (plotting) and netCDF4 (reader, catherine, points)
+# are only imported when one of these submodules (or one of their functions below) is first used
+SUBMODULES = ('cache', 'catherine', 'online', 'pipeline', 'plotting', 'points', 'reader', 'store', 'tracking')
+_LAZY_FUNCTIONS = {
+    'show': 'plotting',
+    'mask_zero_contour_mpl': 'plotting',
+    'mountain_mask': 'reader',
+}
+
+def __getattr__(name):
+    # fd.reader, fd.plotting, ..., and fd.show, fd.mountain_mask, fd.mask_zero_contour_mpl
+    if (name in SUBMODULES):
+      return importlib.import_module('front_detection.' + name)
+    if (name in _LAZY_FUNCTIONS):
+      return getattr(importlib.import_module('front_detection.' + _LAZY_FUNCTIONS[name]), name)
+    raise AttributeError("module 'front_detection' has no attribute '%s'"%(name))
+
+def __dir__():
+    return sorted(set(globals()) | set(SUBMODULES) | set(_LAZY_FUNCTIONS))
+
+def four_corner_shift(arr, shift_len=1, periodic=True):
+    # shifts along the last two (lat, lon) axes, so arr can have leading (time) dimensions
+    # if the grid is not periodic in longitude, the left/right edges are filled with nans like up/down
+    lead_pad = ((0, 0),)*(arr.ndim-2)
+    up = np.pad(arr, lead_pad + ((shift_len, 0), (0, 0)), mode='constant', constant_values=np.nan)[..., :-shift_len, :]
+    down = np.pad(arr, lead_pad + ((0, shift_len), (0, 0)), mode='constant', constant_values=np.nan)[..., shift_len:, :]
+    if (periodic):
+      left = np.roll(arr, -1, axis=-1)
+      right = np.roll(arr, 1, axis=-1)
+    else:
+      left = np.pad(arr, lead_pad + ((0, 0), (0, 1)), mode='constant', constant_values=np.nan)[..., 1:]
+      right = np.pad(arr, lead_pad + ((0, 0), (1, 0)), mode='constant', constant_values=np.nan)[..., :-1]
 
     return up, down, left, right
 
 def theta_from_temp_pres(temp, pres):
   return temp * (1000./pres)**(2./7.)
 
+@instrument.timed()
+def temp_pres_at_height(H, T, lev, height=1000., interpolate=False):
+    ''' temperature, pressure and theta at the level closest to height (1km by default) 
+    H is the height in m, T the temperature, both (..., lev, lat, lon) so leading time dimensions are fine, lev the pressure levels
+    the closest level is found by a running argmin over the levels (only (..., lat, lon) arrays are kept), then T is 
+    picked with take_along_axis and p by indexing lev, no 3-D pressure cube is built
+    if interpolate, T is linearly interpolated in height and p in log(p) between the levels bracketing height 
+    (falls back to the closest level when height is not bracketed)
+    returns a dict with t1km, p1km, theta1km (nan where H is all nan), theta is theta_from_temp_pres computed in place '''
+
+    lev = np.asarray(lev, dtype=float)
+    num_lev = H.shape[-3]
+    if (lev.size != num_lev) or (T.shape[-3] != num_lev):
+      raise ValueError('H, T must have the levels on axis -3, same length as lev (%d)'%(lev.size))
+
+    # closest level, first one on ties like argmin, levels with nan heights are skipped
+    idx = np.zeros(H.shape[:-3] + H.shape[-2:], dtype=np.intp)
+    min_diff = np.full(idx.shape, np.inf)
+    diff = np.empty(idx.shape)
+    closer = np.empty(idx.shape, dtype=bool)
+    for i_lev in range(num_lev):
+      np.subtract(H[..., i_lev, :, :], height, out=diff)
+      np.abs(diff, out=diff)
+      np.less(diff, min_diff, out=closer)
+      np.copyto(idx, i_lev, where=closer)
+      np.copyto(min_diff, diff, where=closer)
+    invalid = np.isinf(min_diff)
+    del diff, closer, min_diff
+
+    def at_level(data, ind):
+      return np.take_along_axis(data, ind[..., np.newaxis, :, :], axis=-3)[..., 0, :, :]
+
+    t1km = np.asarray(at_level(T, idx), dtype=float)
+    p1km = lev[idx]
+
+    if (interpolate):
+      h_closest = at_level(H, idx)
+      for nb in (idx - 1, idx + 1):
+        # the neighbour level on the other side of height
+        in_range = (nb >= 0) & (nb < num_lev)
+        nb = np.clip(nb, 0, num_lev-1)
+        h_nb = at_level(H, nb)
+        with np.errstate(invalid='ignore', divide='ignore'):
+          bracket = in_range & ~invalid & ((h_closest - height)*(h_nb - height) < 0)
+          w = (height - h_closest)/(h_nb - h_closest)
+          t_nb = at_level(T, nb)
+          t1km = np.where(bracket, t1km + w*(t_nb - t1km), t1km)
+          p1km = np.where(bracket, np.exp(np.log(p1km) + w*(np.log(lev[nb]) - np.log(p1km))), p1km)
+
+    t1km[invalid] = np.nan
+    p1km[invalid] = np.nan
+
+    theta1km = np.divide(1000., p1km)
+    theta1km **= (2./7.)
+    theta1km *= t1km
+    return {'t1km': t1km, 'p1km': p1km, 'theta1km': theta1km}
+
+def warm_front_clusters(wf, cyc_lon, cyc_lat):
+    ''' labels the warm fronts and computes the size and mean lat/lon of all the clusters at once '''
+
+    w_label, w_num = label(wf)
+    instrument.count('clusters.warm', w_num)
+    index = np.arange(1, w_num+1)
+
+    clusters = {'label': w_label, 'num': w_num, 'index': index}
+    clusters['size'] = np.bincount(w_label.ravel(), minlength=w_num+1)[1:]
+    clusters['mean_lat'] = np.asarray(ndimage.mean(cyc_lat, w_label, index), dtype=float)
+    clusters['mean_lon'] = np.asarray(ndimage.mean(cyc_lon, w_label, index), dtype=float)
+    clusters['slices'] = ndimage.find_objects(w_label)
+
+    return clusters
+
+def cold_front_clusters(cf, cyc_lon, cyc_lat):
+    ''' labels the cold fronts and keeps the eastern most point of each cluster for each latitude,
+    then computes the size, mean, median, max lat/lon of these points for all the clusters at once '''
+
+    c_label, c_num = label(cf)
+    instrument.count('clusters.cold', c_num)
+    index = np.arange(1, c_num+1)
+
+    clusters = {'label': c_label, 'num': c_num, 'index': index}
+    clusters['size'] = np.bincount(c_label.ravel(), minlength=c_num+1)[1:]
+
+    # one group for each (cluster, latitude) pair
+    cells = np.flatnonzero(c_label)
+    c_ind = c_label.ravel()[cells]
+    cell_lat = np.asarray(cyc_lat).ravel()[cells]
+    cell_lon = np.asarray(cyc_lon).ravel()[cells]
+    uni_lat, lat_inv = np.unique(cell_lat, return_inverse=True)
+    key = np.int64(c_ind) * max(uni_lat.size, 1) + lat_inv.ravel()
+    groups = np.unique(key)
+
+    # eastern most longitude of each group, and where the group is first seen (row major order)
+    group_cluster = groups // max(uni_lat.size, 1)
+    group_lat = uni_lat[groups % max(uni_lat.size, 1)]
+    group_lon = np.asarray(ndimage.maximum(cell_lon, key, groups), dtype=float).reshape(-1)
+    group_first = np.asarray(ndimage.minimum(cells, key, groups), dtype=np.int64).reshape(-1)
+
+    clusters['group_cluster'] = group_cluster
+    clusters['group_lat'] = group_lat
+    clusters['group_lon'] = group_lon
+    clusters['group_first'] = group_first
+    clusters['group_start'] = np.searchsorted(group_cluster, np.arange(1, c_num+2))
+
+    clusters['mean_lat'] = np.asarray(ndimage.mean(group_lat, group_cluster, index), dtype=float).reshape(-1)
+    clusters['mean_lon'] = np.asarray(ndimage.mean(group_lon, group_cluster, index), dtype=float).reshape(-1)
+    clusters['median_lon'] = np.asarray(ndimage.median(group_lon, group_cluster, index), dtype=float).reshape(-1)
+    clusters['max_lat'] = np.asarray(ndimage.maximum(group_lat, group_cluster, index), dtype=float).reshape(-1)
+
+    return clusters
+
+def warm_front_points(clusters, i_w, cyc_lon, cyc_lat):
+    # lon/lat lists of all the points of warm cluster i_w (row major order)
+    slc = clusters['slices'][i_w-1]
+    ind = (clusters['label'][slc] == i_w)
+    return [np.asarray(cyc_lon)[slc][ind].tolist(), np.asarray(cyc_lat)[slc][ind].tolist()]
+
+def cold_front_points(clusters, i_c):
+    # lon/lat lists of the eastern most points of cold cluster i_c
+    # in the same order as the set of latitudes used in the loop version
+    g_ind = np.arange(clusters['group_start'][i_c-1], clusters['group_start'][i_c])
+    g_ind = g_ind[np.argsort(clusters['group_first'][g_ind], kind='stable')]
+    f_lat = clusters['group_lat'][g_ind]
+    lon_for_lat = dict(zip(f_lat, clusters['group_lon'][g_ind]))
+    f_lat = list(set(f_lat))
+    f_lon = [lon_for_lat[i_lat] for i_lat in f_lat]
+    return [f_lon, f_lat]
+
+def attribute_warm_fronts(clusters, cyc_center_lon, cyc_center_lat, ind=None):
+    ''' storm attribution of the warm front clusters (clusters with more than 2 points)
+    ind are the (0 based) cluster indices of the (cluster, cyclone) pairs to test, all the clusters by default,
+    cyc_center_lon/lat are broadcast against ind (one center, or one center per pair) '''
+
+    if (ind is None):
+      ind = np.arange(clusters['num'])
+    mean_lon = clusters['mean_lon'][ind]
+    mean_lat = clusters['mean_lat'][ind]
+
+    dist_deg = get_distance_deg(mean_lon, mean_lat, cyc_center_lon, cyc_center_lat)
+    return (clusters['size'][ind] > 2) & (mean_lon > cyc_center_lon) & (dist_deg < 15.) \
+        & (np.abs(cyc_center_lat - mean_lat) < 5.)
+
+def attribute_cold_fronts(clusters, cyc_center_lon, cyc_center_lat, ind=None):
+    ''' storm attribution of the cold front clusters (clusters with more than 2 points)
+    ind and cyc_center_lon/lat same as attribute_warm_fronts '''
+
+    if (ind is None):
+      ind = np.arange(clusters['num'])
+    mean_lon = clusters['mean_lon'][ind]
+    mean_lat = clusters['mean_lat'][ind]
+    cyc_center_lon = np.broadcast_to(cyc_center_lon, ind.shape)
+
+    dist_deg = get_distance_deg(mean_lon, mean_lat, cyc_center_lon, cyc_center_lat)
+    keep = (clusters['size'][ind] > 2) & (dist_deg < 15) & (np.abs(mean_lon - cyc_center_lon) < 7.5) \
+        & (mean_lat < cyc_center_lat)
+
+    # additional conditions before selecting cold fronts
+    # any eastern most point within 2.5 deg of the center longitude, checked on the groups of each pair
+    starts = clusters['group_start'][ind]
+    num_groups = clusters['group_start'][ind+1] - starts
+    pair = np.repeat(np.arange(ind.size), num_groups)
+    group = np.arange(pair.size) - np.repeat(np.cumsum(num_groups) - num_groups, num_groups) + np.repeat(starts, num_groups)
+    near = np.abs(clusters['group_lon'][group] - cyc_center_lon[pair]) < 2.5
+    near_lon = np.bincount(pair[near], minlength=ind.size) > 0
+
+    keep &= near_lon & ((90 - np.abs(clusters['max_lat'][ind])) < 5) & ((cyc_center_lon - clusters['median_lon'][ind]) > 15)
+
+    return keep
+
+@instrument.timed()
 def clean_fronts(wf, cf, cyc_lon, cyc_lat, cyc_center_lon, cyc_center_lat):
+    ''' storm attribution of the warm and cold front clusters to the cyclone center
+    returns the lists of [lon, lat] points of the warm and cold fronts attributed to the cyclone 
+    the cluster statistics are computed for all the clusters at once (same lists as clean_fronts_loop) '''
+
+    w_clusters = warm_front_clusters(wf, cyc_lon, cyc_lat)
+    w_keep = attribute_warm_fronts(w_clusters, cyc_center_lon, cyc_center_lat)
+    wf_list = [warm_front_points(w_clusters, i_w, cyc_lon, cyc_lat) for i_w in w_clusters['index'][w_keep]]
+
+    c_clusters = cold_front_clusters(cf, cyc_lon, cyc_lat)
+    c_keep = attribute_cold_fronts(c_clusters, cyc_center_lon, cyc_center_lat)
+    cf_list = [cold_front_points(c_clusters, i_c) for i_c in c_clusters['index'][c_keep]]
+
+    return wf_list, cf_list
+
+# number of cyclone centers from which a kd-tree is used to find the clusters close to each center
+KDTREE_MIN_CENTERS = 32
+
+def near_cluster_pairs(clusters, cyc_center_lon, cyc_center_lat, max_dist=15., use_kdtree=None):
+    ''' (0 based) cluster and center indices of all the (cluster, cyclone) pairs with 
+    the cluster mean lat/lon less than max_dist degrees from the center (only clusters with more than 2 points)
+    uses a distance matrix, or a kd-tree when there are many centers '''
+
+    cyc_center_lon = np.asarray(cyc_center_lon, dtype=float).ravel()
+    cyc_center_lat = np.asarray(cyc_center_lat, dtype=float).ravel()
+    if (use_kdtree is None):
+      use_kdtree = (cyc_center_lon.size >= KDTREE_MIN_CENTERS)
+
+    ind = np.where((clusters['size'] > 2) & np.isfinite(clusters['mean_lon']) & np.isfinite(clusters['mean_lat']))[0]
+    if (ind.size == 0) or (cyc_center_lon.size == 0):
+      return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    if (use_kdtree):
+      cluster_tree = cKDTree(np.column_stack((clusters['mean_lon'][ind], clusters['mean_lat'][ind])))
+      center_tree = cKDTree(np.column_stack((cyc_center_lon, cyc_center_lat)))
+      pairs = cluster_tree.sparse_distance_matrix(center_tree, max_dist, output_type='ndarray')
+      i_cluster, i_center = ind[pairs['i']], pairs['j']
+    else:
+      dist_deg = get_distance_deg(clusters['mean_lon'][ind, None], clusters['mean_lat'][ind, None], cyc_center_lon[None, :], cyc_center_lat[None, :])
+      i_cluster, i_center = np.nonzero(dist_deg < max_dist)
+      i_cluster = ind[i_cluster]
+
+    # cyclone by cyclone, clusters in label order
+    order = np.lexsort((i_cluster, i_center))
+    return np.asarray(i_cluster[order], dtype=int), np.asarray(i_center[order], dtype=int)
+
+@instrument.timed()
+def clean_fronts_multi(wf, cf, cyc_lon, cyc_lat, cyc_center_lon, cyc_center_lat, use_kdtree=None):
+    ''' clean_fronts for many cyclone centers at once (cyc_center_lon/lat are arrays)
+    the fronts are labeled and the cluster statistics computed only once, then the attribution rules
+    are applied to all the (cluster, cyclone) pairs close enough to each other
+    returns the lists of warm and cold front lists, one for each cyclone (same as calling clean_fronts for each center) '''
+
+    cyc_center_lon = np.asarray(cyc_center_lon, dtype=float).ravel()
+    cyc_center_lat = np.asarray(cyc_center_lat, dtype=float).ravel()
+    num_centers = cyc_center_lon.size
+
+    wf_lists = [[] for i in range(num_centers)]
+    cf_lists = [[] for i in range(num_centers)]
+
+    w_clusters = warm_front_clusters(wf, cyc_lon, cyc_lat)
+    i_cluster, i_center = near_cluster_pairs(w_clusters, cyc_center_lon, cyc_center_lat, use_kdtree=use_kdtree)
+    keep = attribute_warm_fronts(w_clusters, cyc_center_lon[i_center], cyc_center_lat[i_center], ind=i_cluster)
+    points = {}
+    for i_w, i_cyc in zip(i_cluster[keep], i_center[keep]):
+      if (i_w not in points):
+        points[i_w] = warm_front_points(w_clusters, i_w+1, cyc_lon, cyc_lat)
+      wf_lists[i_cyc].append(points[i_w])
+
+    c_clusters = cold_front_clusters(cf, cyc_lon, cyc_lat)
+    i_cluster, i_center = near_cluster_pairs(c_clusters, cyc_center_lon, cyc_center_lat, use_kdtree=use_kdtree)
+    keep = attribute_cold_fronts(c_clusters, cyc_center_lon[i_center], cyc_center_lat[i_center], ind=i_cluster)
+    points = {}
+    for i_c, i_cyc in zip(i_cluster[keep], i_center[keep]):
+      if (i_c not in points):
+        points[i_c] = cold_front_points(c_clusters, i_c+1)
+      cf_lists[i_cyc].append(points[i_c])
+
+    return wf_lists, cf_lists
+
+def clean_fronts_loop(wf, cf, cyc_lon, cyc_lat, cyc_center_lon, cyc_center_lat):
+    ''' original loop version of clean_fronts, kept as a reference '''
 
     w_label, w_num = label(wf)
     c_label, c_num = label(cf)
@@ -90,7 +371,7 @@ def clean_fronts(wf, cf, cyc_lon, cyc_lat, cyc_center_lon, cyc_center_lat):
         continue
       
       # addtiional conditions before selecting cold fronts
-      if not ((np.any(np.abs(f_lon - cyc_center_lon) < 2.5)) & ((90 - np.abs(np.nanmax(f_lat))) < 5) & ((cyc_center_lon - np.median(f_lon)) > 15)):
+      if not ((np.any(np.abs(np.asarray(f_lon) - cyc_center_lon) < 2.5)) & ((90 - np.abs(np.nanmax(f_lat))) < 5) & ((cyc_center_lon - np.median(f_lon)) > 15)):
         continue
       
       # for the remaining clusters I have to apply Haning filter that simmonds et al, 2012, allow more than one cluster
@@ -98,53 +379,291 @@ def clean_fronts(wf, cf, cyc_lon, cyc_lat, cyc_center_lon, cyc_center_lat):
 
     return wf_list, cf_list
 
-def hewson_1998(latGrid, lonGrid, theta, u_wind, v_wind):
+@instrument.timed()
+def filter_front_clusters(wf, cf, min_size=3):
+    ''' clean up of the front masks (same as the clean up in example.py)
+    removes the warm and cold front clusters (8-connected) with less than min_size points,
+    and keeps only the eastern most point of each cold front cluster in each latitude row 
+    wf and cf can be (lat, lon) or have leading (time) dimensions, clusters are not connected across time '''
+
+    wf = np.double(np.asarray(wf) > 0)
+    cf = np.double(np.asarray(cf) > 0)
+
+    # 8-connected in lat/lon only
+    s = np.zeros((3,)*wf.ndim, dtype=bool)
+    s[(1,)*(wf.ndim-2)] = generate_binary_structure(2,2)
+
+    # keeping only clusters with min_size or more points
+    w_label, w_num = label(wf, structure=s)
+    w_size = np.bincount(w_label.ravel(), minlength=w_num+1)
+    wf[(w_size < min_size)[w_label] & (w_label > 0)] = 0.
+
+    c_label, c_num = label(cf, structure=s)
+    c_size = np.bincount(c_label.ravel(), minlength=c_num+1)
+    instrument.count('filter_front_clusters.clusters', w_num + c_num)
+    cf[(c_size < min_size)[c_label] & (c_label > 0)] = 0.
+
+    # eastern most (largest lon index) point of each cold front cluster for each lat row
+    ind = np.nonzero(cf)
+    c_ind = c_label[ind]
+    row = ind[-2]
+    col = ind[-1]
+    max_col = np.full((c_num+1, cf.shape[-2]), -1, dtype=int)
+    np.maximum.at(max_col, (c_ind, row), col)
+    remove = (col != max_col[c_ind, row])
+    cf[tuple(i[remove] for i in ind)] = 0.
+
+    return wf, cf
+
+# thresholds of the m1 and m2 masks of hewson_1998
+HEWSON_K1 = 0.33 # degC per 100km per 100km; gridlength of 100km
+HEWSON_K2 = 1.49 # degC per 100km
+
+class MeanAxisStencil(object):
+    ''' five point mean axis of mu = grad |grad theta| (appendix 2 of Hewson 1998) and the total divergence 
+    of the four outer vectors resolved onto it (eq6 of hewson_1998_fields), for (..., lat, lon) grids
+    the neighbours are strided views of the grid (no padded, rolled or stacked copies), the angle terms are 
+    computed once per point instead of once per neighbour, and all the work buffers are allocated once, 
+    so a stencil can be reused for many time steps (same values as mean_axis_divergence_stacked)
+    with trig_free, the angles are not computed at all, the double angle terms come from the vector components
+    (|mu| cos 2ang = (x^2 - y^2)/|mu|, |mu| sin 2ang = 2xy/|mu|) and cos, sin of beta_mean from the half angle 
+    formulas, so there are no arctan, cos or sin calls (same values to rounding) '''
+
+    def __init__(self, shape, periodic=True, dtype=np.double, trig_free=False):
+        self.shape = tuple(shape)
+        self.periodic = periodic
+        self.dtype = np.dtype(dtype)
+        self.trig_free = trig_free
+
+        self.sump = np.empty(self.shape, dtype=self.dtype)
+        self.sumq = np.empty(self.shape, dtype=self.dtype)
+        self.beta_mean = np.empty(self.shape, dtype=self.dtype)
+        self.D_mean = np.empty(self.shape, dtype=self.dtype)
+        self._ang = np.empty(self.shape, dtype=self.dtype)
+        self._p = np.empty(self.shape, dtype=self.dtype)
+        self._q = np.empty(self.shape, dtype=self.dtype)
+        self._cos = np.empty(self.shape, dtype=self.dtype)
+        self._sin = np.empty(self.shape, dtype=self.dtype)
+        self._r1 = np.empty(self.shape, dtype=self.dtype)
+        self._r2 = np.empty(self.shape, dtype=self.dtype)
+        self._tmp = np.empty(self.shape, dtype=self.dtype)
+        self._valid = np.empty(self.shape, dtype=bool)
+        self._mask = np.empty(self.shape, dtype=bool)
+        self._flip = np.empty(self.shape, dtype=bool)
+
+    def _neighbour(self, direction):
+        # (out, neighbour) index pairs of the neighbour views, and the out indices without a neighbour
+        # same neighbours as four_corner_shift: up is the row before, down the row after, 
+        # right the column before and left the column after (rolled in longitude if periodic)
+        e = Ellipsis
+        a, b, first, last = slice(1, None), slice(None, -1), slice(None, 1), slice(-1, None)
+        if (direction == 'up'):
+          return [((e, a, slice(None)), (e, b, slice(None)))], [(e, first, slice(None))]
+        if (direction == 'down'):
+          return [((e, b, slice(None)), (e, a, slice(None)))], [(e, last, slice(None))]
+        if (direction == 'right'):
+          pairs, edge = [((e, a), (e, b))], ((e, first), (e, last))
+        else:
+          pairs, edge = [((e, b), (e, a))], ((e, last), (e, first))
+        if (self.periodic):
+          return pairs + [edge], []
+        return pairs, [edge[0]]
+
+    def _add_neighbours(self, arr, out):
+        # out += up, down, right, left (added in that order, as the nansum of the stacks), the missing neighbours as 0
+        for direction in ('up', 'down', 'right', 'left'):
+          pairs, missing = self._neighbour(direction)
+          for o, n in pairs:
+            np.add(out[o], arr[n], out=out[o])
+          for o in missing:
+            np.add(out[o], 0., out=out[o])
+        return out
+
+    def _resolve(self, direction, mu_x, mu_y, out):
+        # out = mu_x*cos(beta_mean) + mu_y*sin(beta_mean) of the neighbour (nan where there is none)
+        pairs, missing = self._neighbour(direction)
+        for o, n in pairs:
+          np.multiply(mu_x[n], self._cos[o], out=out[o])
+          np.multiply(mu_y[n], self._sin[o], out=self._tmp[o])
+          np.add(out[o], self._tmp[o], out=out[o])
+        for o in missing:
+          out[o] = np.nan
+        return out
+
+    def _point_terms(self, mu_x, mu_y, mu_mag):
+        # per point p = |mu| cos(2 ang), q = |mu| sin(2 ang) with nans as 0, and the points where both are valid
+        # ang is the angle of mu in [0, pi) (pi/2 where mu_x is 0)
+        ang = self._ang
+        np.equal(mu_x, 0, out=self._mask)
+        with np.errstate(invalid='ignore', divide='ignore'):
+          np.divide(mu_y, mu_x, out=ang, where=~self._mask)
+        np.arctan(ang, out=ang, where=~self._mask)
+        np.copyto(ang, np.pi/2., where=self._mask)
+        np.less(ang, 0, out=self._mask)
+        np.add(ang, np.pi, out=ang, where=self._mask)
+
+        np.isnan(ang, out=self._valid)
+        np.logical_or(self._valid, np.isnan(mu_mag), out=self._valid)
+        np.logical_not(self._valid, out=self._valid)
+
+        np.multiply(ang, 2, out=self._p)
+        np.sin(self._p, out=self._q)
+        np.cos(self._p, out=self._p)
+        for arr in (self._p, self._q):
+          np.multiply(arr, mu_mag, out=arr)
+          np.isnan(arr, out=self._mask)
+          np.copyto(arr, 0., where=self._mask)
+
+    def _point_terms_trig_free(self, mu_x, mu_y, mu_mag):
+        # same as _point_terms with p = (x^2 - y^2)/|mu|, q = 2xy/|mu| (0 where mu is 0)
+        np.isnan(mu_mag, out=self._valid)
+        np.logical_not(self._valid, out=self._valid)
+
+        np.not_equal(mu_mag, 0, out=self._mask)
+        np.multiply(mu_x, mu_x, out=self._p)
+        np.multiply(mu_y, mu_y, out=self._tmp)
+        np.subtract(self._p, self._tmp, out=self._p)
+        np.multiply(mu_x, mu_y, out=self._q)
+        np.multiply(self._q, 2, out=self._q)
+        for arr in (self._p, self._q):
+          np.divide(arr, mu_mag, out=arr, where=self._mask)
+          np.isnan(arr, out=self._flip)
+          np.copyto(arr, 0., where=self._flip)
+
+    def _mean_axis_trig_free(self, R):
+        # cos, sin of beta_mean from P, Q and R = sqrt(P^2 + Q^2), with phi = arctan(Q/P):
+        # cos phi = |P|/R, sin phi = sign(P) Q/R, then the half angle cos(phi/2) = sqrt((1 + cos phi)/2), 
+        # sin(phi/2) = sin phi/(2 cos(phi/2)), and beta_mean = phi/2 + pi (both signs flipped) where phi < 0
+        np.equal(self.sump, 0, out=self._mask)
+        np.logical_not(self._mask, out=self._flip)
+        np.abs(self.sump, out=self._cos)
+        np.divide(self._cos, R, out=self._cos, where=self._flip)
+        np.divide(self.sumq, R, out=self._sin, where=self._flip)
+        np.copyto(self._sin, 0., where=self._mask)
+        np.less(self.sump, 0, out=self._flip)
+        np.negative(self._sin, out=self._sin, where=self._flip)
+
+        np.add(self._cos, 1, out=self._cos)
+        np.multiply(self._cos, .5, out=self._cos)
+        np.sqrt(self._cos, out=self._cos)
+        np.divide(self._sin, self._cos, out=self._sin)
+        np.multiply(self._sin, .5, out=self._sin)
+        np.less(self._sin, 0, out=self._flip)
+        np.negative(self._cos, out=self._cos, where=self._flip)
+        np.negative(self._sin, out=self._sin, where=self._flip)
+
+        # beta_mean is pi/2 where P is 0
+        np.copyto(self._cos, 0., where=self._mask)
+        np.copyto(self._sin, 1., where=self._mask)
+
+    def _mean_axis(self):
+        # beta_mean = arctan(sumq/sump)/2 in [0, pi] (pi/2 where sump is 0), and its cos and sin
+        beta = self.beta_mean
+        np.equal(self.sump, 0, out=self._mask)
+        np.divide(self.sumq, self.sump, out=beta, where=~self._mask)
+        np.arctan(beta, out=beta, where=~self._mask)
+        np.multiply(beta, .5, out=beta, where=~self._mask)
+        np.copyto(beta, np.pi/2., where=self._mask)
+        np.less(beta, 0, out=self._mask)
+        np.add(beta, np.pi, out=beta, where=self._mask)
+
+        np.cos(beta, out=self._cos)
+        np.sin(beta, out=self._sin)
+
+    def compute(self, mu_x, mu_y, distX, distY, mu_mag=None, out=None):
+        ''' five point mean axis and eq6 of the mu_x, mu_y grids, distX, distY are the grid distances (km)
+        returns a dict with sump, sumq, beta_mean (not with trig_free), cos_beta, sin_beta, D_mean 
+        (buffers of the stencil, overwritten by the next call) and eq6 (a new array, or out) '''
+
+        mu_x = np.asarray(mu_x, dtype=self.dtype)
+        mu_y = np.asarray(mu_y, dtype=self.dtype)
+        if (mu_x.shape != self.shape) or (mu_y.shape != self.shape):
+          raise ValueError('grid shape %s does not match the stencil shape %s'%(str(mu_x.shape), str(self.shape)))
+        if (mu_mag is None):
+          mu_mag = norm(mu_x, mu_y)
+
+        if (self.trig_free):
+          self._point_terms_trig_free(mu_x, mu_y, mu_mag)
+        else:
+          self._point_terms(mu_x, mu_y, mu_mag)
+
+        # P, Q (appendix 2.1), the sums of the point terms of the center and its 4 neighbours
+        np.copyto(self.sump, self._p)
+        self._add_neighbours(self._p, self.sump)
+        np.copyto(self.sumq, self._q)
+        self._add_neighbours(self._q, self.sumq)
+
+        # n is the number of valid (point, neighbour) terms of each time step, 5 per point less the 
+        # points that are not the neighbour of any point (first/last rows, and columns if not periodic)
+        valid = self._valid
+        n = 5*np.sum(valid, axis=(-2, -1)) - np.sum(valid[..., 0, :], axis=-1) - np.sum(valid[..., -1, :], axis=-1)
+        if (not self.periodic):
+          n = n - np.sum(valid[..., :, 0], axis=-1) - np.sum(valid[..., :, -1], axis=-1)
+        n = np.asarray(n, dtype=self.dtype)[..., None, None]
+
+        # D_mean = sqrt(P^2 + Q^2)/n
+        np.multiply(self.sump, self.sump, out=self._r1)
+        np.multiply(self.sumq, self.sumq, out=self._r2)
+        np.add(self._r1, self._r2, out=self.D_mean)
+        np.sqrt(self.D_mean, out=self.D_mean)
+        if (self.trig_free):
+          self._mean_axis_trig_free(self.D_mean)
+        else:
+          self._mean_axis()
+        np.multiply(1/n, self.D_mean, out=self.D_mean)
+
+        # total divergence of the 4 outer vectors resolved onto the mean axis (first order differences)
+        if (out is None):
+          out = np.empty(self.shape, dtype=self.dtype)
+        self._resolve('right', mu_x, mu_y, self._r1)
+        np.subtract(self._r1, self._resolve('left', mu_x, mu_y, self._r2), out=self._r1)
+        np.multiply(100, self._r1, out=self._r1)
+        np.divide(self._r1, np.multiply(2, distX, out=self._tmp), out=self._r1)
+        self._resolve('up', mu_x, mu_y, self._r2)
+        np.subtract(self._r2, self._resolve('down', mu_x, mu_y, out), out=self._r2)
+        np.multiply(100, self._r2, out=self._r2)
+        np.divide(self._r2, np.multiply(2, distY, out=self._tmp), out=self._r2)
+        np.add(self._r1, self._r2, out=out)
+
+        out_dict = {'sump': self.sump, 'sumq': self.sumq, 'cos_beta': self._cos, 'sin_beta': self._sin, 'D_mean': self.D_mean, 'eq6': out}
+        if (not self.trig_free):
+          out_dict['beta_mean'] = self.beta_mean
+        return out_dict
+
+def hewson_1998_fields(latGrid, lonGrid, theta, geometry=None, dtype=None, trig_free=False):
+    ''' the fields of hewson_1998 that depend neither on the k1, k2 thresholds nor on the winds
+    returns a dict with gx, gy (grad theta), grad_norm (|grad theta|), mu_x, mu_y (grad |grad theta|),
+    eq6, eq7 and zc_7 (zero contour of eq7, not masked yet), all (..., lat, lon) in dtype
+    trig_free uses the MeanAxisStencil without angles for eq6 (same to rounding) '''
+
+    timer = instrument.laps('hewson_1998_fields')
+
+    dtype = np.dtype(np.double if (dtype is None) else dtype)
+    theta = np.asarray(theta, dtype=dtype)
+
+    # distances are only computed once for the grid
+    if (geometry is None):
+      geometry = get_grid_geometry(latGrid, lonGrid)
+    timer.lap('geometry')
 
     # computing first derivative
-    gx, gy = geo_gradient(latGrid, lonGrid, theta)
+    gx, gy = geo_gradient(latGrid, lonGrid, theta, geometry=geometry)
     gNorm = norm(gx, gy) 
 
     # computing the 2nd derivative using the first derivative
     # gNorm_gNorm = grad(abs(gNorm))
-    gx_gNorm, gy_gNorm = geo_gradient(latGrid, lonGrid, gNorm)
-    gNorm_gNorm = norm(gx_gNorm, gy_gNorm)
+    gx_gNorm, gy_gNorm = geo_gradient(latGrid, lonGrid, gNorm, geometry=geometry)
     
     # let mu = grad(abs(grad(theta)))
     mu_x = np.copy(gx_gNorm)
     mu_y = np.copy(gy_gNorm)
     abs_mu = norm(mu_x, mu_y) 
 
-    grad_abs_mu_x, grad_abs_mu_y = geo_gradient(latGrid, lonGrid, abs_mu)
-   
-    ################### Computing M1 and M2 values ####################
-    # compute m1, and m2, using k1, and k2 values
-
-    # sign_m1_val = gx * mu_x + gy * mu_y
-    # sign_m1_val = smooth_grid(sign_m1_val, center_weight=1., iter=1) #JJ
-    # sign_m1 = np.zeros(sign_m1_val.shape)
-    # sign_m1[sign_m1_val > 0.] = 1. 
-    # sign_m1[sign_m1_val < 0.] = -1. 
-    # m1 = abs_mu * sign_m1
-
-    # calculating m1 using eq(9), hewson 1998
-    # m1 = -1*(mu_x, mu_y) *dot* (gx/gNorm, gy/gNorm)
-    m1 = -1*(mu_x*gx/gNorm + mu_y*gy/gNorm)
-
-    # computing m2
-    # compute distance grid
-    distX, distY = compute_dist_grids(latGrid, lonGrid)
-    dist_avg = np.sqrt(distX**2 + distY**2)
-
-    # m2 (Hewson 1998) 
-    mconst = 1/math.sqrt(2)
-    m2 = gNorm + mconst * dist_avg * gNorm_gNorm / 100
+    grad_abs_mu_x, grad_abs_mu_y = geo_gradient(latGrid, lonGrid, abs_mu, geometry=geometry)
+    timer.lap('gradients')
    
-    k1 = 0.33 # degC per 100km per 100km; gridlength of 100km
-    k2 = 1.49 # degC per 100km
-    # all my gradients are calculated as per 100 km, so here I have to account that for m2 calculation, my gridlenght has to be converted as per 100km as well
-
-    m1_mask = m1 > k1
-    m2_mask = m2 > k2
+    # computing distance grid
+    distX, distY, dist_avg = geometry.distances(dtype)
 
     ########### Computing eq 6 from the Hewson
 
@@ -153,6 +672,28 @@ def hewson_1998(latGrid, lonGrid, theta, u_wind, v_wind):
     # then project the 4 outer vectors in the positive s direction vector 
     # compute total divergence of the resolved vectors using simple first order finite differencing (p 46, Hewson 1998)
 
+    # (five point mean axis and divergence of the resolved vectors in one fused stencil)
+    eq6 = MeanAxisStencil(mu_x.shape, periodic=geometry.periodic, dtype=dtype, trig_free=trig_free).compute(mu_x, mu_y, distX, distY, mu_mag=abs_mu)['eq6']
+    timer.lap('mean_axis')
+    
+    # zc_6 = mask_zero_contour(latGrid, lonGrid, tot_divergence)
+   
+    ############### Method using equation 7 #############################
+    eq7 = ((grad_abs_mu_x * mu_x) + (grad_abs_mu_y * mu_y))/(abs_mu)
+
+    ########## Getting zero contour line using equation 7
+    # (masked with m1, m2 in hewson_1998_masks)
+    zc_7 = mask_zero_contour(latGrid, lonGrid, eq7)
+    timer.done('zero_contour')
+
+    return {'gx': gx, 'gy': gy, 'grad_norm': gNorm, 'mu_x': mu_x, 'mu_y': mu_y, 'eq6': eq6, 'eq7': eq7, 'zc_7': zc_7}
+
+def mean_axis_divergence_stacked(mu_x, mu_y, distX, distY, periodic=True, dtype=np.double):
+    ''' original version of the eq6 part of hewson_1998_fields (with the 5 layer stacks), kept as a reference 
+    returns a dict with sump, sumq, beta_mean, D_mean and eq6, same as MeanAxisStencil.compute '''
+
+    abs_mu = norm(mu_x, mu_y)
+
     # S five point mean
     mu_mag = np.copy(abs_mu)
 
@@ -160,29 +701,31 @@ def hewson_1998(latGrid, lonGrid, theta, u_wind, v_wind):
     # I think Catherine does not account for this
     valid_ind = (~(mu_x == 0))
 
-    mu_ang = np.empty(abs_mu.shape)*np.nan
+    mu_ang = np.full(abs_mu.shape, np.nan, dtype=dtype)
     mu_ang[~valid_ind] = np.pi/2.
     mu_ang[valid_ind] = np.arctan(mu_y[valid_ind]/mu_x[valid_ind])
     mu_ang[mu_ang < 0] = mu_ang[mu_ang < 0] + np.pi
    
     # shift to get the 4 corners 
-    up_shift_ang, down_shift_ang, left_shift_ang, right_shift_ang = four_corner_shift(mu_ang, shift_len=1)
-    up_shift_mag, down_shift_mag, left_shift_mag, right_shift_mag = four_corner_shift(mu_mag, shift_len=1)
+    up_shift_ang, down_shift_ang, left_shift_ang, right_shift_ang = four_corner_shift(mu_ang, shift_len=1, periodic=periodic)
+    up_shift_mag, down_shift_mag, left_shift_mag, right_shift_mag = four_corner_shift(mu_mag, shift_len=1, periodic=periodic)
     
     # stacking the 5 nearest neighbors for the calculation
-    ang_stack = np.dstack((mu_ang, up_shift_ang, down_shift_ang, right_shift_ang, left_shift_ang))
-    mag_stack = np.dstack((mu_mag, up_shift_mag, down_shift_mag, right_shift_mag, left_shift_mag))
+    # (stacked on a new last axis, so this also works for (time, lat, lon) inputs)
+    ang_stack = np.stack((mu_ang, up_shift_ang, down_shift_ang, right_shift_ang, left_shift_ang), axis=-1)
+    mag_stack = np.stack((mu_mag, up_shift_mag, down_shift_mag, right_shift_mag, left_shift_mag), axis=-1)
 
     # computing the P, Q and n from appendix 2.1
-    n = np.nansum(np.double(~np.isnan(ang_stack) & ~np.isnan(mag_stack)))
-    sump = np.nansum(mag_stack * np.cos(2*ang_stack), 2)
-    sumq = np.nansum(mag_stack * np.sin(2*ang_stack), 2)
+    # n is counted for each time step separately
+    n = np.sum(~np.isnan(ang_stack) & ~np.isnan(mag_stack), axis=(-3, -2, -1), keepdims=True, dtype=dtype)[..., 0]
+    sump = np.nansum(mag_stack * np.cos(2*ang_stack), -1)
+    sumq = np.nansum(mag_stack * np.sin(2*ang_stack), -1)
 
     # from P, Q and n, we have to compute the D and beta mean values
     # again here we make sure B mean is in the range [0, pi], and also take care of division by zero
     # this will give us the 5 mean axis of the "s" vector, in polar cdts
     valid_ind = ~(sump == 0)
-    beta_mean = np.empty(sump.shape)*np.nan
+    beta_mean = np.full(sump.shape, np.nan, dtype=dtype)
     beta_mean[~valid_ind] = np.pi/2.
     beta_mean[valid_ind] = .5 * np.arctan(sumq[valid_ind]/sump[valid_ind])
     beta_mean[beta_mean < 0] = beta_mean[beta_mean < 0] + np.pi
@@ -191,8 +734,8 @@ def hewson_1998(latGrid, lonGrid, theta, u_wind, v_wind):
     ## Resolve the four outer vectors into the positive s_hat [D_mean, B_mean]
     # shifting the mu_x and mu_y to get the 4 corners
     # this overlaps the neighbors to allow us to vector caculate
-    up_shift_mu_x, down_shift_mu_x, left_shift_mu_x, right_shift_mu_x = four_corner_shift(mu_x, shift_len=1)
-    up_shift_mu_y, down_shift_mu_y, left_shift_mu_y, right_shift_mu_y = four_corner_shift(mu_y, shift_len=1)
+    up_shift_mu_x, down_shift_mu_x, left_shift_mu_x, right_shift_mu_x = four_corner_shift(mu_x, shift_len=1, periodic=periodic)
+    up_shift_mu_y, down_shift_mu_y, left_shift_mu_y, right_shift_mu_y = four_corner_shift(mu_y, shift_len=1, periodic=periodic)
 
     # resolve the 4 outer x,y vectors onto the center postiive s_hat
     resolve_up = up_shift_mu_x * np.cos(beta_mean) + up_shift_mu_y * np.sin(beta_mean)
@@ -202,7 +745,7 @@ def hewson_1998(latGrid, lonGrid, theta, u_wind, v_wind):
 
     # computing the total divergence of the resolved vectors, using simple first order diffferentiating
     # have to find the distance between the two grid points, at each grid point
-    distX, distY = compute_dist_grids(latGrid, lonGrid)
+    # (distX, distY are the grid distances)
 
     # # this is not how you find the total divergence of the resolved vectors
     # tot_divergence = ((resolve_up * np.cos(beta_mean))/distX) + ((resolve_up * np.sin(beta_mean))/distY) \
@@ -217,37 +760,229 @@ def hewson_1998(latGrid, lonGrid, theta, u_wind, v_wind):
     #     + geo_divergence(latGrid, lonGrid, resolve_right*np.cos(beta_mean), resolve_right*np.sin(beta_mean)) \
     #     + geo_divergence(latGrid, lonGrid, resolve_left*np.cos(beta_mean), resolve_left*np.sin(beta_mean))
 
-    eq6 = tot_divergence
-    eq6_masked = np.copy(eq6)
-    eq6_masked[~(m1_mask & m2_mask)] = np.nan
-    
-    zc_6 = mask_zero_contour(latGrid, lonGrid, tot_divergence)
-    zc_6[~(m1_mask & m2_mask)] = np.nan
-   
-    ########## Getting zero contour line using equation 6
-    # zc_6 = mask_zero_contour(latGrid, lonGrid, eq6_masked)
+    return {'sump': sump, 'sumq': sumq, 'beta_mean': beta_mean, 'D_mean': D_mean, 'eq6': tot_divergence}
 
-    ############### Method using equation 7 #############################
-    eq7 = ((grad_abs_mu_x * mu_x) + (grad_abs_mu_y * mu_y))/(abs_mu)
+def hewson_1998_m1_m2(fields, geometry):
+    ''' m1 and m2 of hewson_1998 from its hewson_1998_fields, the fronts are where m1 > k1 and m2 > k2 '''
 
-    ########## Getting zero contour line using equation 7
-    eq7_masked = np.copy(eq7)
-    eq7_masked[~(m1_mask & m2_mask)] = np.nan
-    
-    zc_7 = mask_zero_contour(latGrid, lonGrid, eq7_masked)
-    
-    zc_7 = mask_zero_contour(latGrid, lonGrid, eq7)
-    zc_7[~(m1_mask & m2_mask)] = np.nan
+    gx, gy, gNorm = fields['gx'], fields['gy'], fields['grad_norm']
+    mu_x, mu_y = fields['mu_x'], fields['mu_y']
+
+    # |grad |grad theta||
+    gNorm_gNorm = norm(mu_x, mu_y)
+
+    ################### Computing M1 and M2 values ####################
+    # compute m1, and m2, using k1, and k2 values
+
+    # sign_m1_val = gx * mu_x + gy * mu_y
+    # sign_m1_val = smooth_grid(sign_m1_val, center_weight=1., iter=1) #JJ
+    # sign_m1 = np.zeros(sign_m1_val.shape)
+    # sign_m1[sign_m1_val > 0.] = 1. 
+    # sign_m1[sign_m1_val < 0.] = -1. 
+    # m1 = abs_mu * sign_m1
+
+    # calculating m1 using eq(9), hewson 1998
+    # m1 = -1*(mu_x, mu_y) *dot* (gx/gNorm, gy/gNorm)
+    m1 = -1*(mu_x*gx/gNorm + mu_y*gy/gNorm)
+
+    # computing m2
+    # compute distance grid
+    distX, distY, dist_avg = geometry.distances(gx.dtype)
+
+    # m2 (Hewson 1998) 
+    mconst = 1/math.sqrt(2)
+    m2 = gNorm + mconst * dist_avg * gNorm_gNorm / 100
+
+    # all my gradients are calculated as per 100 km, so here I have to account that for m2 calculation, my gridlenght has to be converted as per 100km as well
+    return m1, m2
+
+def hewson_1998_masks(fields, u_wind, v_wind, geometry, k1=HEWSON_K1, k2=HEWSON_K2):
+    ''' wf, cf of hewson_1998 from its hewson_1998_fields, for the k1, k2 thresholds
+    (the fields are only read, so they can be read only, e.g. memory mapped from a FieldCache) '''
+
+    timer = instrument.laps('hewson_1998_masks')
+
+    gx, gy = fields['gx'], fields['gy']
+    dtype = gx.dtype
+    u_wind = np.asarray(u_wind, dtype=dtype)
+    v_wind = np.asarray(v_wind, dtype=dtype)
+
+    m1, m2 = hewson_1998_m1_m2(fields, geometry)
+    m1_mask = m1 > k1
+    m2_mask = m2 > k2
+    timer.lap('m1_m2')
+
+    # masking the zero contour of eq7 with m1 and m2
+    zc_7 = np.where(m1_mask & m2_mask, fields['zc_7'], np.nan)
     
     # getting cold and warm fronts
     a_gt = geostrophic_thermal_advection(gx, gy, u_wind, v_wind)
+    if (dtype != np.double):
+      # single precision, bool masks
+      front = (zc_7 > 0)
+      timer.done('advection')
+      return {'wf': front & (a_gt > 0), 'cf': front & (a_gt < 0)}
+
     wf_mask = np.double(a_gt > 0)
     cf_mask = np.double(a_gt < 0)
+    timer.done('advection')
    
     # return {'wf': wf_mask*zc_6, 'cf': cf_mask*zc_6}
     return {'wf': wf_mask*zc_7, 'cf': cf_mask*zc_7}
-    # return zc_6, zc_7
+
+@instrument.timed()
+def hewson_1998(latGrid, lonGrid, theta, u_wind, v_wind, geometry=None, dtype=None, k1=HEWSON_K1, k2=HEWSON_K2):
+    ''' dtype=np.float32 computes everything in single precision (half the memory traffic), the wf and cf 
+    masks are then returned as bool (True on the fronts), by default it is double with 1/0/nan float masks 
+    (hewson_1998_fields, then hewson_1998_masks with the k1, k2 thresholds) '''
+
+    if (geometry is None):
+      geometry = get_grid_geometry(latGrid, lonGrid)
+
+    fields = hewson_1998_fields(latGrid, lonGrid, theta, geometry=geometry, dtype=dtype)
+    return hewson_1998_masks(fields, u_wind, v_wind, geometry, k1=k1, k2=k2)
     
+@instrument.timed()
+def hewson_1998_batch(latGrid, lonGrid, theta, u_wind, v_wind, chunk_size=None, geometry=None, dtype=None, k1=HEWSON_K1, k2=HEWSON_K2):
+    ''' hewson_1998 for (time, lat, lon) stacks of theta, u_wind and v_wind
+    all the time steps are computed together, chunk_size limits the number of time steps 
+    computed at once (to limit memory use), by default all the time steps are done in one pass 
+    dtype, k1 and k2 same as hewson_1998 '''
+
+    theta = np.asarray(theta)
+    u_wind = np.asarray(u_wind)
+    v_wind = np.asarray(v_wind)
+
+    if (theta.ndim != 3):
+      raise ValueError('hewson_1998_batch expects (time, lat, lon) arrays, got shape %s'%(str(theta.shape)))
+    if not (theta.shape == u_wind.shape == v_wind.shape):
+      raise ValueError('theta, u_wind and v_wind must have the same shape')
+
+    if (geometry is None):
+      geometry = get_grid_geometry(latGrid, lonGrid)
+
+    num_time = theta.shape[0]
+    if (not chunk_size):
+      chunk_size = max(num_time, 1)
+
+    mask_dtype = np.double if (dtype is None) or (np.dtype(dtype) == np.double) else bool
+    wf = np.zeros(theta.shape, dtype=mask_dtype)
+    cf = np.zeros(theta.shape, dtype=mask_dtype)
+    for t_start in range(0, num_time, chunk_size):
+      t_slice = slice(t_start, min(t_start + chunk_size, num_time))
+      fronts = hewson_1998(latGrid, lonGrid, theta[t_slice], u_wind[t_slice], v_wind[t_slice], geometry=geometry, dtype=dtype, k1=k1, k2=k2)
+      wf[t_slice] = fronts['wf']
+      cf[t_slice] = fronts['cf']
+
+    return {'wf': wf, 'cf': cf}
+
+def hewson_1998_candidates(fields, u_wind, v_wind, geometry):
+    ''' the parts of hewson_1998_masks that do not depend on k1, k2, at the points of the zero contour of eq7 only
+    returns a dict with index (flat index of the points in the (..., lat, lon) fields), m1, m2, sign of the
+    thermal advection (1 warm, -1 cold, 0) and area (km2) of the grid cells of the points '''
+
+    m1, m2 = hewson_1998_m1_m2(fields, geometry)
+    dtype = m1.dtype
+    a_gt = geostrophic_thermal_advection(fields['gx'], fields['gy'], np.asarray(u_wind, dtype=dtype), np.asarray(v_wind, dtype=dtype))
+
+    with np.errstate(invalid='ignore'):
+      index = np.flatnonzero(np.asarray(fields['zc_7']) > 0)
+    distX, distY, dist_avg = geometry.distances()
+    cell_area = np.broadcast_to(distX*distY, m1.shape)
+
+    return {
+      'index': index,
+      'm1': m1.ravel()[index],
+      'm2': m2.ravel()[index],
+      'sign': np.sign(a_gt.ravel()[index]).astype(np.int8),
+      'area': cell_area.ravel()[index],
+    }
+
+def sweep_counts(candidates, k1_values, k2_values):
+    ''' number of points and area (km2) of the warm and cold fronts for all the (k1, k2) pairs,
+    as (k1, k2) arrays, from hewson_1998_candidates (one matrix product per front type) '''
+
+    k1_values = np.atleast_1d(np.asarray(k1_values, dtype=float))
+    k2_values = np.atleast_1d(np.asarray(k2_values, dtype=float))
+
+    # candidate points above each threshold, (k1, points) and (k2, points)
+    above_k1 = np.double(candidates['m1'][None, :] > k1_values[:, None])
+    above_k2 = np.double(candidates['m2'][None, :] > k2_values[:, None])
+
+    out = {}
+    for name, f_sign in (('wf', 1), ('cf', -1)):
+      sel = (candidates['sign'] == f_sign)
+      a_k1 = above_k1[:, sel]
+      a_k2 = above_k2[:, sel]
+      out[name + '_count'] = np.rint(np.dot(a_k1, a_k2.T)).astype(np.int64)
+      out[name + '_area'] = np.dot(a_k1 * candidates['area'][sel], a_k2.T)
+    return out
+
+def sweep_masks(candidates, shape, k1, k2):
+    ''' bool wf, cf masks (shape) for one (k1, k2) pair, from hewson_1998_candidates '''
+    front = (candidates['m1'] > k1) & (candidates['m2'] > k2)
+    out = {}
+    for name, f_sign in (('wf', 1), ('cf', -1)):
+      mask = np.zeros(int(np.prod(shape)), dtype=bool)
+      mask[candidates['index'][front & (candidates['sign'] == f_sign)]] = True
+      out[name] = mask.reshape(shape)
+    return out
+
+@instrument.timed()
+def hewson_1998_sweep(latGrid, lonGrid, theta, u_wind, v_wind, k1_values, k2_values, geometry=None, dtype=None, masks=False):
+    ''' hewson_1998 for all the (k1, k2) pairs of k1_values x k2_values, the fields, m1, m2, zero contour and
+    advection are computed once (for each time step if theta, u_wind, v_wind have leading time dimensions)
+    returns a dict with k1, k2 and wf_count, cf_count (number of front points), wf_area, cf_area (km2)
+    of shape (k1, k2, ...leading dims), with masks=True also the wf, cf bool masks (k1, k2, ..., lat, lon)
+    (same fronts as hewson_1998(..., k1=k1, k2=k2) > 0) '''
+
+    if (geometry is None):
+      geometry = get_grid_geometry(latGrid, lonGrid)
+
+    k1_values = np.atleast_1d(np.asarray(k1_values, dtype=float))
+    k2_values = np.atleast_1d(np.asarray(k2_values, dtype=float))
+    theta = np.asarray(theta)
+    lead_shape = theta.shape[:-2]
+
+    # one time step at a time, so the memory use is the one of a hewson_1998 call
+    theta = theta.reshape((-1,) + theta.shape[-2:])
+    u_wind = np.asarray(u_wind).reshape(theta.shape)
+    v_wind = np.asarray(v_wind).reshape(theta.shape)
+    num_steps = theta.shape[0]
+    pairs = (k1_values.size, k2_values.size)
+
+    out = {'k1': k1_values, 'k2': k2_values}
+    for name in ('wf', 'cf'):
+      out[name + '_count'] = np.zeros(pairs + (num_steps,), dtype=np.int64)
+      out[name + '_area'] = np.zeros(pairs + (num_steps,))
+      if (masks):
+        out[name] = np.zeros(pairs + theta.shape, dtype=bool)
+
+    for t_ind in range(num_steps):
+      fields = hewson_1998_fields(latGrid, lonGrid, theta[t_ind], geometry=geometry, dtype=dtype)
+      candidates = hewson_1998_candidates(fields, u_wind[t_ind], v_wind[t_ind], geometry)
+      instrument.count('hewson_1998_sweep.candidates', candidates['index'].size)
+
+      counts = sweep_counts(candidates, k1_values, k2_values)
+      for name in counts:
+        out[name][..., t_ind] = counts[name]
+
+      if (masks):
+        for i, k1 in enumerate(k1_values):
+          for j, k2 in enumerate(k2_values):
+            pair_masks = sweep_masks(candidates, theta.shape[-2:], k1, k2)
+            out['wf'][i, j, t_ind] = pair_masks['wf']
+            out['cf'][i, j, t_ind] = pair_masks['cf']
+
+    for name in ('wf', 'cf'):
+      out[name + '_count'] = out[name + '_count'].reshape(pairs + lead_shape)
+      out[name + '_area'] = out[name + '_area'].reshape(pairs + lead_shape)
+      if (masks):
+        out[name] = out[name].reshape(pairs + lead_shape + theta.shape[-2:])
+
+    return out
+
+@instrument.timed()
 def simmonds_et_al_2012(latGrid, lonGrid, u_prior, v_prior, u, v):
   # At 850 hPa
 
@@ -283,7 +1018,58 @@ def simmonds_et_al_2012(latGrid, lonGrid, u_prior, v_prior, u, v):
 # topo_file = '/mnt/drive1/jj/cameron/data/MERRA2_101.const_2d_ctm_Nx.00000000.nc4'
 # which is the topographic information from merra2
 
-def expand_fronts(fronts, num_pixels):
+def _front_spans(mask, num_pixels, periodic=False):
+    ''' (row, lon) mask of the expanded span of each row of a 2d mask (rows, lon)
+    not periodic: from num_pixels before the first to num_pixels after the last front point of the row, a row touching 
+    the first (last) column is only expanded after its last (before its first) point
+    periodic: the shortest arc of the row holding all its front points (everything but the largest gap), 
+    expanded by num_pixels on both sides '''
+
+    num_rows, num_lon = mask.shape
+    col = np.arange(num_lon)
+    rows = mask.any(axis=1)
+    first = np.argmax(mask, axis=1)
+    last = num_lon - 1 - np.argmax(mask[:, ::-1], axis=1)
+
+    if (not periodic):
+      start, end = first - num_pixels, last + num_pixels
+      left, right = (first == 0), (last == num_lon-1) & (first > 0)
+      start[left], end[left] = last[left] + 1, last[left] + num_pixels
+      start[right], end[right] = first[right] - num_pixels, first[right] - 1
+      return rows[:, None] & (col >= start[:, None]) & (col <= end[:, None])
+
+    # gap after each front point (to the next point of the row, the last one wraps to the first)
+    r, c = np.nonzero(mask)
+    if (c.size == 0):
+      return np.zeros(mask.shape, dtype=bool)
+    row_end = np.r_[r[1:] != r[:-1], True]
+    gap = np.empty(c.size, dtype=int)
+    gap[:-1] = c[1:] - c[:-1]
+    gap[row_end] = first[r[row_end]] + num_lon - c[row_end]
+
+    # largest gap of each row (last of the row after sorting by row, then gap)
+    order = np.lexsort((gap, r))
+    largest = order[np.r_[r[order][1:] != r[order][:-1], True]]
+    start = np.zeros(num_rows, dtype=int)
+    length = np.full(num_rows, -1)
+    start[r[largest]] = (c[largest] + gap[largest]) % num_lon - num_pixels
+    length[r[largest]] = num_lon - gap[largest] + 2*num_pixels
+    return ((col[None, :] - start[:, None]) % num_lon) <= length[:, None]
+
+def expand_fronts(fronts, num_pixels, periodic=False, value=-10):
+    ''' expands the fronts (points equal to value) of each row (lon) of fronts (..., lat, lon), in place 
+    see _front_spans for the expanded span of a row, the same as expand_fronts_loop when not periodic
+    (except for rows touching the last column, that are only expanded before their first point) '''
+
+    fronts = np.asarray(fronts)
+    mask = (fronts == value).reshape(-1, fronts.shape[-1])
+    instrument.count('expand_fronts.points', int(mask.sum()))
+    fronts[_front_spans(mask, num_pixels, periodic=periodic).reshape(fronts.shape)] = value
+
+    return fronts
+
+def expand_fronts_loop(fronts, num_pixels):
+    ''' original (2d only) version of expand_fronts, kept as a reference '''
     
     row_len = fronts.shape[0]
     for i in np.arange(0, row_len):
@@ -381,17 +1167,130 @@ def compute_center_mask(lat, lon, centerLat, centerLon):
 def norm(x,y):
     return np.sqrt(x**2 + y**2)
 
-def smooth_grid(inGrid, iter=1, center_weight=4):
+class GridSmoother(object):
+    ''' NaN aware 5 point smoother used by smooth_grid, the center point is weighted by center_weight
+    all the work buffers are allocated once for the given (..., lat, lon) shape, and the iterations 
+    ping-pong between two buffers, so a smoother can be reused for many fields without new allocations
+    gives the same values (bit for bit) as smooth_grid_loop '''
+
+    def __init__(self, shape, center_weight=4, periodic=True, dtype=np.double):
+        self.shape = tuple(shape)
+        self.center_weight = center_weight
+        self.periodic = periodic
+        self.dtype = np.dtype(dtype)
+
+        self._grid = [np.empty(self.shape, dtype=self.dtype), np.empty(self.shape, dtype=self.dtype)]
+        self._zeroed = np.empty(self.shape, dtype=self.dtype) # grid with nans set to 0, as nansum does
+        self._num = np.empty(self.shape, dtype=self.dtype)
+        self._valid = np.empty(self.shape, dtype=np.double)
+        self._cnts = np.empty(self.shape, dtype=np.double)
+        self._nan = np.empty(self.shape, dtype=bool)
+        self._has_cnt = np.empty(self.shape, dtype=bool)
+
+    def _add_neighbours(self, arr, out):
+        # out += right, left, up, down (added in that order), with the missing neighbours as 0
+        # right/left are rolled in longitude (or missing if not periodic), up/down are missing at the lat edges
+        np.add(out[..., :, 1:], arr[..., :, :-1], out=out[..., :, 1:])
+        if (self.periodic):
+          np.add(out[..., :, 0], arr[..., :, -1], out=out[..., :, 0])
+        else:
+          np.add(out[..., :, 0], 0., out=out[..., :, 0])
+
+        np.add(out[..., :, :-1], arr[..., :, 1:], out=out[..., :, :-1])
+        if (self.periodic):
+          np.add(out[..., :, -1], arr[..., :, 0], out=out[..., :, -1])
+        else:
+          np.add(out[..., :, -1], 0., out=out[..., :, -1])
+
+        np.add(out[..., 1:, :], arr[..., :-1, :], out=out[..., 1:, :])
+        np.add(out[..., 0, :], 0., out=out[..., 0, :])
+
+        np.add(out[..., :-1, :], arr[..., 1:, :], out=out[..., :-1, :])
+        np.add(out[..., -1, :], 0., out=out[..., -1, :])
+
+        return out
+
+    def smooth(self, inGrid, iter=1, out=None):
+        ''' smooths inGrid iter times, returns a new array (or writes into out) '''
+
+        inGrid = np.asarray(inGrid)
+        if (inGrid.shape != self.shape):
+          raise ValueError('grid shape %s does not match the smoother shape %s'%(str(inGrid.shape), str(self.shape)))
+
+        src, dst = self._grid
+        np.copyto(src, inGrid, casting='unsafe')
+
+        for iter_loop in range(iter):
+
+          np.isnan(src, out=self._nan)
+          np.logical_not(self._nan, out=self._has_cnt)
+
+          # valid point counts, center weighted
+          np.multiply(self._has_cnt, self.center_weight, out=self._cnts)
+          np.copyto(self._valid, self._has_cnt)
+          self._add_neighbours(self._valid, self._cnts)
+
+          # weighted sum, same order of summation as the nansum of the 5 stacked grids
+          # (center*center_weight + right + left + up + down, with nans as 0)
+          np.copyto(self._zeroed, src)
+          np.copyto(self._zeroed, 0., where=self._nan)
+          np.multiply(self._zeroed, self.center_weight, out=self._num)
+          self._add_neighbours(self._zeroed, self._num)
+
+          # points with no valid values around them (cnts == 0) are left as they are (nan)
+          np.copyto(dst, src, where=self._nan)
+          np.not_equal(self._cnts, 0., out=self._has_cnt)
+          with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(self._num, self._cnts, out=dst, where=self._has_cnt)
+
+          src, dst = dst, src
+
+        if (out is None):
+          return np.copy(src)
+        np.copyto(out, src, casting='unsafe')
+        return out
+
+@instrument.timed()
+def smooth_grid(inGrid, iter=1, center_weight=4, geometry=None):
+    ''' smooths the grid iter times with the 5 point NaN aware GridSmoother 
+    inGrid can be (lat, lon) or have leading dimensions (fields, time steps), which are all smoothed in one go '''
+
+    inGrid = np.asarray(inGrid)
+
+    # by default the grid wraps around in longitude
+    periodic = True
+    if (geometry is not None):
+      geometry.check_shape(inGrid.shape)
+      periodic = geometry.periodic
+
+    dtype = inGrid.dtype if np.issubdtype(inGrid.dtype, np.floating) else np.double
+    smoother = GridSmoother(inGrid.shape, center_weight=center_weight, periodic=periodic, dtype=dtype)
+    instrument.count('smooth_grid.points', inGrid.size*iter)
+
+    return smoother.smooth(inGrid, iter=iter)
+
+def smooth_grid_loop(inGrid, iter=1, center_weight=4, geometry=None):
+    ''' original (2d only) version of smooth_grid, kept as a reference '''
     
     outGrid = np.copy(inGrid)
     shift_len = 1
+
+    # by default the grid wraps around in longitude
+    periodic = True
+    if (geometry is not None):
+      geometry.check_shape(outGrid.shape)
+      periodic = geometry.periodic
     
     for iter_loop in range(iter):
 
       up_shift = np.pad(outGrid, ((shift_len, 0), (0, 0)), mode='constant', constant_values=np.nan)[:-shift_len, :]
       down_shift = np.pad(outGrid, ((0, shift_len), (0, 0)), mode='constant', constant_values=np.nan)[shift_len:, :]
-      right_shift = np.roll(outGrid, 1, axis=1)
-      left_shift = np.roll(outGrid, -1, axis=1)
+      if (periodic):
+        right_shift = np.roll(outGrid, 1, axis=1)
+        left_shift = np.roll(outGrid, -1, axis=1)
+      else:
+        right_shift = np.pad(outGrid, ((0, 0), (shift_len, 0)), mode='constant', constant_values=np.nan)[:, :-shift_len]
+        left_shift = np.pad(outGrid, ((0, 0), (0, shift_len)), mode='constant', constant_values=np.nan)[:, shift_len:]
       # right_shift = np.pad(outGrid, ((0, 0), (shift_len, 0)), mode='constant', constant_values=np.nan)[:, :-shift_len]
       # left_shift = np.pad(outGrid, ((0, 0), (0, shift_len)), mode='constant', constant_values=np.nan)[:, shift_len:]
      
@@ -407,21 +1306,9 @@ def smooth_grid(inGrid, iter=1, center_weight=4):
       
     return outGrid
 
-def mask_zero_contour(latGrid, lonGrid, data):
-    
-    plt.figure() 
-    cs = plt.contour(latGrid, lonGrid, data, levels=[0]) 
-    plt.close()
-    zc = np.zeros(data.shape)
-
-    cdt = np.asarray([])
-    for line in cs.collections[0].get_paths():
-        cdt_line = np.asarray(line.vertices)
-        if (cdt.size == 0):
-          cdt = cdt_line
-        else:
-          cdt = np.vstack((cdt, cdt_line))
-
+def zero_contour_edges(latGrid, lonGrid):
+    # bin edges used to rasterize the contour vertices back onto the grid
+    # (the last edge is kept at the last grid center, as in the original contour code)
     lat_edges = np.asarray(latGrid[:,0])
     lon_edges = np.asarray(lonGrid[0,:])
 
@@ -433,72 +1320,126 @@ def mask_zero_contour(latGrid, lonGrid, data):
 
     lon_edges = lon_edges - lon_div/2.
     lon_edges = np.append(lon_edges, lon_edges[-1]+lon_div/2.)
-    
-    H, _, _ = np.histogram2d(cdt[:, 0], cdt[:, 1], bins=(lat_edges, lon_edges))
-    out_array = np.double(H > 0)
-
-    return out_array
-
-def mountain_mask(inLat, inLon):
-
-    topo_file = '/mnt/drive1/jj/cameron/data/MERRA2_101.const_2d_ctm_Nx.00000000.nc4'
-
-    # read in the topographic data
-    dataset = Dataset(topo_file)
 
-    # dsearchn the lat and lon from the grid
-    lat = dataset.variables['lat'][:]
-    lon = dataset.variables['lon'][:]
-    phis = dataset.variables['PHIS'][:]
-    phis = phis[1,:,:]/9.8
+    return lat_edges, lon_edges
+
+def _bin_index(edges, x):
+    # same binning rule as np.histogram2d, right most bin is closed
+    ind = np.searchsorted(edges, x, side='right') - 1
+    ind[x == edges[-1]] = edges.size - 2
+    return ind
+
+def _edge_crossings(z_a, z_b, use):
+    # sign change of the level 0 along an edge, a grid point is "above" the contour if it is > 0
+    cross = use & ((z_a > 0) != (z_b > 0))
+    ind = np.nonzero(cross)
+    z_a = z_a[ind]
+    z_b = z_b[ind]
+    a_below = ~(z_a > 0)
+    return ind, np.where(a_below, z_a, z_b), np.where(a_below, z_b, z_a), a_below
+
+def _interp(x_a, x_b, z_below, z_above, a_below, start=None):
+    # linear interpolation of the crossing point, written the same way as the contour generator
+    # (from the point below to the point above, reversed at the start of lines on the top/right boundaries),
+    # so that the points falling exactly on the last bin edge are rasterized the same way
+    x_a, x_b = np.broadcast_arrays(x_a, x_b)
+    x_below = np.where(a_below, x_a, x_b)
+    x_above = np.where(a_below, x_b, x_a)
+    frac = z_above/(z_above - z_below)
+    x = x_below*frac + x_above*(1. - frac)
+    if (start is not None) and np.any(start):
+      frac = z_below[start]/(z_below[start] - z_above[start])
+      x[start] = x_above[start]*frac + x_below[start]*(1. - frac)
+    return x
+
+@instrument.timed()
+def mask_zero_contour(latGrid, lonGrid, data, corner_mask=True):
+    ''' marks all the grid cells crossed by the zero contour line of data
+    works on (..., lat, lon) arrays, data can have leading (time) dimensions
+    gives the same mask as mask_zero_contour_mpl, without going through matplotlib 
+    the mask has the (float) dtype of data '''
+
+    data = np.asarray(data)
+    if (not np.issubdtype(data.dtype, np.floating)):
+      data = data.astype(float)
+    lat = np.asarray(latGrid[:,0], dtype=float)
+    lon = np.asarray(lonGrid[0,:], dtype=float)
+    lat_edges, lon_edges = zero_contour_edges(latGrid, lonGrid)
+
+    out_array = np.zeros(data.shape, dtype=data.dtype)
+
+    # contouring only uses quads with all 4 corners valid,
+    # with corner_mask quads with a single missing corner are contoured as triangles
+    valid = np.isfinite(data)
+    n_valid = np.int8(valid[..., :-1, :-1]) + valid[..., 1:, :-1] + valid[..., :-1, 1:] + valid[..., 1:, 1:]
+    if (corner_mask):
+      quad_ok = (n_valid >= 3)
+    else:
+      quad_ok = (n_valid == 4)
+
+    # an edge is contoured if it belongs to at least one valid quad
+    lead = quad_ok.shape[:-2]
+    no_row = np.zeros(lead + (1, quad_ok.shape[-1]), dtype=bool)
+    no_col = np.zeros(lead + (quad_ok.shape[-2], 1), dtype=bool)
+    use_x = np.concatenate((quad_ok, no_row), axis=-2) | np.concatenate((no_row, quad_ok), axis=-2)
+    use_y = np.concatenate((quad_ok, no_col), axis=-1) | np.concatenate((no_col, quad_ok), axis=-1)
+    use_x &= valid[..., :, :-1] & valid[..., :, 1:]
+    use_y &= valid[..., :-1, :] & valid[..., 1:, :]
+
+    # edges along the longitude (i, j) -> (i, j+1)
+    ind, z_below, z_above, a_below = _edge_crossings(data[..., :, :-1], data[..., :, 1:], use_x)
+    i, j = ind[-2], ind[-1]
+    start = (i == lat.size-1) & a_below
+    v_lat = [_interp(lat[i], lat[i], z_below, z_above, a_below, start)]
+    v_lon = [_interp(lon[j], lon[j+1], z_below, z_above, a_below, start)]
+    v_lead = [ind[:-2]]
+
+    # edges along the latitude (i, j) -> (i+1, j)
+    ind, z_below, z_above, a_below = _edge_crossings(data[..., :-1, :], data[..., 1:, :], use_y)
+    i, j = ind[-2], ind[-1]
+    start = (j == lon.size-1) & ~a_below
+    v_lat.append(_interp(lat[i], lat[i+1], z_below, z_above, a_below, start))
+    v_lon.append(_interp(lon[j], lon[j], z_below, z_above, a_below, start))
+    v_lead.append(ind[:-2])
+
+    # diagonals of the triangles made by quads with one missing corner
+    # the diagonal joins the two corners next to the missing one
+    if (corner_mask):
+      tri = (n_valid == 3)
+      diag_a = tri & ~(valid[..., :-1, :-1] & valid[..., 1:, 1:]) # (i, j+1) -> (i+1, j)
+      diag_b = tri & ~diag_a # (i, j) -> (i+1, j+1)
+
+      ind, z_below, z_above, a_below = _edge_crossings(data[..., :-1, 1:], data[..., 1:, :-1], diag_a)
+      i, j = ind[-2], ind[-1]
+      v_lat.append(_interp(lat[i], lat[i+1], z_below, z_above, a_below))
+      v_lon.append(_interp(lon[j+1], lon[j], z_below, z_above, a_below))
+      v_lead.append(ind[:-2])
+
+      ind, z_below, z_above, a_below = _edge_crossings(data[..., :-1, :-1], data[..., 1:, 1:], diag_b)
+      i, j = ind[-2], ind[-1]
+      v_lat.append(_interp(lat[i], lat[i+1], z_below, z_above, a_below))
+      v_lon.append(_interp(lon[j], lon[j+1], z_below, z_above, a_below))
+      v_lead.append(ind[:-2])
+
+    v_lat = np.concatenate(v_lat)
+    v_lon = np.concatenate(v_lon)
+    v_lead = tuple(np.concatenate(i_lead) for i_lead in zip(*v_lead))
+    instrument.count('mask_zero_contour.vertices', v_lat.size)
+
+    # rasterize the crossing points onto the grid, same as the histogram of the contour vertices
+    lat_ind = _bin_index(lat_edges, v_lat)
+    lon_ind = _bin_index(lon_edges, v_lon)
+    in_grid = (lat_ind >= 0) & (lat_ind < lat.size) & (lon_ind >= 0) & (lon_ind < lon.size)
+    out_array[tuple(i_lead[in_grid] for i_lead in v_lead) + (lat_ind[in_grid], lon_ind[in_grid])] = 1.
 
-    lonGrid, latGrid = np.meshgrid(lon, lat)
-
-    ul_lon = inLon[0,0]
-    ul_lat = inLat[0,0]
-    
-    lr_lon = inLon[-1,-1]
-    lr_lat = inLat[-1,-1]
-
-    ul_ind = np.argwhere((lonGrid == ul_lon) & (latGrid == ul_lat))
-    lr_ind = np.argwhere((lonGrid == lr_lon) & (latGrid == lr_lat))
-    
-    topo = phis[ul_ind[0][0]:lr_ind[0][0]+1, ul_ind[0][1]:lr_ind[0][1]+1]
-
-    return topo
-    
-    # create the mask for a threhold height as mountains
-
-    # return the mask 
-    pass
+    return out_array
 
 def geostrophic_thermal_advection(gx,gy,u,v):
     return -(u * gx + v * gy)
 
 def auto_derivative(data):
-    return np.gradient(data)
-
-def show(latGrid, lonGrid, data):
-
-    plt.figure()
-
-    ll_lon = np.nanmin(lonGrid)
-    ll_lat = np.nanmin(latGrid)
-    ur_lon = np.nanmax(lonGrid)
-    ur_lat = np.nanmax(latGrid)
-
-    cmap = mpl.cm.get_cmap('jet',16);
-
-    m = Basemap(projection='lcc',resolution='l',llcrnrlon=ll_lon,llcrnrlat=ll_lat,urcrnrlon=ur_lon,urcrnrlat=ur_lat,lat_1=ll_lat,lat_2=ur_lat,lat_0=50,lon_0=-107.)
-    m.drawmapboundary()
-    m.drawcoastlines()
-    x, y = m(lonGrid, latGrid)
-    vmin_val = np.nanmin(data)
-    vmax_val = np.nanmax(data)
-    m.pcolormesh(x, y, data,vmin=vmin_val,vmax=vmax_val,cmap=cmap)
-    plt.colorbar()
-    plt.show()
-
+    # derivative along the (lat, lon) axes, the last two axes of data
+    return np.gradient(data, axis=(-2, -1))
 
 def distance_in_deg(lon1, lat1, lon2, lat2):
 
@@ -506,14 +1447,21 @@ def distance_in_deg(lon1, lat1, lon2, lat2):
 
     return dist
 
+# distance in degrees used for the storm attribution in clean_fronts
+get_distance_deg = distance_in_deg
+
 # getting the gradient given lat, lon and data
-def geo_gradient(lat, lon, data):
+@instrument.timed()
+def geo_gradient(lat, lon, data, geometry=None):
 
     # compute the gradient of data, in dx, and dy
     dx, dy = auto_derivative(data)
 
     # get the distance matrix for the given lat and lon
-    distX, distY = compute_dist_grids(lat, lon)
+    # (in the precision of the gradient, so float32 data stays float32)
+    if (geometry is None):
+      geometry = get_grid_geometry(lat, lon)
+    distX, distY, _ = geometry.distances(dx.dtype)
 
     # # compute the d(data)/dx and d(data)/dy
     dx = dx / distX 
@@ -525,16 +1473,20 @@ def geo_gradient(lat, lon, data):
 
     return dx, dy 
 
-def geo_divergence(lat, lon, x, y):
+def geo_divergence(lat, lon, x, y, geometry=None):
 
-    x_dx, x_dy = geo_gradient(lat, lon, x)
-    y_dx, y_dy = geo_gradient(lat, lon, y)
+    if (geometry is None):
+      geometry = get_grid_geometry(lat, lon)
+
+    x_dx, x_dy = geo_gradient(lat, lon, x, geometry=geometry)
+    y_dx, y_dy = geo_gradient(lat, lon, y, geometry=geometry)
 
     div = x_dx + y_dy
 
     return div
 
 # computing the distance given the lat and lon grid
+@instrument.timed()
 def compute_dist_grids(lat, lon):
 
     # km per degree value
@@ -580,6 +1532,239 @@ def compute_dist_grids(lat, lon):
 
     return distX, distY
 
+# maximum number of grids kept in the grid geometry cache
+GRID_GEOMETRY_CACHE_SIZE = 8
+_grid_geometry_cache = OrderedDict()
+# the lat/lon arrays of the last lookup and their key, so the same arrays passed again are not hashed again
+_grid_geometry_last = {}
+
+class GridGeometry(object):
+    ''' distances and gradient spacing of a lat/lon grid, computed once and reused
+    for every field on the grid (use get_grid_geometry to get the cached one) 
+    periodic tells if the grid wraps around in longitude (global grids) '''
+
+    def __init__(self, lat, lon, periodic=True):
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        if (lat.shape != lon.shape) or (lat.ndim != 2):
+          raise ValueError('lat and lon must be 2d grids of the same shape')
+
+        self.shape = lat.shape
+        self.periodic = periodic
+        self.lat = lat
+        self.lon = lon
+
+        # np.gradient spacing of lat and lon (same as used in compute_dist_grids)
+        self.dxLat, self.dyLat = np.gradient(lat)
+        self.dxLon, self.dyLon = np.gradient(lon)
+
+        self.distX, self.distY = compute_dist_grids(lat, lon)
+        self.dist_avg = np.sqrt(self.distX**2 + self.distY**2)
+
+        # the arrays are shared between calls, so making sure they are not modified
+        for arr in (self.lat, self.lon, self.dxLat, self.dyLat, self.dxLon, self.dyLon, self.distX, self.distY, self.dist_avg):
+          arr.setflags(write=False)
+
+        self._distances = {np.dtype(np.double): (self.distX, self.distY, self.dist_avg)}
+
+    def distances(self, dtype=np.double):
+        ''' distX, distY, dist_avg in dtype (the single precision copies are made once) '''
+        dtype = np.dtype(dtype)
+        if (dtype not in self._distances):
+          dists = tuple(np.asarray(arr, dtype=dtype) for arr in (self.distX, self.distY, self.dist_avg))
+          for arr in dists:
+            arr.setflags(write=False)
+          self._distances[dtype] = dists
+        return self._distances[dtype]
+
+    @staticmethod
+    def key(lat, lon, periodic=True):
+        # key of the grid in the cache, using the values of lat and lon
+        lat = np.ascontiguousarray(lat, dtype=float)
+        lon = np.ascontiguousarray(lon, dtype=float)
+        digest = hashlib.sha1(lat.tobytes())
+        digest.update(lon.tobytes())
+        return (lat.shape, bool(periodic), digest.hexdigest())
+
+    def check_shape(self, shape):
+        if (tuple(shape[-2:]) != self.shape):
+          raise ValueError('data shape %s does not match the grid shape %s'%(str(tuple(shape)), str(self.shape)))
+
+def get_grid_geometry(lat, lon, periodic=True):
+    ''' returns the GridGeometry of the grid, from the cache if it was already computed
+    the cache keeps the GRID_GEOMETRY_CACHE_SIZE most recently used grids, the values of lat and lon are
+    hashed unless they are the same arrays as in the last call (arrays modified in place need clear_grid_geometry_cache) '''
+
+    key = _grid_geometry_key(lat, lon, periodic)
+    if (key in _grid_geometry_cache):
+      _grid_geometry_cache.move_to_end(key)
+      return _grid_geometry_cache[key]
+
+    geometry = GridGeometry(lat, lon, periodic=periodic)
+    _grid_geometry_cache[key] = geometry
+    while (len(_grid_geometry_cache) > GRID_GEOMETRY_CACHE_SIZE):
+      _grid_geometry_cache.popitem(last=False)
+
+    return geometry
+
+def _grid_geometry_key(lat, lon, periodic):
+    # GridGeometry.key, hashing lat and lon only when they are not the (still alive) arrays of the last lookup
+    last = _grid_geometry_last.get(bool(periodic))
+    if (last is not None) and (last[0]() is lat) and (last[1]() is lon) and (last[2] == (lat.shape, lon.shape)):
+      return last[3]
+
+    key = GridGeometry.key(lat, lon, periodic)
+    try:
+      _grid_geometry_last[bool(periodic)] = (weakref.ref(lat), weakref.ref(lon), (np.shape(lat), np.shape(lon)), key)
+    except TypeError:
+      # (lists and other objects with no weak references are always hashed)
+      _grid_geometry_last.pop(bool(periodic), None)
+    return key
+
+def clear_grid_geometry_cache():
+    _grid_geometry_cache.clear()
+    _grid_geometry_last.clear()
+
+# depth (in grid cells) of the hewson_1998 stencils: the three nested geo_gradient calls and the zero contour
+HEWSON_HALO = 4
+
+class GridRegion(object):
+    ''' bounding box (llat, ulat, llon, ulon) of a global lat/lon grid, with a halo of grid cells around it
+    so that the fronts computed on the sub grid (lat, lon) are the same as the global ones inside the box
+    the default halo covers smooth_iter passes of smooth_grid and the hewson_1998 stencils
+    llon > ulon is a box across the date line, if the box and its halo cross the edge of the grid in longitude,
+    the sub grid keeps all the longitudes (periodic, like the global grid) and only the latitudes are cut '''
+
+    def __init__(self, latGrid, lonGrid, llat, ulat, llon, ulon, halo=None, smooth_iter=10):
+        if (halo is None):
+          halo = smooth_iter + HEWSON_HALO
+        self.halo = halo
+        self.shape = latGrid.shape
+
+        lat = np.asarray(latGrid[:, 0])
+        lon = np.asarray(lonGrid[0, :])
+        num_lat, num_lon = self.shape
+
+        box_rows = np.where((lat >= llat) & (lat <= ulat))[0]
+        if (llon <= ulon):
+          box_cols = np.where((lon >= llon) & (lon <= ulon))[0]
+        else:
+          # across the date line, from llon going east
+          box_cols = np.r_[np.where(lon >= llon)[0], np.where(lon <= ulon)[0]]
+        if (box_rows.size == 0) or (box_cols.size == 0):
+          raise ValueError('no grid points in the box (%g, %g, %g, %g)'%(llat, ulat, llon, ulon))
+
+        self.rows = slice(max(box_rows.min() - halo, 0), min(box_rows.max() + halo + 1, num_lat))
+        if (llon <= ulon) and (box_cols.min() - halo >= 0) and (box_cols.max() + halo < num_lon):
+          self.cols = slice(box_cols.min() - halo, box_cols.max() + halo + 1)
+          self.periodic = False
+        else:
+          self.cols = slice(0, num_lon)
+          self.periodic = True
+
+        # box rows and cols in the sub grid
+        self.box_rows = box_rows - self.rows.start
+        self.box_cols = box_cols - self.cols.start
+        self.global_rows = box_rows
+        self.global_cols = box_cols
+
+        self.lat = np.asarray(latGrid)[self.rows, self.cols]
+        self.lon = np.asarray(lonGrid)[self.rows, self.cols]
+        self.geometry = get_grid_geometry(self.lat, self.lon, periodic=self.periodic)
+
+    def subset(self, data):
+        ''' the sub grid (with the halo) of a global (..., lat, lon) field '''
+        return np.asarray(data)[..., self.rows, self.cols]
+
+    def crop(self, data):
+        ''' the box (without the halo) of a (..., lat, lon) field on the sub grid '''
+        return np.asarray(data)[..., self.box_rows[:, None], self.box_cols[None, :]]
+
+    def to_global(self, data, fill_value=np.nan):
+        ''' a global (..., lat, lon) field with the cropped box values, fill_value outside the box '''
+        data = np.asarray(data)
+        out = np.full(data.shape[:-2] + self.shape, fill_value, dtype=np.result_type(data.dtype, np.min_scalar_type(fill_value)))
+        out[..., self.global_rows[:, None], self.global_cols[None, :]] = data
+        return out
+
+def hewson_1998_region(region, theta, u_wind, v_wind, smooth_iter=10, center_weight=4):
+    ''' hewson_1998 only on the GridRegion sub grid, for global (..., lat, lon) raw fields
+    the fields are smoothed smooth_iter times on the sub grid (set 0 if they are already smoothed)
+    returns wf, cf of the box (same as the global hewson_1998 of the smoothed fields, cropped to the box) '''
+
+    fields = region.subset(np.stack((theta, u_wind, v_wind)))
+    if (smooth_iter):
+      fields = smooth_grid(fields, iter=smooth_iter, center_weight=center_weight, geometry=region.geometry)
+
+    fronts = hewson_1998(region.lat, region.lon, fields[0], fields[1], fields[2], geometry=region.geometry)
+    return {'wf': region.crop(fronts['wf']), 'cf': region.crop(fronts['cf'])}
+
+class GridTiles(object):
+    ''' latitude bands of a global lat/lon grid, each one a GridRegion with a halo of HEWSON_HALO rows,
+    so hewson_1998 can run on the bands in parallel (hewson_1998_tiled) and give the same fronts as on the whole grid
+    by default there are 2 bands per cpu, at least 2*halo rows each, the band geometries are computed once here '''
+
+    def __init__(self, latGrid, lonGrid, num_tiles=None, halo=HEWSON_HALO):
+        latGrid = np.asarray(latGrid)
+        lonGrid = np.asarray(lonGrid)
+        num_lat = latGrid.shape[0]
+        if (num_tiles is None):
+          num_tiles = 2*(os.cpu_count() or 1)
+        num_tiles = int(max(1, min(num_tiles, num_lat // max(2*halo, 1))))
+
+        self.shape = latGrid.shape
+        self.halo = halo
+        self.row_edges = np.linspace(0, num_lat, num_tiles+1).round().astype(int)
+
+        lat = latGrid[:, 0]
+        self.regions = []
+        for r_start, r_end in zip(self.row_edges[:-1], self.row_edges[1:]):
+          band_lat = lat[r_start:r_end]
+          self.regions.append(GridRegion(latGrid, lonGrid, band_lat.min(), band_lat.max(), -np.inf, np.inf, halo=halo))
+
+    def __len__(self):
+        return len(self.regions)
+
+@instrument.timed()
+def hewson_1998_tiled(tiles, theta, u_wind, v_wind, num_workers=None, dtype=None, k1=HEWSON_K1, k2=HEWSON_K2):
+    ''' hewson_1998 of the (..., lat, lon) smoothed fields, computed band by band (GridTiles) on a pool of num_workers
+    threads (numpy releases the GIL in the array operations), and stitched back into the global wf, cf
+    the temporaries are the size of a band, so the peak memory is about num_workers bands instead of the whole grid '''
+
+    theta = np.asarray(theta)
+    u_wind = np.asarray(u_wind)
+    v_wind = np.asarray(v_wind)
+    if (theta.shape[-2:] != tiles.shape):
+      raise ValueError('data shape %s does not match the grid shape %s'%(str(theta.shape), str(tiles.shape)))
+
+    def run(region):
+      fronts = hewson_1998(region.lat, region.lon, region.subset(theta), region.subset(u_wind), region.subset(v_wind),
+          geometry=region.geometry, dtype=dtype, k1=k1, k2=k2)
+      return region, fronts
+
+    out = {}
+    num_workers = num_workers or os.cpu_count() or 1
+    with cf_futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+      for region, fronts in executor.map(run, tiles.regions):
+        for name in ('wf', 'cf'):
+          if (name not in out):
+            out[name] = np.empty(theta.shape, dtype=fronts[name].dtype)
+          # the bands cover all the longitudes, so their box is a block of rows
+          rows = slice(region.global_rows[0], region.global_rows[-1]+1)
+          out[name][..., rows, :] = fronts[name][..., region.box_rows[0]:region.box_rows[-1]+1, :]
+
+    return out
+
+def simmonds_region(region, u_prior, v_prior, u, v, smooth_iter=10, center_weight=4):
+    ''' simmonds_et_al_2012 only on the GridRegion sub grid, same as hewson_1998_region '''
+
+    fields = region.subset(np.stack((u_prior, v_prior, u, v)))
+    if (smooth_iter):
+      fields = smooth_grid(fields, iter=smooth_iter, center_weight=center_weight, geometry=region.geometry)
+
+    fronts = simmonds_et_al_2012(region.lat, region.lon, fields[0], fields[1], fields[2], fields[3])
+    return {'cf': region.crop(fronts['cf'])}
+
 
 '''
 def detect_fronts(latGrid, lonGrid, data, u850, v850, centerLat, centerLon):
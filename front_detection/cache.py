@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+'''
+On disk cache of the smoothed and derived fields, shared by the detection variants
+
+Running hewson_1998 on theta850 and theta1km, simmonds_et_al_2012, or other k1/k2 thresholds on the same
+input files smooths the same fields and computes the same gradients again each time. FieldCache keeps them
+under a folder, one .npy file per field and time step, read back memory mapped (read only, no copy).
+Entries are keyed by the input file (path, size and modification time), the time step, the field name and
+the parameters that produced it (smoothing, level, dtype, ...), so any change gives a new entry.
+The least recently used entries are removed once the folder is over max_bytes. Writes go through a
+temporary file and a rename, so worker processes can share the same folder. Each instance (one per worker)
+only counts its own writes, so the size of the folder is read again from disk once it is half full, and
+every max_bytes/16 written: with N workers the folder goes over max_bytes by at most about one entry per
+worker (or N/16 of max_bytes with more than 8 workers filling an empty folder).
+
+Example:
+  cache = FieldCache('/localdrive/drive10/jj/fronts_cache', max_bytes=20*2**30)
+  for step in reader.read_steps(files, cache=cache):
+    fields = cache.hewson_fields(step, 'theta850')
+    f_hew = fd.hewson_1998_masks(fields, step['u850'], step['v850'], geometry, k1=0.3, k2=1.5)
+'''
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+import front_detection as fd
+from front_detection import instrument
+
+# derived fields of hewson_1998 that are kept (what hewson_1998_masks needs)
+HEWSON_FIELDS = ('gx', 'gy', 'grad_norm', 'mu_x', 'mu_y', 'eq7', 'zc_7')
+
+# the size of the folder is read again from disk (to see the writes of the other workers) once the cache is
+# over RESCAN_FRACTION of max_bytes, and every RESCAN_WRITTEN of max_bytes written by the instance
+RESCAN_FRACTION = .5
+RESCAN_WRITTEN = 1/16.
+
+def file_id(in_file):
+    # the same file as long as it is not modified
+    stat = os.stat(in_file)
+    return [os.path.abspath(in_file), stat.st_size, stat.st_mtime_ns]
+
+class FieldCache(object):
+    ''' memory mapped cache of (..., lat, lon) fields under root, at most max_bytes on disk
+    (the fields returned are read only np.memmap) '''
+
+    def __init__(self, root, max_bytes=10*2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._bytes = self.size()
+        # bytes written since the size was last read from disk
+        self._written = 0
+
+    def key(self, in_file, t_ind, field, **params):
+        ''' name of the entry of field at time step t_ind of in_file, computed with params '''
+        desc = json.dumps([file_id(in_file), int(t_ind), field, params], sort_keys=True, default=str)
+        return field + '_' + hashlib.sha1(desc.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key + '.npy')
+
+    def get(self, key):
+        ''' memory mapped field, or None if it is not in the cache '''
+        path = self._path(key)
+        try:
+          data = np.load(path, mmap_mode='r')
+          # most recently used
+          os.utime(path)
+        except (OSError, ValueError):
+          self.misses += 1
+          instrument.count('cache.misses')
+          return None
+        self.hits += 1
+        instrument.count('cache.hits')
+        return data
+
+    def put(self, key, data):
+        ''' stores data and returns it memory mapped from the cache '''
+        data = np.asarray(data)
+        path = self._path(key)
+        tmp_path = '%s.%s.tmp'%(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+          np.save(f, data)
+        size = os.path.getsize(tmp_path)
+        # an entry written again (e.g. by another worker) replaces the file, it is not added to it
+        try:
+          replaced = os.path.getsize(path)
+        except OSError:
+          replaced = 0
+        os.replace(tmp_path, path)
+        self._bytes += size - replaced
+        self._written += size
+
+        # mapped before evicting (it stays readable if its file is removed, by this or another worker),
+        # data itself is returned if the file is already gone
+        try:
+          out = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+          out = data
+
+        if (self._bytes > RESCAN_FRACTION*self.max_bytes) or (self._written > RESCAN_WRITTEN*self.max_bytes):
+          self._bytes = self.size()
+          self._written = 0
+        if (self._bytes > self.max_bytes):
+          self.evict(keep=(path,))
+        return out
+
+    def get_or_compute(self, key, compute):
+        data = self.get(key)
+        if (data is None):
+          data = self.put(key, compute())
+        return data
+
+    def get_all(self, keys):
+        ''' dict name -> field for the dict name -> key, None if one of them is missing '''
+        out = {}
+        for name, key in keys.items():
+          out[name] = self.get(key)
+          if (out[name] is None):
+            return None
+        return out
+
+    def get_many(self, keys, compute):
+        ''' same as get_all, but compute() (giving a dict with all of them) is called if one of them is missing '''
+        out = self.get_all(keys)
+        if (out is not None):
+          return out
+
+        fields = compute()
+        return dict((name, self.put(key, fields[name])) for name, key in keys.items())
+
+    def entries(self):
+        ''' (last use time, bytes, path) of all the entries, oldest first '''
+        out = []
+        with os.scandir(self.root) as it:
+          for entry in it:
+            if (not entry.name.endswith('.npy')):
+              continue
+            try:
+              stat = entry.stat()
+            except OSError:
+              continue
+            out.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(out)
+
+    def size(self):
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self, max_bytes=None, keep=()):
+        ''' removes the least recently used entries until the cache is under 90% of max_bytes 
+        (except the paths in keep, e.g. the entry just written, even if it alone is over max_bytes) '''
+        max_bytes = self.max_bytes if (max_bytes is None) else max_bytes
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+          if (total <= 0.9*max_bytes):
+            break
+          if (path in keep):
+            continue
+          # (a memory mapped field stays readable after its file is removed)
+          try:
+            os.remove(path)
+          except OSError:
+            pass
+          total -= size
+          instrument.count('cache.evicted')
+        self._bytes = total
+        self._written = 0
+
+    def clear(self):
+        self.evict(max_bytes=0)
+
+    def hewson_fields(self, step, theta_field='theta850', geometry=None, dtype=None, **params):
+        ''' hewson_1998_fields of step[theta_field] (a step of reader.read_steps(cache=...), with its params),
+        from the cache or computed and stored, for hewson_1998_masks '''
+
+        params = dict(step.get('params', {}), theta_field=theta_field, dtype=np.dtype(dtype or np.double).name, **params)
+        keys = dict((name, self.key(step['file'], step['t_step'], 'hewson_' + name, **params)) for name in HEWSON_FIELDS)
+
+        def compute():
+          return fd.hewson_1998_fields(step['lat'], step['lon'], step[theta_field], geometry=geometry, dtype=dtype)
+
+        return self.get_many(keys, compute)
@@ -1,82 +1,119 @@
-import numpy as np 
+import numpy as np
 from netCDF4 import Dataset
+import datetime as dt
+import calendar
 import glob
+import json
 import os
-
-def fronts_for_date(latGrid, lonGrid, year, month, day, hour):
-    #################### CATHERINE FRONTS ###############
-   
-    # initilazing output array as zeros
-    wf = np.zeros(latGrid.shape)
-    cf = np.zeros(latGrid.shape)
-
-    # get list of files in the folder
-    c_folder = '/mnt/drive1/processed_data/MERRA2fronts/%04d%02d/'%(year, month)
-
-    # select date
-    selectDate = '%04d%02d%02d'%(year, month, day)
-
-    # string to search in the main c_folder (YYYY/MM folder)
-    search_string = os.path.join(c_folder, '*%s_%02d*.ncdf'%(selectDate, hour))
-    c_files = glob.glob(search_string)
-   
-    # if no files are found
-    if (not c_files):
-        print ("Catherine's front file not found.")
-        return wf, cf
-   
-    # if found, then continue with the following code
-    # for each file found, read in the lat, lon
-    # grid them into a .5 x .625 hist2d to find the location of the fronts
-    cf_lon = []
-    cf_lat = []
-    wf_lat = []
-    wf_lon = []
-
-    for c_file in c_files:
-      print (c_file)
-      dataset = Dataset(c_file)
-      dataset.set_auto_mask(False)
-      c_lat = dataset.variables['latitude'][:]
-      c_lon = dataset.variables['longitude'][:]
-      c_slp = dataset.variables['MERRA2SLP'][:]
-      c_info = dataset.variables['storm_info'][:]
-
-      # CF_combined, CF_simmonds850, CF_hewson1km
-      # c_cf = dataset.variables['CF_combined'][:]
-      # c_cf = dataset.variables['CF_simmonds850'][:]
-      c_cf = dataset.variables['CF_hewson1km'][:]
-      c_cf_lon = c_cf[:,0]
-      c_cf_lat = c_cf[:,1]
-
-      cf_lat.extend(c_cf_lat.tolist())
-      cf_lon.extend(c_cf_lon.tolist())
-
-      # WF_Hewson850, WF_Hewson1Km, WF_HewsonWB
-      c_wf = dataset.variables['WF_Hewson1km'][:] 
-      # c_wf = dataset.variables['WF_Hewson850'][:] 
-      c_wf_lon = c_wf[:,0]
-      c_wf_lat = c_wf[:,1]
-      
-      wf_lat.extend(c_wf_lat.tolist())
-      wf_lon.extend(c_wf_lon.tolist())
-
-      dataset.close()
-
-    wf_lat = np.asarray(wf_lat)
-    wf_lon = np.asarray(wf_lon)
-    
-    cf_lat = np.asarray(cf_lat)
-    cf_lon = np.asarray(cf_lon)
-
-    invalid_ind = (wf_lat == -999.) | (wf_lon == -999.)
-    wf_lat = wf_lat[~invalid_ind]
-    wf_lon = wf_lon[~invalid_ind]
-    
-    invalid_ind = (cf_lat == -999.) | (cf_lon == -999.)
-    cf_lat = cf_lat[~invalid_ind]
-    cf_lon = cf_lon[~invalid_ind]
-
+import re
+from collections import OrderedDict
+
+import front_detection as fd
+
+# folder of Catherine's fronts, one YYYYMM sub folder per month
+CATH_FOLDER = '/mnt/drive1/processed_data/MERRA2fronts/'
+
+# number of gridded time steps kept in memory by fronts_for_date
+CATH_CACHE_SIZE = 64
+_cath_cache = OrderedDict()
+_cath_indexes = {}
+
+class FrontIndex(object):
+    ''' index of Catherine's front files, YYYYMMDD_HH -> files, for all the YYYYMM folders under root
+    the index is saved to index_file (root/fronts_index.json by default) and reloaded next time,
+    only the month folders modified since are listed again, files() checks the mtime of the month folder
+    it reads from, so files added (or removed) after the index was built are seen '''
+
+    def __init__(self, root=CATH_FOLDER, index_file=None):
+        self.root = root
+        self.index_file = index_file or os.path.join(root, 'fronts_index.json')
+        self.months = {}
+
+        if (os.path.exists(self.index_file)):
+          with open(self.index_file, 'r') as f:
+            saved = json.load(f)
+          if (saved.get('root') == os.path.abspath(root)):
+            self.months = saved['months']
+
+        self.update()
+
+    def update(self):
+        # lists the month folders that are new or were modified since the index was built
+        changed = False
+        month_folders = glob.glob(os.path.join(self.root, '[0-9]'*6))
+        for month_folder in month_folders:
+          month = os.path.basename(month_folder)
+          mtime = os.path.getmtime(month_folder)
+          if (month in self.months) and (self.months[month]['mtime'] == mtime):
+            continue
+          self.months[month] = {'mtime': mtime, 'files': self._list_month(month_folder)}
+          changed = True
+
+        # removed folders
+        names = set(os.path.basename(month_folder) for month_folder in month_folders)
+        for month in [month for month in self.months if (month not in names)]:
+          del self.months[month]
+          changed = True
+
+        if (changed):
+          self.save()
+
+    @staticmethod
+    def _list_month(month_folder):
+        # same files as the '*YYYYMMDD_HH*.ncdf' glob of fronts_for_date
+        files = {}
+        for c_file in sorted(os.listdir(month_folder)):
+          if (not c_file.endswith('.ncdf')):
+            continue
+          for date_hour in set('%s_%s'%(d, h) for d, h in re.findall(r'(?=(\d{8})_(\d{2}))', c_file)):
+            files.setdefault(date_hour, []).append(c_file)
+        return files
+
+    def save(self):
+        # the index is only a cache, so not being able to write it is fine
+        try:
+          tmp_file = self.index_file + '.tmp'
+          with open(tmp_file, 'w') as f:
+            json.dump({'root': os.path.abspath(self.root), 'months': self.months}, f)
+          os.replace(tmp_file, self.index_file)
+        except OSError:
+          pass
+
+    def _month_files(self, month_key):
+        # date_hour -> files of the month, listed again if the month folder changed since
+        month_folder = os.path.join(self.root, month_key)
+        try:
+          mtime = os.path.getmtime(month_folder)
+        except OSError:
+          if (self.months.pop(month_key, None) is not None):
+            self.save()
+          return {}
+        if (month_key not in self.months) or (self.months[month_key]['mtime'] != mtime):
+          self.months[month_key] = {'mtime': mtime, 'files': self._list_month(month_folder)}
+          self.save()
+        return self.months[month_key]['files']
+
+    def files(self, year, month, day, hour):
+        month_key = '%04d%02d'%(year, month)
+        month_files = self._month_files(month_key)
+        names = month_files.get('%04d%02d%02d_%02d'%(year, month, day, hour), [])
+        return [os.path.join(self.root, month_key, name) for name in names]
+
+def get_index(root=CATH_FOLDER, index_file=None):
+    ''' returns the FrontIndex of root, built (or loaded from disk) on the first call only
+    the same index is kept for the whole process, its months are refreshed by files() when their folder
+    mtime changes, clear_cache() drops it (the next call rebuilds it from index_file and the folders) '''
+    key = (os.path.abspath(root), index_file)
+    if (key not in _cath_indexes):
+      _cath_indexes[key] = FrontIndex(root, index_file)
+    return _cath_indexes[key]
+
+def clear_cache():
+    _cath_cache.clear()
+    _cath_indexes.clear()
+
+def grid_edges(latGrid, lonGrid):
+    # bin edges of the grid cells, used to grid the front points
     lat_edges = np.asarray(latGrid[:,0])
     lon_edges = np.asarray(lonGrid[0,:])
 
@@ -88,12 +125,113 @@ def fronts_for_date(latGrid, lonGrid, year, month, day, hour):
 
     lon_edges = lon_edges - lon_div/2.
     lon_edges = np.append(lon_edges, lon_edges[-1]+lon_div)
-    
-    wf, _, _ = np.histogram2d(wf_lat, wf_lon, bins=(lat_edges, lon_edges))
-    wf = np.double(wf > 0)
-    
-    cf, _, _ = np.histogram2d(cf_lat, cf_lon, bins=(lat_edges, lon_edges))
-    cf = np.double(cf > 0)
-
-    return wf, cf, c_slp, c_lat, c_lon
-        
+
+    return lat_edges, lon_edges
+
+def read_front_file(c_file):
+    ''' reads the warm and cold front points and the slp of one of Catherine's files
+    the -999 points are removed '''
+
+    dataset = Dataset(c_file)
+    dataset.set_auto_mask(False)
+    out = {
+      'lat': dataset.variables['latitude'][:],
+      'lon': dataset.variables['longitude'][:],
+      'slp': dataset.variables['MERRA2SLP'][:],
+    }
+
+    # CF_combined, CF_simmonds850, CF_hewson1km
+    c_cf = np.asarray(dataset.variables['CF_hewson1km'][:])
+    # WF_Hewson850, WF_Hewson1Km, WF_HewsonWB
+    c_wf = np.asarray(dataset.variables['WF_Hewson1km'][:])
+    dataset.close()
+
+    for name, c_front in (('wf', c_wf), ('cf', c_cf)):
+      valid = (c_front[:,0] != -999.) & (c_front[:,1] != -999.)
+      out[name + '_lon'] = c_front[valid, 0]
+      out[name + '_lat'] = c_front[valid, 1]
+
+    return out
+
+def grid_points(lat, lon, lat_edges, lon_edges, out):
+    # sets the cells of out with at least one point to 1, same bins as np.histogram2d
+    inside = (lat >= lat_edges[0]) & (lat <= lat_edges[-1]) & (lon >= lon_edges[0]) & (lon <= lon_edges[-1])
+    out[fd._bin_index(lat_edges, lat[inside]), fd._bin_index(lon_edges, lon[inside])] = 1
+    return out
+
+def _grid_files(latGrid, lonGrid, c_files):
+    # gridded wf, cf of all the files of one time step, and the slp/lat/lon of the last file
+    lat_edges, lon_edges = grid_edges(latGrid, lonGrid)
+    wf = np.zeros(latGrid.shape)
+    cf = np.zeros(latGrid.shape)
+
+    for c_file in c_files:
+      data = read_front_file(c_file)
+      grid_points(data['wf_lat'], data['wf_lon'], lat_edges, lon_edges, wf)
+      grid_points(data['cf_lat'], data['cf_lon'], lat_edges, lon_edges, cf)
+
+    return wf, cf, data['slp'], data['lat'], data['lon']
+
+def fronts_for_date(latGrid, lonGrid, year, month, day, hour, root=CATH_FOLDER, index=None):
+    ''' Catherine's warm and cold fronts gridded on latGrid/lonGrid, with her slp, lat and lon
+    the files are found with the FrontIndex of root (no glob), and the gridded results of the
+    CATH_CACHE_SIZE most recent calls are kept, the returned arrays are read only
+    if there are no files, wf, cf are zeros and slp, lat, lon are None '''
+
+    index = index or get_index(root)
+    c_files = index.files(year, month, day, hour)
+
+    # if no files are found
+    if (not c_files):
+        print ("Catherine's front file not found.")
+        return np.zeros(latGrid.shape), np.zeros(latGrid.shape), None, None, None
+
+    # the gridding only depends on the lat/lon of the grid rows/columns
+    key = (tuple(c_files), fd.GridGeometry.key(latGrid[:,0], lonGrid[0,:]))
+    if (key in _cath_cache):
+      _cath_cache.move_to_end(key)
+      return _cath_cache[key]
+
+    result = _grid_files(latGrid, lonGrid, c_files)
+    for arr in result:
+      arr.setflags(write=False)
+
+    _cath_cache[key] = result
+    while (len(_cath_cache) > CATH_CACHE_SIZE):
+      _cath_cache.popitem(last=False)
+
+    return result
+
+def fronts_for_month(latGrid, lonGrid, year, month, hours=(0, 6, 12, 18), root=CATH_FOLDER, index=None):
+    ''' Catherine's fronts for all the time steps of a month, gridded on latGrid/lonGrid
+    returns a dict with dates, found (if there were files for the time step), and wf, cf as (time, lat, lon)
+    each file is read once, and the points of all the time steps are gridded together '''
+
+    index = index or get_index(root)
+    lat_edges, lon_edges = grid_edges(latGrid, lonGrid)
+
+    num_days = calendar.monthrange(year, month)[1]
+    dates = [dt.datetime(year, month, day, hour) for day in range(1, num_days+1) for hour in hours]
+    found = np.zeros(len(dates), dtype=bool)
+
+    points = {'wf': ([], [], []), 'cf': ([], [], [])}
+    for t_ind, date in enumerate(dates):
+      c_files = index.files(date.year, date.month, date.day, date.hour)
+      found[t_ind] = bool(c_files)
+      for c_file in c_files:
+        data = read_front_file(c_file)
+        for name in ('wf', 'cf'):
+          points[name][0].append(np.full(data[name + '_lat'].size, t_ind))
+          points[name][1].append(data[name + '_lat'])
+          points[name][2].append(data[name + '_lon'])
+
+    out = {'dates': np.asarray(dates), 'found': found}
+    for name in ('wf', 'cf'):
+      fronts = np.zeros((len(dates),) + latGrid.shape)
+      if (points[name][0]):
+        t_ind, lat, lon = (np.concatenate(x) for x in points[name])
+        inside = (lat >= lat_edges[0]) & (lat <= lat_edges[-1]) & (lon >= lon_edges[0]) & (lon <= lon_edges[-1])
+        fronts[t_ind[inside], fd._bin_index(lat_edges, lat[inside]), fd._bin_index(lon_edges, lon[inside])] = 1
+      out[name] = fronts
+
+    return out
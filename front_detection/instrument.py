@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+'''
+Opt-in timers and counters for the front detection stages
+
+Disabled by default, every hook then only checks one flag (the laps/stage objects are shared no-op singletons).
+Once enabled, each stage records its number of calls and wall time, and with track_memory (tracemalloc,
+numpy reports its allocations to it) the bytes allocated and the peak memory of the stage.
+Counters are for sizes like the number of contour vertices or clusters.
+Stages inside stages are named with dots (hewson_1998.gradients), the nested times are included in the outer ones.
+
+Example:
+  from front_detection import instrument
+  instrument.enable(track_memory=True)
+  ... run the detection ...
+  instrument.to_json('profile.json')
+  instrument.to_csv('profile.csv')
+
+Setting the FRONT_DETECTION_INSTRUMENT environment variable (to 1, or memory) enables it at import.
+'''
+import csv
+import datetime as dt
+import functools
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+
+_enabled = False
+_track_memory = False
+_lock = threading.Lock()
+_local = threading.local()
+_stages = {}
+_counters = {}
+
+def enabled():
+    return _enabled
+
+def enable(track_memory=False):
+    ''' starts recording, track_memory also records the bytes allocated (slower, uses tracemalloc) '''
+    global _enabled, _track_memory
+    _track_memory = track_memory
+    if (track_memory) and (not tracemalloc.is_tracing()):
+      tracemalloc.start()
+    _enabled = True
+
+def disable():
+    global _enabled, _track_memory
+    _enabled = False
+    if (_track_memory) and (tracemalloc.is_tracing()):
+      tracemalloc.stop()
+    _track_memory = False
+
+def reset():
+    with _lock:
+      _stages.clear()
+      _counters.clear()
+
+def _stack():
+    if (not hasattr(_local, 'stack')):
+      _local.stack = []
+    return _local.stack
+
+def _record(name, elapsed, allocated=0, peak=0):
+    with _lock:
+      stats = _stages.get(name)
+      if (stats is None):
+        stats = _stages[name] = {'calls': 0, 'time': 0., 'max_time': 0., 'bytes': 0, 'peak_bytes': 0}
+      stats['calls'] += 1
+      stats['time'] += elapsed
+      stats['max_time'] = max(stats['max_time'], elapsed)
+      stats['bytes'] += allocated
+      stats['peak_bytes'] = max(stats['peak_bytes'], peak)
+
+def count(name, value=1):
+    ''' adds value to the counter name '''
+    if (not _enabled):
+      return
+    with _lock:
+      _counters[name] = _counters.get(name, 0) + value
+
+class _Stage(object):
+    # one running stage, the memory peak of inner stages is passed up to the outer ones
+    # (tracemalloc has only one peak, which is reset at the start of each stage)
+
+    def __init__(self, name):
+        self.name = name
+
+    def start(self):
+        stack = _stack()
+        if (stack):
+          self.name = stack[-1].prefix + '.' + self.name
+        # name given to the stages inside this one
+        self.prefix = self.name
+        self.inner_peak = 0
+        if (_track_memory):
+          self.mem_start, peak = tracemalloc.get_traced_memory()
+          if (stack):
+            stack[-1].inner_peak = max(stack[-1].inner_peak, peak)
+          tracemalloc.reset_peak()
+        stack.append(self)
+        self.t_start = time.perf_counter()
+        return self
+
+    def stop(self, record=True):
+        elapsed = time.perf_counter() - self.t_start
+        stack = _stack()
+        # (stages left open by an exception are dropped too)
+        while (stack) and (stack.pop() is not self):
+          pass
+        allocated = peak = 0
+        if (_track_memory):
+          mem_end, mem_peak = tracemalloc.get_traced_memory()
+          mem_peak = max(mem_peak, self.inner_peak)
+          allocated = mem_end - self.mem_start
+          peak = mem_peak - self.mem_start
+          if (stack):
+            stack[-1].inner_peak = max(stack[-1].inner_peak, mem_peak)
+        if (record):
+          _record(self.name, elapsed, allocated, peak)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+class _Laps(object):
+    # consecutive sub stages of a function, lap(name) closes the current one and names it
+
+    def __init__(self, name):
+        self.outer = _Stage(name).start()
+        self._next()
+
+    def _next(self):
+        # stages inside a lap are named after the function, not the lap
+        self.current = _Stage('').start()
+        self.current.prefix = self.outer.name
+
+    def lap(self, name):
+        self.current.name = self.outer.name + '.' + name
+        self.current.stop()
+        self._next()
+
+    def done(self, name=None):
+        if (name):
+          self.lap(name)
+        # the last (unnamed) lap is dropped
+        self.current.stop(record=False)
+        self.outer.stop()
+
+class _NoOp(object):
+    # shared object returned when disabled, does nothing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def lap(self, name):
+        pass
+
+    def done(self, name=None):
+        pass
+
+_noop = _NoOp()
+
+def stage(name):
+    ''' context manager timing the block as stage name '''
+    if (not _enabled):
+      return _noop
+    return _Stage(name)
+
+def laps(name):
+    ''' timer of the consecutive parts of a function:
+    t = laps('hewson_1998'); ...; t.lap('gradients'); ...; t.lap('m1_m2'); t.done() '''
+    if (not _enabled):
+      return _noop
+    return _Laps(name)
+
+def timed(name=None):
+    ''' decorator timing every call of the function as a stage '''
+    def decorator(func):
+      stage_name = name or func.__name__
+
+      @functools.wraps(func)
+      def wrapper(*args, **kwargs):
+        if (not _enabled):
+          return func(*args, **kwargs)
+        with _Stage(stage_name):
+          return func(*args, **kwargs)
+      return wrapper
+    return decorator
+
+def report():
+    ''' dict with the stages (calls, time, mean_time, max_time, bytes, peak_bytes) and the counters '''
+    with _lock:
+      stages = dict((name, dict(stats, mean_time=stats['time']/stats['calls'])) for name, stats in _stages.items())
+      counters = dict(_counters)
+    return {
+      'created': dt.datetime.now().isoformat(),
+      'host': platform.node(),
+      'pid': os.getpid(),
+      'track_memory': _track_memory,
+      'stages': stages,
+      'counters': counters,
+    }
+
+def merge(other):
+    ''' adds a report (e.g. from a worker process) to the current records '''
+    with _lock:
+      for name, stats in other['stages'].items():
+        mine = _stages.setdefault(name, {'calls': 0, 'time': 0., 'max_time': 0., 'bytes': 0, 'peak_bytes': 0})
+        mine['calls'] += stats['calls']
+        mine['time'] += stats['time']
+        mine['max_time'] = max(mine['max_time'], stats['max_time'])
+        mine['bytes'] += stats['bytes']
+        mine['peak_bytes'] = max(mine['peak_bytes'], stats['peak_bytes'])
+      for name, value in other['counters'].items():
+        _counters[name] = _counters.get(name, 0) + value
+
+def to_json(out_file, extra=None):
+    out = report()
+    if (extra):
+      out.update(extra)
+    with open(out_file, 'w') as f:
+      json.dump(out, f, indent=2, sort_keys=True)
+    return out
+
+def to_csv(out_file):
+    out = report()
+    with open(out_file, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(['name', 'kind', 'calls', 'time', 'mean_time', 'max_time', 'bytes', 'peak_bytes', 'value'])
+      for name in sorted(out['stages']):
+        stats = out['stages'][name]
+        writer.writerow([name, 'stage', stats['calls'], stats['time'], stats['mean_time'], stats['max_time'],
+            stats['bytes'], stats['peak_bytes'], ''])
+      for name in sorted(out['counters']):
+        writer.writerow([name, 'counter', '', '', '', '', '', '', out['counters'][name]])
+    return out
+
+if (os.environ.get('FRONT_DETECTION_INSTRUMENT', '').lower() not in ('', '0', 'false')):
+  enable(track_memory=(os.environ['FRONT_DETECTION_INSTRUMENT'].lower() == 'memory'))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+'''
+Incremental front detection, for analyses arriving one time step at a time
+
+FrontDetector keeps everything that does not change from one time step to the next: the grid geometry,
+the smoother and its buffers, and the smoothed winds of the previous time step (needed by simmonds_et_al_2012).
+update() only smooths the new fields once and runs the detection for that time step, so the work (and the time)
+per step is the same for every step.
+
+Example:
+  detector = FrontDetector(lat, lon, latency_budget=2.)
+  for step in reader.read_steps(files, smooth_iter=0):
+    fronts = detector.update(step)
+    if (fronts is not None):
+      writer.write(fronts['date'], fronts)
+'''
+import time
+
+import numpy as np
+
+import front_detection as fd
+
+class FrontDetector(object):
+    ''' stateful front detection, update(step_fields) gives the fronts of each new time step
+    step_fields is a dict with the raw (not smoothed) u850, v850 and theta850 (or theta_field) (lat, lon) fields,
+    and optionally the date, like the steps of reader.read_steps(smooth_iter=0)
+    the fields are smoothed smooth_iter times, then wf is from hewson_1998 and cf from simmonds_et_al_2012,
+    cleaned up with filter_front_clusters (min_size)
+    if region (GridRegion) is given, only the region sub grid is computed and the fronts are for the region box
+    latency_budget (s) is only measured against, nothing is skipped or cut short to meet it: the steps that took 
+    longer are counted in over_budget and flagged in their result (over_budget), for the caller to act on,
+    dtype=np.float32 keeps the fields and the smoothing in single precision '''
+
+    def __init__(self, latGrid, lonGrid, smooth_iter=10, center_weight=4, theta_field='theta850', min_size=3,
+          region=None, latency_budget=None, dtype=np.double):
+
+        self.smooth_iter = smooth_iter
+        self.theta_field = theta_field
+        self.min_size = min_size
+        self.region = region
+        self.latency_budget = latency_budget
+        self.dtype = np.dtype(dtype)
+
+        if (region is not None):
+          self.lat, self.lon, self.geometry = region.lat, region.lon, region.geometry
+        else:
+          self.lat, self.lon = np.asarray(latGrid), np.asarray(lonGrid)
+          self.geometry = fd.get_grid_geometry(self.lat, self.lon)
+
+        # u, v, theta of the current step, smoothed together, and the smoothed winds of the previous step
+        shape = (3,) + self.lat.shape
+        self.smoother = fd.GridSmoother(shape, center_weight=center_weight, periodic=self.geometry.periodic, dtype=self.dtype)
+        self._raw = np.empty(shape, dtype=self.dtype)
+        self._smoothed = np.empty(shape, dtype=self.dtype)
+        self._prev_winds = np.empty((2,) + self.lat.shape, dtype=self.dtype)
+
+        self.reset()
+
+    def reset(self):
+        ''' forgets the previous time step (e.g. after a gap in the feed) '''
+        self.has_prev = False
+        self.prev_date = None
+        self.last = None
+        self.num_steps = 0
+        self.over_budget = 0
+        self.last_latency = None
+
+    def _subset(self, data):
+        if (self.region is not None):
+          return self.region.subset(data)
+        return data
+
+    def _crop(self, data):
+        if (self.region is not None):
+          return self.region.crop(data)
+        return data
+
+    def update(self, step_fields):
+        ''' smooths the new fields and computes the fronts of the time step
+        returns a dict with date, wf, cf, latency (s) and over_budget (True if latency is over latency_budget), 
+        or None for the very first time step
+        (simmonds_et_al_2012 needs the previous time step winds) '''
+
+        t_start = time.perf_counter()
+
+        self._raw[0] = self._subset(step_fields['u850'])
+        self._raw[1] = self._subset(step_fields['v850'])
+        self._raw[2] = self._subset(step_fields[self.theta_field])
+        if (self.smooth_iter):
+          self.smoother.smooth(self._raw, iter=self.smooth_iter, out=self._smoothed)
+        else:
+          np.copyto(self._smoothed, self._raw)
+        u, v, theta = self._smoothed
+
+        result = None
+        if (self.has_prev):
+          f_sim = fd.simmonds_et_al_2012(self.lat, self.lon, self._prev_winds[0], self._prev_winds[1], u, v)
+          f_hew = fd.hewson_1998(self.lat, self.lon, theta, u, v, geometry=self.geometry, dtype=self.dtype)
+          wf, cf = fd.filter_front_clusters(self._crop(f_hew['wf']), self._crop(f_sim['cf']), min_size=self.min_size)
+          result = {'date': step_fields.get('date'), 'wf': wf, 'cf': cf}
+
+        # the smoothed winds are kept for the next time step
+        np.copyto(self._prev_winds, self._smoothed[:2])
+        self.has_prev = True
+        self.prev_date = step_fields.get('date')
+        self.num_steps += 1
+
+        latency = time.perf_counter() - t_start
+        self.last_latency = latency
+        over_budget = (self.latency_budget is not None) and (latency > self.latency_budget)
+        if (over_budget):
+          self.over_budget += 1
+
+        if (result is not None):
+          result['latency'] = latency
+          result['over_budget'] = over_budget
+          self.last = result
+
+        return result
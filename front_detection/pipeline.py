@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+'''
+Multi-year front climatology driver
+
+Runs the front detection (smoothing, simmonds_et_al_2012, hewson_1998 and the cluster clean up)
+over a date range of MERRA-2 inst6_3d_ana_Np daily files, one file (day) per task on a process pool.
+The results are written by the main process into one netCDF output store, that is preallocated
+for the whole date range, so a run that crashes can be restarted and only the days not done are computed.
+With an output folder ending in .zarr, the fronts (and the diagnostics, m1, m2, eq7, grad_norm, if asked) go to a
+chunked store.FrontArrayStore instead, written directly by the workers (one day per chunk, no locks).
+
+Usage:
+  python -m front_detection.pipeline --start 2007-01-01 --end 2016-12-31 \
+      --files '/localdrive/drive10/merra2/inst6_3d_ana_Np/MERRA2_*.inst6_3d_ana_Np.*.nc4' \
+      --out fronts_2007_2016.nc --workers 8
+  python -m front_detection.pipeline ... --out fronts_2007_2016.zarr --diagnostics m1,m2
+'''
+import argparse
+import concurrent.futures as cf_futures
+import datetime as dt
+import glob
+import os
+import re
+
+import numpy as np
+from netCDF4 import Dataset
+
+import front_detection as fd
+from front_detection import instrument
+from front_detection import reader
+from front_detection.cache import FieldCache
+from front_detection.store import DIAGNOSTICS, FrontArrayStore
+
+# value of the missing time steps in the output store
+MISSING = 255
+
+def parse_date(date):
+    if isinstance(date, dt.datetime):
+      return date.date()
+    if isinstance(date, dt.date):
+      return date
+    return dt.datetime.strptime(date, '%Y-%m-%d').date()
+
+def date_from_file(in_file):
+    # MERRA-2 files have the date as the last 8 digit number in the file name
+    dates = re.findall(r'(\d{8})', os.path.basename(in_file))
+    if (not dates):
+      return None
+    return dt.datetime.strptime(dates[-1], '%Y%m%d').date()
+
+def files_for_dates(file_glob, start_date, end_date):
+    ''' returns a dict of date -> file, for the files matching file_glob between start_date and end_date (inclusive)
+    the file of the day before start_date is also included if available, for the previous time step winds '''
+
+    start_date = parse_date(start_date)
+    end_date = parse_date(end_date)
+    first_date = start_date - dt.timedelta(days=1)
+
+    files = {}
+    for in_file in sorted(glob.glob(file_glob)):
+      date = date_from_file(in_file)
+      if (date is None) or (date < first_date) or (date > end_date):
+        continue
+      files[date] = in_file
+
+    return files
+
+def detect_fronts_for_file(in_file, prev_file=None, lev=850, smooth_iter=10, center_weight=4, steps_per_day=4, theta_level='850', dtype=np.double,
+      cache=None, k1=fd.HEWSON_K1, k2=fd.HEWSON_K2, diagnostics=()):
+    ''' computes the fronts for all the time steps of one inst6_3d_ana_Np file
+    returns the date, the index of the time steps in the day, and the wf, cf masks (time, lat, lon) as uint8
+    (no time steps if there are none to compute, e.g. a single time step file without prev_file)
+    and the diagnostics of hewson_1998 asked for (of store.DIAGNOSTICS, (time, lat, lon) as float32)
+    if there is no prev_file, the first time step is skipped, as simmonds needs the previous time step winds 
+    theta_level is the theta used for hewson_1998, '850' or '1km', dtype=np.float32 runs in single precision 
+    with a cache (cache.FieldCache), the smoothed fields and the hewson_1998_fields are reused from (or stored in) it,
+    so other variants (theta_level, k1, k2) of the same files only compute what changes '''
+
+    date = date_from_file(in_file)
+
+    steps = list(reader.read_steps(in_file, prev_file=prev_file, lev=lev, smooth_iter=smooth_iter, center_weight=center_weight, dtype=dtype,
+        cache=cache))
+    if (not steps):
+      # e.g. a file with a single time step and no prev_file, the first time step is skipped
+      ncid = Dataset(in_file, 'r')
+      shape = (0, ncid.variables['lat'].size, ncid.variables['lon'].size)
+      ncid.close()
+      result = {'file': in_file, 'date': date, 'steps': np.zeros(0, dtype=int), 'wf': np.zeros(shape, dtype=np.uint8),
+          'cf': np.zeros(shape, dtype=np.uint8)}
+      for name in diagnostics:
+        result[name] = np.zeros(shape, dtype=np.float32)
+      return result
+
+    lat = steps[0]['lat']
+    lon = steps[0]['lon']
+    geometry = fd.get_grid_geometry(lat, lon)
+
+    def stack(name):
+      return np.stack([step[name] for step in steps])
+
+    u, v = stack('u850'), stack('v850')
+    f_sim = fd.simmonds_et_al_2012(lat, lon, stack('prev_u850'), stack('prev_v850'), u, v)
+    diag = dict((name, []) for name in diagnostics)
+    if (cache is None) and (not diagnostics):
+      f_hew = fd.hewson_1998_batch(lat, lon, stack('theta' + theta_level), u, v, geometry=geometry, dtype=dtype, k1=k1, k2=k2)
+    else:
+      # one time step at a time, the cache has the fields of each time step
+      fronts = []
+      for step in steps:
+        if (cache is None):
+          fields = fd.hewson_1998_fields(lat, lon, step['theta' + theta_level], geometry=geometry, dtype=dtype)
+        else:
+          fields = cache.hewson_fields(step, 'theta' + theta_level, geometry=geometry, dtype=dtype)
+        fronts.append(fd.hewson_1998_masks(fields, step['u850'], step['v850'], geometry, k1=k1, k2=k2))
+        if ('m1' in diag) or ('m2' in diag):
+          fields = dict(fields, **dict(zip(('m1', 'm2'), fd.hewson_1998_m1_m2(fields, geometry))))
+        for name in diag:
+          diag[name].append(np.float32(fields[name]))
+      f_hew = dict((name, np.stack([f[name] for f in fronts])) for name in ('wf', 'cf'))
+
+    wf, cf = fd.filter_front_clusters(f_hew['wf'], f_sim['cf'], min_size=3)
+
+    # index of the time steps in the day
+    step_hours = 24./steps_per_day
+    day_steps = np.asarray([int((step['date'].hour + step['date'].minute/60.) // step_hours) for step in steps])
+
+    result = {'file': in_file, 'date': date, 'steps': day_steps, 'wf': np.uint8(wf), 'cf': np.uint8(cf)}
+    for name in diag:
+      result[name] = np.stack(diag[name])
+
+    # timings of this file, sent back with the result when instrumented
+    if (instrument.enabled()):
+      result['profile'] = instrument.report()
+      instrument.reset()
+
+    return result
+
+def sweep_file(in_file, k1_values, k2_values, prev_file=None, lev=850, smooth_iter=10, center_weight=4, theta_level='850',
+      dtype=np.double, cache=None):
+    ''' hewson_1998 warm/cold front counts and areas for all the (k1, k2) pairs, for all the time steps of one file
+    returns a dict with the file, date, dates of the time steps, k1, k2, and wf_count, cf_count, wf_area, cf_area
+    (k1, k2, time), in one pass over the file (see hewson_1998_sweep), with cache the fields are reused '''
+
+    k1_values = np.atleast_1d(np.asarray(k1_values, dtype=float))
+    k2_values = np.atleast_1d(np.asarray(k2_values, dtype=float))
+
+    counts = []
+    dates = []
+    for step in reader.read_steps(in_file, prev_file=prev_file, lev=lev, smooth_iter=smooth_iter, center_weight=center_weight,
+        dtype=dtype, cache=cache):
+      geometry = fd.get_grid_geometry(step['lat'], step['lon'])
+      if (cache is None):
+        fields = fd.hewson_1998_fields(step['lat'], step['lon'], step['theta' + theta_level], geometry=geometry, dtype=dtype)
+      else:
+        fields = cache.hewson_fields(step, 'theta' + theta_level, geometry=geometry, dtype=dtype)
+      candidates = fd.hewson_1998_candidates(fields, step['u850'], step['v850'], geometry)
+      counts.append(fd.sweep_counts(candidates, k1_values, k2_values))
+      dates.append(step['date'])
+
+    result = {'file': in_file, 'date': date_from_file(in_file), 'dates': dates, 'k1': k1_values, 'k2': k2_values}
+    for name in ('wf_count', 'cf_count', 'wf_area', 'cf_area'):
+      result[name] = np.stack([count[name] for count in counts], axis=-1)
+    return result
+
+class FrontStore(object):
+    ''' netCDF store of the front masks for a date range, preallocated for all the time steps
+    each day is written in its own slot, and flagged in day_done once it is written,
+    so writing a day again gives the same file (restarts are safe) '''
+
+    def __init__(self, out_file, start_date, end_date, lat, lon, steps_per_day=4):
+
+        self.out_file = out_file
+        self.start_date = parse_date(start_date)
+        self.end_date = parse_date(end_date)
+        self.steps_per_day = steps_per_day
+        self.num_days = (self.end_date - self.start_date).days + 1
+
+        if (os.path.exists(out_file)):
+          self.ncid = Dataset(out_file, 'a')
+          self._check()
+        else:
+          self._create(lat, lon)
+
+    def _create(self, lat, lon):
+        ncid = Dataset(self.out_file, 'w', format='NETCDF4')
+        ncid.createDimension('time', self.num_days*self.steps_per_day)
+        ncid.createDimension('day', self.num_days)
+        ncid.createDimension('lat', lat.size)
+        ncid.createDimension('lon', lon.size)
+        ncid.start_date = self.start_date.strftime('%Y-%m-%d')
+        ncid.end_date = self.end_date.strftime('%Y-%m-%d')
+        ncid.steps_per_day = self.steps_per_day
+
+        time = ncid.createVariable('time', 'f8', ('time',))
+        time.units = 'hours since %s 00:00:00'%(self.start_date.strftime('%Y-%m-%d'))
+        time[:] = np.arange(self.num_days*self.steps_per_day) * 24./self.steps_per_day
+
+        ncid.createVariable('lat', 'f8', ('lat',))[:] = lat
+        ncid.createVariable('lon', 'f8', ('lon',))[:] = lon
+        ncid.createVariable('day_done', 'u1', ('day',), fill_value=0)
+
+        for var_name in ('wf', 'cf'):
+          var = ncid.createVariable(var_name, 'u1', ('time', 'lat', 'lon'), fill_value=MISSING,
+              zlib=True, chunksizes=(1, lat.size, lon.size))
+          var.missing_value = MISSING
+
+        ncid.sync()
+        self.ncid = ncid
+
+    def _check(self):
+        # making sure we are restarting the same run
+        ncid = self.ncid
+        if (ncid.start_date != self.start_date.strftime('%Y-%m-%d')) or (ncid.end_date != self.end_date.strftime('%Y-%m-%d')) \
+            or (int(ncid.steps_per_day) != self.steps_per_day):
+          raise ValueError('%s was created for another date range (%s to %s)'%(self.out_file, ncid.start_date, ncid.end_date))
+
+    def day_index(self, date):
+        return (parse_date(date) - self.start_date).days
+
+    def done_dates(self):
+        done = np.asarray(self.ncid.variables['day_done'][:]) == 1
+        return set(self.start_date + dt.timedelta(days=int(i)) for i in np.where(done)[0])
+
+    def write(self, result):
+        i_day = self.day_index(result['date'])
+        t_ind = i_day*self.steps_per_day + np.asarray(result['steps'])
+        for i, i_t in enumerate(t_ind):
+          self.ncid.variables['wf'][i_t, :, :] = result['wf'][i]
+          self.ncid.variables['cf'][i_t, :, :] = result['cf'][i]
+        self.ncid.sync()
+
+        # only flagged once the data is on disk
+        self.ncid.variables['day_done'][i_day] = 1
+        self.ncid.sync()
+
+    def close(self):
+        self.ncid.close()
+
+def detect_fronts_to_store(store_root, in_file, *args, **kwargs):
+    ''' detect_fronts_for_file, written by the worker itself into the FrontArrayStore at store_root 
+    (each day has its own chunks, so workers write different days at the same time without locks)
+    returns the date (and the profile) only '''
+
+    result = detect_fronts_for_file(in_file, *args, **kwargs)
+    FrontArrayStore(store_root).write(result)
+
+    return dict((key, result[key]) for key in ('file', 'date', 'profile') if (key in result))
+
+def run_climatology(start_date, end_date, file_glob, out_file, num_workers=None, max_pending=None, lev=850,
+      smooth_iter=10, center_weight=4, steps_per_day=4, theta_level='850', profile_file=None, dtype=np.double, cache=None,
+      diagnostics=(), k1=fd.HEWSON_K1, k2=fd.HEWSON_K2):
+    ''' runs the front detection for all the days between start_date and end_date (inclusive)
+    on a process pool of num_workers, and writes the fronts to out_file
+    (netCDF FrontStore, or FrontArrayStore written by the workers with the diagnostics if out_file ends with .zarr)
+    at most max_pending days are queued/in memory at once (default 2x the number of workers)
+    the days already done in out_file are skipped, so the same call can be used to resume a run 
+    if profile_file is given, the workers are instrumented and the timings of all the days are written to it
+    (csv if it ends with .csv, else json), dtype=np.float32 runs the detection in single precision 
+    cache (cache.FieldCache) is shared by all the workers, k1, k2 are the hewson_1998 thresholds, see detect_fronts_for_file '''
+
+    start_date = parse_date(start_date)
+    end_date = parse_date(end_date)
+
+    files = files_for_dates(file_glob, start_date, end_date)
+    dates = sorted(date for date in files if (date >= start_date))
+    if (not dates):
+      print('No files found for %s between %s and %s'%(file_glob, start_date, end_date))
+      return
+
+    # grid for the output store
+    ncid = Dataset(files[dates[0]], 'r')
+    lat = np.asarray(ncid.variables['lat'][:])
+    lon = np.asarray(ncid.variables['lon'][:])
+    ncid.close()
+
+    worker_writes = out_file.rstrip(os.sep).endswith('.zarr')
+    if (worker_writes):
+      store = FrontArrayStore(out_file, start_date, end_date, lat, lon, steps_per_day=steps_per_day, diagnostics=diagnostics)
+    elif (diagnostics):
+      raise ValueError('the diagnostics can only be written to a .zarr output store')
+    else:
+      store = FrontStore(out_file, start_date, end_date, lat, lon, steps_per_day=steps_per_day)
+    done = store.done_dates()
+    todo = [date for date in dates if (date not in done)]
+    print('%d days to do, %d already done'%(len(todo), len(dates) - len(todo)))
+
+    num_workers = num_workers or os.cpu_count()
+    max_pending = max_pending or 2*num_workers
+
+    def write(result):
+      if ('profile' in result):
+        instrument.merge(result['profile'])
+      if (not worker_writes):
+        store.write(result)
+
+    initializer = instrument.enable if (profile_file) else None
+    if (profile_file):
+      instrument.reset()
+
+    try:
+      with cf_futures.ProcessPoolExecutor(max_workers=num_workers, initializer=initializer) as executor:
+        pending = set()
+        for date in todo:
+          # bounded queue, waiting for a day to finish before submitting more
+          while (len(pending) >= max_pending):
+            finished, pending = cf_futures.wait(pending, return_when=cf_futures.FIRST_COMPLETED)
+            for future in finished:
+              write(future.result())
+
+          kwargs = {'prev_file': files.get(date - dt.timedelta(days=1)), 'lev': lev, 'smooth_iter': smooth_iter,
+              'center_weight': center_weight, 'steps_per_day': steps_per_day, 'theta_level': theta_level, 'dtype': dtype,
+              'cache': cache, 'k1': k1, 'k2': k2}
+          if (worker_writes):
+            pending.add(executor.submit(detect_fronts_to_store, out_file, files[date], diagnostics=tuple(diagnostics), **kwargs))
+          else:
+            pending.add(executor.submit(detect_fronts_for_file, files[date], **kwargs))
+
+        for future in cf_futures.as_completed(pending):
+          write(future.result())
+    finally:
+      store.close()
+      if (profile_file):
+        if (profile_file.endswith('.csv')):
+          instrument.to_csv(profile_file)
+        else:
+          instrument.to_json(profile_file, extra={'start_date': str(start_date), 'end_date': str(end_date), 'num_days': len(todo)})
+
+def main():
+    parser = argparse.ArgumentParser(description='Front climatology from MERRA-2 inst6_3d_ana_Np files')
+    parser.add_argument('--start', required=True, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='last date, YYYY-MM-DD')
+    parser.add_argument('--files', required=True, help='glob of the daily input files')
+    parser.add_argument('--out', required=True, help='output netCDF file, or chunked store folder if it ends with .zarr (resumed if it exists)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--max-pending', type=int, default=None, help='maximum number of days queued at once')
+    parser.add_argument('--lev', type=float, default=850, help='pressure level of the winds and theta (hPa)')
+    parser.add_argument('--theta', default='850', choices=['850', '1km'], help='theta used for the hewson fronts')
+    parser.add_argument('--profile', default=None, help='write the stage timings to this json (or .csv) file')
+    parser.add_argument('--float32', action='store_true', help='run the detection in single precision')
+    parser.add_argument('--cache', default=None, help='folder of the cache of the smoothed and derived fields')
+    parser.add_argument('--cache-size', type=float, default=10., help='maximum size of the cache (GB)')
+    parser.add_argument('--k1', type=float, default=fd.HEWSON_K1, help='hewson_1998 m1 threshold (degC per 100km per 100km)')
+    parser.add_argument('--k2', type=float, default=fd.HEWSON_K2, help='hewson_1998 m2 threshold (degC per 100km)')
+    parser.add_argument('--diagnostics', default='', help='comma separated diagnostics also stored (.zarr output only), of %s'%(', '.join(DIAGNOSTICS)))
+    args = parser.parse_args()
+
+    cache = None
+    if (args.cache):
+      cache = FieldCache(args.cache, max_bytes=int(args.cache_size*2**30))
+
+    run_climatology(args.start, args.end, args.files, args.out, num_workers=args.workers,
+        max_pending=args.max_pending, lev=args.lev, theta_level=args.theta, profile_file=args.profile,
+        dtype=np.float32 if (args.float32) else np.double, cache=cache,
+        diagnostics=tuple(name for name in args.diagnostics.split(',') if (name)), k1=args.k1, k2=args.k2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+Plotting helpers and the matplotlib versions of the kernels
+
+Kept out of the front_detection package itself, so that importing it (e.g. in the pipeline worker processes)
+does not load matplotlib and Basemap, fd.show and fd.mask_zero_contour_mpl still work (imported on first use).
+'''
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib as mpl
+
+import front_detection as fd
+
+def mask_zero_contour_mpl(latGrid, lonGrid, data):
+    ''' original matplotlib contour version of mask_zero_contour, kept as a reference '''
+    
+    plt.figure() 
+    cs = plt.contour(latGrid, lonGrid, data, levels=[0]) 
+    plt.close()
+
+    cdt = np.asarray([])
+    for line in cs.allsegs[0]:
+        cdt_line = np.asarray(line)
+        if (cdt.size == 0):
+          cdt = cdt_line
+        else:
+          cdt = np.vstack((cdt, cdt_line))
+
+    if (cdt.size == 0):
+      return np.zeros(data.shape)
+
+    lat_edges, lon_edges = fd.zero_contour_edges(latGrid, lonGrid)
+    
+    H, _, _ = np.histogram2d(cdt[:, 0], cdt[:, 1], bins=(lat_edges, lon_edges))
+    out_array = np.double(H > 0)
+
+    return out_array
+
+def show(latGrid, lonGrid, data):
+    # Basemap is only needed (and imported) here
+    from mpl_toolkits.basemap import Basemap
+
+    plt.figure()
+
+    ll_lon = np.nanmin(lonGrid)
+    ll_lat = np.nanmin(latGrid)
+    ur_lon = np.nanmax(lonGrid)
+    ur_lat = np.nanmax(latGrid)
+
+    cmap = mpl.cm.get_cmap('jet',16);
+
+    m = Basemap(projection='lcc',resolution='l',llcrnrlon=ll_lon,llcrnrlat=ll_lat,urcrnrlon=ur_lon,urcrnrlat=ur_lat,lat_1=ll_lat,lat_2=ur_lat,lat_0=50,lon_0=-107.)
+    m.drawmapboundary()
+    m.drawcoastlines()
+    x, y = m(lonGrid, latGrid)
+    vmin_val = np.nanmin(data)
+    vmax_val = np.nanmax(data)
+    m.pcolormesh(x, y, data,vmin=vmin_val,vmax=vmax_val,cmap=cmap)
+    plt.colorbar()
+    plt.show()
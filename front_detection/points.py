@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+'''
+Compact front point files
+
+Fronts cover well under 1% of the grid, so instead of the dense (time, lat, lon) masks, each time step
+is stored as the list of its front points (row, col, type, cluster_id), CSR style: the points of all the
+time steps are appended one after the other, and start/count give the points of each time step.
+type is WARM (1) or COLD (2), cluster_id the label of the cluster of the point in its time step and type
+(8-connected, like the clusters of filter_front_clusters, the warm/cold_front_clusters of clean_fronts are
+4-connected, so diagonally touching points with one cluster_id can be two clusters there).
+Everything is in one netCDF file with unlimited dimensions, so time steps can be appended to it.
+
+Example:
+  writer = FrontPointWriter('fronts_2007.nc', lat, lon)
+  for step in reader.read_steps(files):
+    f_sim = fd.simmonds_et_al_2012(...)
+    f_hew = fd.hewson_1998(...)
+    writer.write(step['date'], {'wf': f_hew['wf'], 'cf': f_sim['cf']})
+  writer.close()
+
+  points = FrontPointReader('fronts_2007.nc')
+  masks = points.dense(slice(0, 40), window=(slice(200, 300), slice(0, 100)))
+'''
+import os
+
+import numpy as np
+from netCDF4 import Dataset, date2num, num2date
+from scipy.ndimage import generate_binary_structure, label
+
+WARM = 1
+COLD = 2
+FRONT_TYPES = {'wf': WARM, 'cf': COLD}
+
+TIME_UNITS = 'hours since 1900-01-01 00:00:00'
+
+def front_points(fronts):
+    ''' row, col, type, cluster_id of all the front points of one time step
+    fronts is a dict with 'wf' and/or 'cf' (lat, lon) masks, e.g. the result of hewson_1998 or simmonds_et_al_2012,
+    points are where the mask is > 0 (nans are not fronts) '''
+
+    out = ([], [], [], [])
+    for name, f_type in sorted(FRONT_TYPES.items(), key=lambda x: x[1]):
+      if (fronts.get(name) is None):
+        continue
+      with np.errstate(invalid='ignore'):
+        mask = np.asarray(fronts[name]) > 0
+      labels, _ = label(mask, structure=generate_binary_structure(2, 2))
+      row, col = np.nonzero(mask)
+      out[0].append(row)
+      out[1].append(col)
+      out[2].append(np.full(row.size, f_type))
+      out[3].append(labels[row, col])
+
+    if (not out[0]):
+      return tuple(np.zeros(0, dtype=int) for i in range(4))
+    return tuple(np.concatenate(x) for x in out)
+
+def merge_fronts(*results):
+    # wf and cf of all the results together (a point is a front if it is in any of them)
+    merged = {}
+    for result in results:
+      for name in FRONT_TYPES:
+        if (result.get(name) is None):
+          continue
+        with np.errstate(invalid='ignore'):
+          mask = np.asarray(result[name]) > 0
+        merged[name] = (merged[name] | mask) if (name in merged) else mask
+    return merged
+
+class FrontPointWriter(object):
+    ''' appends the front points of each time step to out_file, created if it does not exist
+    (lat and lon are the 2d grids or the 1d lat/lon vectors of the grid) '''
+
+    def __init__(self, out_file, lat, lon, zlib=True):
+
+        self.out_file = out_file
+        lat = np.asarray(lat)
+        lon = np.asarray(lon)
+        if (lat.ndim == 2):
+          lat, lon = lat[:, 0], lon[0, :]
+
+        if (os.path.exists(out_file)):
+          self.ncid = Dataset(out_file, 'a')
+          if (self.ncid.dimensions['lat'].size != lat.size) or (self.ncid.dimensions['lon'].size != lon.size):
+            self.ncid.close()
+            raise ValueError('%s was created for another grid'%(out_file))
+        else:
+          self._create(lat, lon, zlib)
+
+        self.num_times = self.ncid.dimensions['time'].size
+        self.num_points = self.ncid.dimensions['point'].size
+
+    def _create(self, lat, lon, zlib):
+        ncid = Dataset(self.out_file, 'w', format='NETCDF4')
+        ncid.createDimension('time', None)
+        ncid.createDimension('point', None)
+        ncid.createDimension('lat', lat.size)
+        ncid.createDimension('lon', lon.size)
+        ncid.warm_type = WARM
+        ncid.cold_type = COLD
+
+        ncid.createVariable('lat', 'f8', ('lat',))[:] = lat
+        ncid.createVariable('lon', 'f8', ('lon',))[:] = lon
+
+        time = ncid.createVariable('time', 'f8', ('time',))
+        time.units = TIME_UNITS
+        ncid.createVariable('start', 'i8', ('time',))
+        ncid.createVariable('count', 'i4', ('time',))
+
+        for var_name, var_type in (('row', 'u2'), ('col', 'u2'), ('type', 'u1'), ('cluster_id', 'i4')):
+          ncid.createVariable(var_name, var_type, ('point',), zlib=zlib, chunksizes=(1<<16,))
+
+        self.ncid = ncid
+
+    def write(self, date, *results):
+        ''' appends one time step, results are dicts with 'wf' and/or 'cf' (lat, lon) masks
+        (hewson_1998, simmonds_et_al_2012 outputs, or {'wf': ..., 'cf': ...}), merged if more than one
+        date can also be a list of dates, with (time, lat, lon) masks '''
+
+        if (np.ndim(date) > 0):
+          for t_ind, t_date in enumerate(date):
+            self.write(t_date, *[dict((name, result[name][t_ind]) for name in FRONT_TYPES if (result.get(name) is not None)) for result in results])
+          return
+
+        row, col, f_type, cluster_id = front_points(merge_fronts(*results))
+
+        ncid = self.ncid
+        t_ind = self.num_times
+        p_slice = slice(self.num_points, self.num_points + row.size)
+        if (row.size > 0):
+          ncid.variables['row'][p_slice] = row
+          ncid.variables['col'][p_slice] = col
+          ncid.variables['type'][p_slice] = f_type
+          ncid.variables['cluster_id'][p_slice] = cluster_id
+
+        # the points are written before the time step refers to them, the first write below already grows
+        # the unlimited time dimension, so start goes last: the time step is complete once start is set
+        ncid.variables['time'][t_ind] = date2num(date, TIME_UNITS)
+        ncid.variables['count'][t_ind] = row.size
+        ncid.variables['start'][t_ind] = self.num_points
+
+        self.num_times += 1
+        self.num_points += row.size
+
+    def sync(self):
+        self.ncid.sync()
+
+    def close(self):
+        self.ncid.close()
+
+class FrontPointReader(object):
+    ''' reads the front points written by FrontPointWriter, dense masks are only built for the
+    time steps and the (row, col) window asked for '''
+
+    def __init__(self, in_file):
+
+        self.in_file = in_file
+        ncid = Dataset(in_file, 'r')
+        ncid.set_auto_mask(False)
+        self.ncid = ncid
+
+        self.lat = np.asarray(ncid.variables['lat'][:])
+        self.lon = np.asarray(ncid.variables['lon'][:])
+        self.shape = (self.lat.size, self.lon.size)
+
+        # the index of the time steps is small, so it is read once
+        time = ncid.variables['time']
+        self.dates = np.asarray(num2date(time[:], time.units, only_use_cftime_datetimes=False))
+        self.start = np.asarray(ncid.variables['start'][:])
+        self.count = np.asarray(ncid.variables['count'][:])
+
+    def __len__(self):
+        return self.dates.size
+
+    def _time_indexes(self, t_ind):
+        if isinstance(t_ind, slice):
+          return np.arange(len(self))[t_ind]
+        return np.atleast_1d(np.arange(len(self))[t_ind])
+
+    def points(self, t_ind):
+        ''' dict with the row, col, type, cluster_id of the points of time step t_ind '''
+        p_slice = slice(self.start[t_ind], self.start[t_ind] + self.count[t_ind])
+        return dict((var_name, np.asarray(self.ncid.variables[var_name][p_slice]))
+            for var_name in ('row', 'col', 'type', 'cluster_id'))
+
+    def dense(self, t_ind, window=None, types=('wf', 'cf')):
+        ''' rebuilds the dense masks of the time steps t_ind (int, slice or indexes)
+        window is a (row slice, col slice) of the grid, the whole grid by default
+        returns a dict with a (time, lat, lon) bool mask for each of types (wf, cf) '''
+
+        t_inds = self._time_indexes(t_ind)
+        rows, cols = window if (window is not None) else (slice(None), slice(None))
+        row_ind = np.arange(self.shape[0])[rows]
+        col_ind = np.arange(self.shape[1])[cols]
+
+        # grid row/col -> window row/col, -1 outside of the window
+        row_map = np.full(self.shape[0], -1)
+        row_map[row_ind] = np.arange(row_ind.size)
+        col_map = np.full(self.shape[1], -1)
+        col_map[col_ind] = np.arange(col_ind.size)
+
+        out = dict((name, np.zeros((t_inds.size, row_ind.size, col_ind.size), dtype=bool)) for name in types)
+        if (t_inds.size == 0):
+          return out
+
+        # one read of all the points when the time steps follow each other, else one read per time step
+        if (np.all(np.diff(t_inds) == 1)):
+          p_slice = slice(self.start[t_inds[0]], self.start[t_inds[-1]] + self.count[t_inds[-1]])
+          data = dict((var_name, np.asarray(self.ncid.variables[var_name][p_slice])) for var_name in ('row', 'col', 'type'))
+        else:
+          parts = [self.points(i) for i in t_inds]
+          data = dict((var_name, np.concatenate([part[var_name] for part in parts])) for var_name in ('row', 'col', 'type'))
+        point_t = np.repeat(np.arange(t_inds.size), self.count[t_inds])
+
+        w_row = row_map[data['row']]
+        w_col = col_map[data['col']]
+        inside = (w_row >= 0) & (w_col >= 0)
+        for name in types:
+          sel = inside & (data['type'] == FRONT_TYPES[name])
+          out[name][point_t[sel], w_row[sel], w_col[sel]] = True
+
+        return out
+
+    def iter_dense(self, window=None, types=('wf', 'cf'), chunk_size=1):
+        ''' generator over all the time steps, yields the date and the dense masks of chunk_size time steps at a time '''
+        for first in range(0, len(self), chunk_size):
+          t_slice = slice(first, min(first + chunk_size, len(self)))
+          yield self.dates[t_slice], self.dense(t_slice, window=window, types=types)
+
+    def close(self):
+        self.ncid.close()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+'''
+Streaming time step reader for MERRA-2 inst6_3d_ana_Np files
+
+read_steps yields, for each time step, the fields needed by the front detection
+(theta850, theta1km, u850, v850 and the previous time step u850, v850), already smoothed.
+The next time step is read on a background thread while the current one is processed,
+only the levels needed are read (one contiguous hyperslab from the surface up to p_top),
+and the smoothed winds are carried over to the next time step, so they are read and smoothed once.
+
+Example:
+  for step in read_steps(sorted(glob.glob('/localdrive/drive10/merra2/inst6_3d_ana_Np/*.2007*.nc4'))):
+    f_sim = fd.simmonds_et_al_2012(step['lat'], step['lon'], step['prev_u850'], step['prev_v850'], step['u850'], step['v850'])
+    f_hew = fd.hewson_1998(step['lat'], step['lon'], step['theta850'], step['u850'], step['v850'])
+'''
+import concurrent.futures as cf_futures
+
+import numpy as np
+from netCDF4 import Dataset, num2date
+
+import front_detection as fd
+
+def read_var(var, t_ind, lev_slice, dtype=float):
+    # contiguous read of one time step, fill values are set to nan
+    data = np.asarray(var[t_ind, lev_slice, :, :], dtype=dtype)
+    fill_value = getattr(var, '_FillValue', None)
+    if (fill_value is not None):
+      data[data == fill_value] = np.nan
+    return data
+
+class _FileReader(object):
+    ''' reads the raw fields of one time step, keeps the current file open
+    all the reads are done from the same (prefetch) thread '''
+
+    def __init__(self, lev=850, p_top=400., dtype=float):
+        self.lev = lev
+        self.p_top = p_top
+        self.dtype = dtype
+        self.in_file = None
+        self.ncid = None
+
+    def open(self, in_file):
+        if (in_file == self.in_file):
+          return
+        self.close()
+
+        ncid = Dataset(in_file, 'r')
+        ncid.set_auto_mask(False)
+        self.ncid = ncid
+        self.in_file = in_file
+
+        self.lat = np.asarray(ncid.variables['lat'][:])
+        self.lon = np.asarray(ncid.variables['lon'][:])
+        in_lev = np.asarray(ncid.variables['lev'][:], dtype=float)
+        time = ncid.variables['time']
+        self.dates = num2date(time[:], time.units, only_use_cftime_datetimes=False)
+
+        # levels from the surface up to p_top, and the index of the front level in it
+        # (levels go from the surface up in MERRA-2 files, so this is one contiguous block)
+        lev_ind = np.where(in_lev >= min(self.p_top, self.lev))[0]
+        self.lev_slice = slice(lev_ind.min(), lev_ind.max()+1)
+        self.levels = in_lev[self.lev_slice]
+        self.lev_ind = int(np.where(self.levels == self.lev)[0][0])
+
+    def num_steps(self, in_file):
+        self.open(in_file)
+        return len(self.dates)
+
+    def winds(self, in_file, t_ind):
+        self.open(in_file)
+        lev_slice = slice(self.lev_slice.start + self.lev_ind, self.lev_slice.start + self.lev_ind + 1)
+        u = read_var(self.ncid.variables['U'], t_ind, lev_slice, self.dtype)[0]
+        v = read_var(self.ncid.variables['V'], t_ind, lev_slice, self.dtype)[0]
+        return u, v
+
+    def info(self, in_file, t_ind):
+        # file, time step, date and grid, without reading any field
+        self.open(in_file)
+        return {
+          'file': in_file,
+          't_step': t_ind,
+          'date': self.dates[t_ind],
+          'lat': self.lat,
+          'lon': self.lon,
+        }
+
+    def step(self, in_file, t_ind):
+        out = self.info(in_file, t_ind)
+        u, v = self.winds(in_file, t_ind)
+        out.update({
+          'levels': self.levels,
+          'lev_ind': self.lev_ind,
+          'u': u,
+          'v': v,
+          'T': read_var(self.ncid.variables['T'], t_ind, self.lev_slice, self.dtype),
+          'H': read_var(self.ncid.variables['H'], t_ind, self.lev_slice, self.dtype)/9.8,
+        })
+        return out
+
+    def close(self):
+        if (self.ncid is not None):
+          self.ncid.close()
+        self.ncid = None
+        self.in_file = None
+
+# smoothed fields of each time step, in the order they are smoothed
+SMOOTHED_FIELDS = ('u850', 'v850', 'theta850', 'theta1km')
+
+def read_steps(files, prev_file=None, lev=850, p_top=400., smooth_iter=10, center_weight=4, prefetch=True, dtype=np.double,
+      cache=None):
+    ''' generator over all the time steps of files (in order), yields a dict with
+    date, lat/lon grids, theta850, theta1km, u850, v850, prev_u850, prev_v850 (all smoothed)
+    the very first time step is skipped (no previous winds) unless prev_file is given,
+    in which case the previous winds are read from the last time step of prev_file
+    set smooth_iter=0 to get the raw fields, dtype=np.float32 to keep the fields in single precision 
+    with a cache (cache.FieldCache) the smoothed fields are stored, and the time steps already in it are not read
+    again (the fields are then read only memory maps) '''
+
+    if isinstance(files, str):
+      files = [files]
+
+    reader = _FileReader(lev=lev, p_top=p_top, dtype=dtype)
+    params = {'lev': lev, 'p_top': p_top, 'smooth_iter': smooth_iter, 'center_weight': center_weight, 'dtype': np.dtype(dtype).name}
+    if (not smooth_iter):
+      cache = None
+    executor = cf_futures.ThreadPoolExecutor(max_workers=1) if (prefetch) else None
+
+    def run(func, *args):
+      # read on the background thread if prefetching, else right away
+      if (executor is None):
+        return _Done(func(*args))
+      return executor.submit(func, *args)
+
+    def smooth(fields):
+      if (not smooth_iter):
+        return fields
+      return fd.smooth_grid(fields, iter=smooth_iter, center_weight=center_weight)
+
+    def keys(in_file, t_ind, names=SMOOTHED_FIELDS):
+      return dict((name, cache.key(in_file, t_ind, name, **params)) for name in names)
+
+    def load(in_file, t_ind):
+      # the smoothed fields from the cache if they are all there, else the raw fields
+      if (cache is not None):
+        smoothed = cache.get_all(keys(in_file, t_ind))
+        if (smoothed is not None):
+          return dict(reader.info(in_file, t_ind), smoothed=smoothed)
+      return reader.step(in_file, t_ind)
+
+    def prev_step_winds(in_file, t_ind):
+      def compute():
+        return dict(zip(('u850', 'v850'), smooth(np.stack(run(reader.winds, in_file, t_ind).result()))))
+      if (cache is None):
+        winds = compute()
+      else:
+        winds = cache.get_many(keys(in_file, t_ind, ('u850', 'v850')), compute)
+      return np.stack((winds['u850'], winds['v850']))
+
+    def steps():
+      for in_file in files:
+        for t_ind in range(run(reader.num_steps, in_file).result()):
+          yield in_file, t_ind
+
+    try:
+      # previous time step winds, carried over from one step to the next
+      prev_winds = None
+      if (prev_file):
+        n_prev = run(reader.num_steps, prev_file).result()
+        prev_winds = prev_step_winds(prev_file, n_prev-1)
+
+      step_iter = steps()
+      next_step = next(step_iter, None)
+      pending = run(load, *next_step) if (next_step) else None
+
+      while (pending is not None):
+        raw = pending.result()
+
+        # start reading the next step while this one is processed
+        next_step = next(step_iter, None)
+        pending = run(load, *next_step) if (next_step) else None
+
+        if ('smoothed' in raw):
+          u850, v850, theta850, theta1km = (raw['smoothed'][name] for name in SMOOTHED_FIELDS)
+        else:
+          t850 = np.copy(raw['T'][raw['lev_ind']])
+          t850[t850 > 1000] = np.nan
+          theta850 = fd.theta_from_temp_pres(t850, lev)
+          theta1km = fd.temp_pres_at_height(raw['H'], raw['T'], raw['levels'])['theta1km']
+
+          # all the fields of the step are smoothed together
+          smoothed = smooth(np.stack((raw['u'], raw['v'], theta850, theta1km)).astype(dtype, copy=False))
+          if (cache is not None):
+            step_keys = keys(raw['file'], raw['t_step'])
+            smoothed = [cache.put(step_keys[name], data) for name, data in zip(SMOOTHED_FIELDS, smoothed)]
+          u850, v850, theta850, theta1km = smoothed
+
+        if (prev_winds is not None):
+          lon, lat = np.meshgrid(raw['lon'], raw['lat'])
+          yield {
+            'file': raw['file'],
+            't_step': raw['t_step'],
+            'date': raw['date'],
+            'lat': lat,
+            'lon': lon,
+            'theta850': theta850,
+            'theta1km': theta1km,
+            'u850': u850,
+            'v850': v850,
+            'prev_u850': prev_winds[0],
+            'prev_v850': prev_winds[1],
+            'params': params,
+          }
+
+        prev_winds = np.stack((u850, v850))
+    finally:
+      if (executor is not None):
+        executor.shutdown(wait=True)
+      reader.close()
+
+class _Done(object):
+    # result holder with the same result() call as a future, when not prefetching
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+def mountain_mask(inLat, inLon):
+
+    topo_file = '/mnt/drive1/jj/cameron/data/MERRA2_101.const_2d_ctm_Nx.00000000.nc4'
+
+    # read in the topographic data
+    dataset = Dataset(topo_file)
+
+    # dsearchn the lat and lon from the grid
+    lat = dataset.variables['lat'][:]
+    lon = dataset.variables['lon'][:]
+    phis = dataset.variables['PHIS'][:]
+    phis = phis[1,:,:]/9.8
+
+    lonGrid, latGrid = np.meshgrid(lon, lat)
+
+    ul_lon = inLon[0,0]
+    ul_lat = inLat[0,0]
+    
+    lr_lon = inLon[-1,-1]
+    lr_lat = inLat[-1,-1]
+
+    ul_ind = np.argwhere((lonGrid == ul_lon) & (latGrid == ul_lat))
+    lr_ind = np.argwhere((lonGrid == lr_lon) & (latGrid == lr_lat))
+    
+    topo = phis[ul_ind[0][0]:lr_ind[0][0]+1, ul_ind[0][1]:lr_ind[0][1]+1]
+
+    return topo
+    
+    # create the mask for a threhold height as mountains
+
+    # return the mask 
+    pass
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+'''
+Chunked, compressed output store of the front masks and diagnostic fields
+
+FrontArrayStore keeps wf, cf (uint8, 1 on the fronts, 0 elsewhere, MISSING for the time steps not computed) and
+optionally diagnostic fields (m1, m2, eq7, grad_norm, float32) for a date range, under a folder in the zarr (v2)
+format: one folder per array with its .zarray/.zattrs metadata, and one zlib compressed file per chunk.
+It is written with numpy, zlib and json only, and can be opened with zarr or xarray.open_zarr later.
+
+The chunks are aligned with the days (steps_per_day time steps) and split in latitude/longitude tiles:
+- writing a day only writes the chunk files of that day (through a temporary file and a rename),
+  so worker processes can write different days into the same store at the same time, without locks;
+- reading a spatial or temporal subset only reads and decompresses the chunks it overlaps.
+A day is flagged in day_done (its own chunk) once it is written, so a run can be resumed.
+
+Example:
+  store = FrontArrayStore('fronts_2007.zarr', '2007-01-01', '2007-12-31', lat, lon, diagnostics=('m1', 'm2'))
+  store.write(pipeline.detect_fronts_for_file(in_file, prev_file, diagnostics=('m1', 'm2')))
+  sub = FrontArrayStore('fronts_2007.zarr').read('cf', '2007-06-01', '2007-08-31', lat_range=(20, 60), lon_range=(-100, 0))
+'''
+import datetime as dt
+import json
+import math
+import os
+import uuid
+import zlib
+
+import numpy as np
+
+# value of wf, cf for the time steps that are not computed
+MISSING = 255
+
+# diagnostic fields of hewson_1998 that can be stored with the fronts
+DIAGNOSTICS = ('m1', 'm2', 'eq7', 'grad_norm')
+
+def parse_date(date):
+    if isinstance(date, dt.datetime):
+      return date.date()
+    if isinstance(date, dt.date):
+      return date
+    return dt.datetime.strptime(date, '%Y-%m-%d').date()
+
+def _write_json(path, obj):
+    tmp_path = '%s.%s.tmp'%(path, uuid.uuid4().hex)
+    with open(tmp_path, 'w') as f:
+      json.dump(obj, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    with open(path) as f:
+      return json.load(f)
+
+class ChunkedArray(object):
+    ''' one array of the store, a folder with the zarr v2 .zarray/.zattrs files and one zlib compressed chunk per file
+    (chunks that were never written read as fill_value), indexed with ints and slices like a numpy array '''
+
+    def __init__(self, path):
+        self.path = path
+        meta = _read_json(os.path.join(path, '.zarray'))
+        self.shape = tuple(meta['shape'])
+        self.chunks = tuple(meta['chunks'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.fill_value = np.nan if (meta['fill_value'] == 'NaN') else meta['fill_value']
+        self.level = meta['compressor']['level']
+        self.attrs = _read_json(os.path.join(path, '.zattrs'))
+        self.dims = tuple(self.attrs.get('_ARRAY_DIMENSIONS', ()))
+
+    @classmethod
+    def create(cls, path, shape, chunks, dtype, fill_value, dims, attrs=None, level=1):
+        ''' new array at path (the folder must not exist) '''
+        dtype = np.dtype(dtype)
+        os.makedirs(path)
+        fill = 'NaN' if (isinstance(fill_value, float) and math.isnan(fill_value)) else fill_value
+        _write_json(os.path.join(path, '.zattrs'), dict(attrs or {}, _ARRAY_DIMENSIONS=list(dims)))
+        _write_json(os.path.join(path, '.zarray'), {
+            'zarr_format': 2,
+            'shape': [int(n) for n in shape],
+            'chunks': [int(n) for n in chunks],
+            'dtype': dtype.str,
+            'compressor': {'id': 'zlib', 'level': level},
+            'fill_value': fill,
+            'filters': None,
+            'order': 'C',
+            'dimension_separator': '.',
+        })
+        return cls(path)
+
+    def _chunk_path(self, index):
+        return os.path.join(self.path, '.'.join(str(i) for i in index))
+
+    def read_chunk(self, index):
+        ''' the (whole, edge chunks are padded with fill_value) chunk at chunk index '''
+        try:
+          with open(self._chunk_path(index), 'rb') as f:
+            data = f.read()
+        except FileNotFoundError:
+          return np.full(self.chunks, self.fill_value, dtype=self.dtype)
+        return np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape(self.chunks)
+
+    def write_chunk(self, index, chunk):
+        ''' writes the chunk at chunk index, through a temporary file and a rename (readers never see half a chunk) '''
+        path = self._chunk_path(index)
+        tmp_path = '%s.%s.tmp'%(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+          f.write(zlib.compress(np.ascontiguousarray(chunk, dtype=self.dtype).tobytes(), self.level))
+        os.replace(tmp_path, path)
+
+    def _ranges(self, key):
+        # (start, stop, step) of each axis and the axes indexed with an int (dropped from the result)
+        if (not isinstance(key, tuple)):
+          key = (key,)
+        if (Ellipsis in key):
+          i = key.index(Ellipsis)
+          key = key[:i] + (slice(None),)*(len(self.shape) - len(key) + 1) + key[i+1:]
+        key = key + (slice(None),)*(len(self.shape) - len(key))
+        if (len(key) != len(self.shape)):
+          raise IndexError('too many indices for an array of shape %s'%(str(self.shape)))
+
+        ranges, drop = [], []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+          if isinstance(k, slice):
+            ranges.append(k.indices(n))
+          elif isinstance(k, (int, np.integer)):
+            i = int(k) + n if (k < 0) else int(k)
+            if not (0 <= i < n):
+              raise IndexError('index %d is out of bounds for axis %d with size %d'%(k, axis, n))
+            ranges.append((i, i+1, 1))
+            drop.append(axis)
+          else:
+            raise TypeError('only ints and slices are supported, not %s'%(type(k).__name__))
+        return ranges, tuple(drop)
+
+    def _chunk_slices(self, bounds):
+        # for the box bounds [(start, stop), ...] of the array, the chunk indices it overlaps
+        # and for each the part of the chunk and of the box
+        axes = []
+        for (start, stop), c in zip(bounds, self.chunks):
+          parts = []
+          for i in range(start // c, -(-stop // c)):
+            lo, hi = max(start, i*c), min(stop, (i+1)*c)
+            parts.append((i, slice(lo - i*c, hi - i*c), slice(lo - start, hi - start)))
+          axes.append(parts)
+
+        out = []
+        for parts in np.ndindex(*[len(p) for p in axes]):
+          sel = [axes[axis][i] for axis, i in enumerate(parts)]
+          out.append((tuple(s[0] for s in sel), tuple(s[1] for s in sel), tuple(s[2] for s in sel)))
+        return out
+
+    def __getitem__(self, key):
+        ranges, drop = self._ranges(key)
+        # box of the array covering the selection (in index order), stepped after reading
+        bounds = []
+        for start, stop, step in ranges:
+          idx = range(start, stop, step)
+          bounds.append((min(idx), max(idx) + 1) if (len(idx) > 0) else (0, 0))
+
+        box = np.full([hi - lo for lo, hi in bounds], self.fill_value, dtype=self.dtype)
+        if (box.size > 0):
+          for index, in_chunk, in_box in self._chunk_slices(bounds):
+            box[in_box] = self.read_chunk(index)[in_chunk]
+
+        sel = tuple(slice(None) if (len(range(*r)) == 0) else
+            slice(0, None, r[2]) if (r[2] > 0) else slice(None, None, r[2]) for r in ranges)
+        out = box[sel]
+        return out.reshape([n for axis, n in enumerate(out.shape) if (axis not in drop)])
+
+    def __setitem__(self, key, value):
+        ''' writes value into the selection, chunks only partly covered are read, updated and written again
+        (so writers working at the same time must write different chunks) '''
+        ranges, drop = self._ranges(key)
+        if any(step != 1 for start, stop, step in ranges):
+          raise IndexError('only contiguous selections (step 1) can be written')
+        bounds = [(start, max(start, stop)) for start, stop, step in ranges]
+        shape = [hi - lo for lo, hi in bounds]
+        value = np.broadcast_to(np.asarray(value, dtype=self.dtype), [n for axis, n in enumerate(shape) if (axis not in drop)])
+        value = value.reshape(shape)
+
+        for index, in_chunk, in_box in self._chunk_slices(bounds):
+          whole = all((s.stop - s.start) == c for s, c in zip(in_chunk, self.chunks))
+          chunk = np.full(self.chunks, self.fill_value, dtype=self.dtype) if (whole) else np.array(self.read_chunk(index))
+          chunk[in_chunk] = value[in_box]
+          self.write_chunk(index, chunk)
+
+class FrontArrayStore(object):
+    ''' chunked store of the front masks (and diagnostics) for a date range under the folder root
+    with start_date, end_date, lat, lon a new store is created (or an existing one checked, to resume a run),
+    with root only an existing store is opened, e.g. by the worker processes
+    chunks are one day (steps_per_day time steps) by lat_chunk x lon_chunk points (a quarter of the grid each way by default) '''
+
+    def __init__(self, root, start_date=None, end_date=None, lat=None, lon=None, steps_per_day=4, diagnostics=(),
+        lat_chunk=None, lon_chunk=None, level=1):
+        self.root = root
+
+        if (not os.path.exists(os.path.join(root, '.zgroup'))):
+          if (start_date is None) or (lat is None) or (lon is None):
+            raise ValueError('%s is not a front store, start_date, end_date, lat and lon are needed to create it'%(root))
+          self._create(parse_date(start_date), parse_date(end_date), np.asarray(lat), np.asarray(lon), steps_per_day,
+              tuple(diagnostics), lat_chunk, lon_chunk, level)
+        self._open()
+
+        if (start_date is not None):
+          self._check(parse_date(start_date), parse_date(end_date), steps_per_day, tuple(diagnostics))
+
+    def _create(self, start_date, end_date, lat, lon, steps_per_day, diagnostics, lat_chunk, lon_chunk, level):
+        unknown = set(diagnostics) - set(DIAGNOSTICS)
+        if (unknown):
+          raise ValueError('unknown diagnostics %s, of %s'%(', '.join(sorted(unknown)), ', '.join(DIAGNOSTICS)))
+
+        num_days = (end_date - start_date).days + 1
+        num_times = num_days*steps_per_day
+        lat_chunk = lat_chunk or -(-lat.size // 4)
+        lon_chunk = lon_chunk or -(-lon.size // 4)
+
+        # arrays are created in a temporary folder, renamed once complete
+        tmp_root = '%s.%s.tmp'%(self.root.rstrip(os.sep), uuid.uuid4().hex)
+        os.makedirs(tmp_root)
+        _write_json(os.path.join(tmp_root, '.zgroup'), {'zarr_format': 2})
+        _write_json(os.path.join(tmp_root, '.zattrs'), {'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'), 'steps_per_day': steps_per_day, 'diagnostics': list(diagnostics)})
+
+        def create(name, shape, chunks, dtype, fill_value, dims, attrs=None):
+          return ChunkedArray.create(os.path.join(tmp_root, name), shape, chunks, dtype, fill_value, dims, attrs=attrs, level=level)
+
+        time = create('time', (num_times,), (num_times,), 'f8', np.nan, ('time',),
+            attrs={'units': 'hours since %s 00:00:00'%(start_date.strftime('%Y-%m-%d')), 'calendar': 'standard'})
+        time[:] = np.arange(num_times) * 24./steps_per_day
+        create('lat', (lat.size,), (lat.size,), 'f8', np.nan, ('lat',), attrs={'units': 'degrees_north'})[:] = lat
+        create('lon', (lon.size,), (lon.size,), 'f8', np.nan, ('lon',), attrs={'units': 'degrees_east'})[:] = lon
+        create('day_done', (num_days,), (1,), 'u1', 0, ('day',))
+
+        chunks = (steps_per_day, lat_chunk, lon_chunk)
+        for name in ('wf', 'cf'):
+          create(name, (num_times, lat.size, lon.size), chunks, 'u1', MISSING, ('time', 'lat', 'lon'), attrs={'missing_value': MISSING})
+        for name in diagnostics:
+          create(name, (num_times, lat.size, lon.size), chunks, 'f4', np.nan, ('time', 'lat', 'lon'))
+
+        try:
+          os.rename(tmp_root, self.root)
+        except OSError:
+          # created by another process in the mean time
+          if (not os.path.exists(os.path.join(self.root, '.zgroup'))):
+            raise
+          for dir_path, dir_names, file_names in os.walk(tmp_root, topdown=False):
+            for name in file_names:
+              os.remove(os.path.join(dir_path, name))
+            os.rmdir(dir_path)
+
+    def _open(self):
+        attrs = _read_json(os.path.join(self.root, '.zattrs'))
+        self.start_date = parse_date(attrs['start_date'])
+        self.end_date = parse_date(attrs['end_date'])
+        self.steps_per_day = int(attrs['steps_per_day'])
+        self.diagnostics = tuple(attrs['diagnostics'])
+        self.num_days = (self.end_date - self.start_date).days + 1
+
+        self.arrays = dict((name, ChunkedArray(os.path.join(self.root, name)))
+            for name in ('time', 'lat', 'lon', 'day_done', 'wf', 'cf') + self.diagnostics)
+        self.lat = self.arrays['lat'][:]
+        self.lon = self.arrays['lon'][:]
+
+    def _check(self, start_date, end_date, steps_per_day, diagnostics):
+        # making sure we are restarting the same run
+        if (start_date != self.start_date) or (end_date != self.end_date) or (steps_per_day != self.steps_per_day) \
+            or (set(diagnostics) != set(self.diagnostics)):
+          raise ValueError('%s was created for another run (%s to %s, %d steps per day, diagnostics %s)'%(self.root,
+              self.start_date.strftime('%Y-%m-%d'), self.end_date.strftime('%Y-%m-%d'), self.steps_per_day, ', '.join(self.diagnostics)))
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def day_index(self, date):
+        return (parse_date(date) - self.start_date).days
+
+    def done_dates(self):
+        done = (self.arrays['day_done'][:] == 1)
+        return set(self.start_date + dt.timedelta(days=int(i)) for i in np.where(done)[0])
+
+    def write(self, result):
+        ''' writes the fronts (and the diagnostics of the store) of one day, result of pipeline.detect_fronts_for_file
+        (date, steps, wf, cf, ...), the time steps of the day that are not in result are MISSING (nan) '''
+        i_day = self.day_index(result['date'])
+        if not (0 <= i_day < self.num_days):
+          raise ValueError('%s is not between %s and %s'%(result['date'], self.start_date, self.end_date))
+        steps = np.asarray(result['steps'])
+        t_day = slice(i_day*self.steps_per_day, (i_day+1)*self.steps_per_day)
+
+        # whole days, so only the chunks of this day are written (no read back)
+        for name in ('wf', 'cf') + self.diagnostics:
+          arr = self.arrays[name]
+          day = np.full((self.steps_per_day, self.lat.size, self.lon.size), arr.fill_value, dtype=arr.dtype)
+          day[steps] = result[name]
+          arr[t_day] = day
+
+        # only flagged once the data is on disk
+        self.arrays['day_done'][i_day] = 1
+
+    def read(self, name, start_date=None, end_date=None, lat_range=None, lon_range=None):
+        ''' name (wf, cf or a diagnostic) for the days start_date to end_date (inclusive, all by default)
+        and the points inside lat_range, lon_range (min, max), only the chunks overlapping them are read
+        returns a dict with name (time, lat, lon), dates, lat and lon '''
+        t0 = 0 if (start_date is None) else self.day_index(start_date)*self.steps_per_day
+        t1 = self.num_days*self.steps_per_day if (end_date is None) else (self.day_index(end_date) + 1)*self.steps_per_day
+        t0, t1 = max(t0, 0), min(t1, self.num_days*self.steps_per_day)
+
+        def axis_slice(values, value_range):
+          if (value_range is None):
+            return slice(None)
+          ind = np.where((values >= value_range[0]) & (values <= value_range[1]))[0]
+          return slice(ind[0], ind[-1] + 1) if (ind.size > 0) else slice(0, 0)
+
+        lat_slice, lon_slice = axis_slice(self.lat, lat_range), axis_slice(self.lon, lon_range)
+        start = dt.datetime.combine(self.start_date, dt.time())
+        step = dt.timedelta(hours=24./self.steps_per_day)
+        return {name: self.arrays[name][t0:t1, lat_slice, lon_slice],
+            'dates': [start + i*step for i in range(t0, max(t0, t1))],
+            'lat': self.lat[lat_slice], 'lon': self.lon[lon_slice]}
+
+    def close(self):
+        # nothing is kept open, every write is on disk when it returns
+        pass
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+'''
+Front tracking across time steps
+
+The clusters (8-connected, joined across the date line) of the warm and cold front masks of each time step
+are linked to the clusters of the previous time step, so each front gets a track id, and a lifetime,
+a distance and a speed once its track ends. The clusters of the previous time step are kept in a ClusterIndex,
+a KD tree of the cluster centroids (on the unit sphere) with their bounding boxes and sizes, so only the
+clusters that are close enough are compared: a pair is a candidate if the bounding boxes overlap or if the
+centroids are less than max_dist apart. Candidates are matched one to one, the pairs sharing the most grid
+cells first, then the nearest centroids. A current cluster with no match starts a track (genesis), a track
+with no match ends (lysis).
+Only the tracks active at the last time step are kept in memory, the finished tracks are written to out_file
+(csv) as they end, or kept in finished if there is no out_file.
+
+Example:
+  tracker = FrontTracker(lat, lon, max_dist=500., out_file='front_tracks_2007.csv')
+  for step in reader.read_steps(files):
+    ...
+    track_ids = tracker.update(step['date'], {'wf': wf, 'cf': cf})
+  tracker.close()
+'''
+import csv
+
+import numpy as np
+from scipy.ndimage import label, generate_binary_structure
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6371. # km
+
+TRACK_COLUMNS = ['track_id', 'type', 'start', 'end', 'num_steps', 'start_lat', 'start_lon', 'end_lat', 'end_lon',
+    'distance', 'mean_speed', 'max_size']
+
+def lat_lon_to_xyz(lat, lon):
+    # unit vectors on the sphere, (..., 3)
+    lat = np.deg2rad(lat)
+    lon = np.deg2rad(lon)
+    return np.stack((np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)), axis=-1)
+
+def xyz_to_lat_lon(xyz):
+    lat = np.rad2deg(np.arctan2(xyz[..., 2], np.hypot(xyz[..., 0], xyz[..., 1])))
+    lon = np.rad2deg(np.arctan2(xyz[..., 1], xyz[..., 0]))
+    return lat, lon
+
+def chord_to_km(chord):
+    return 2*EARTH_RADIUS*np.arcsin(np.clip(chord/2., 0, 1))
+
+def km_to_chord(dist):
+    return 2*np.sin(np.minimum(np.asarray(dist, dtype=float)/(2*EARTH_RADIUS), np.pi/2))
+
+def _join_periodic(labels, num):
+    # joins the clusters touching across the first and last columns (8-connected)
+    first = labels[:, 0]
+    last = labels[:, -1]
+    pairs = []
+    for shift in (-1, 0, 1):
+      lo = max(0, -shift)
+      hi = labels.shape[0] - max(0, shift)
+      a = first[lo:hi]
+      b = last[lo+shift:hi+shift]
+      touch = (a > 0) & (b > 0)
+      pairs.append((a[touch], b[touch]))
+    a = np.concatenate([p[0] for p in pairs])
+    b = np.concatenate([p[1] for p in pairs])
+    if (a.size == 0):
+      return labels, num, np.zeros(num+1, dtype=bool)
+
+    graph = coo_matrix((np.ones(a.size), (a, b)), shape=(num+1, num+1))
+    _, component = connected_components(graph, directed=False)
+    # new labels 1..n, in the order of the old ones
+    _, new_label = np.unique(component[1:], return_inverse=True)
+    relabel = np.r_[0, new_label + 1]
+    wrapped = np.zeros(num+1, dtype=bool)
+    wrapped[a] = True
+    wrapped_new = np.zeros(relabel.max()+1, dtype=bool)
+    wrapped_new[relabel[wrapped]] = True
+    return relabel[labels], int(relabel.max()), wrapped_new
+
+def front_clusters(mask, latGrid, lonGrid, min_size=1, periodic=True):
+    ''' 8-connected clusters of a (lat, lon) front mask (> 0), joined across the date line if periodic
+    returns a dict with labels (lat, lon), 0 outside of the clusters, and for each cluster (label - 1):
+    size, lat, lon and xyz of the centroid, radius (km, farthest point from the centroid),
+    row_min, row_max, col_min, col_max (all the columns for the clusters across the date line) '''
+
+    with np.errstate(invalid='ignore'):
+      mask = np.asarray(mask) > 0
+    labels, num = label(mask, structure=generate_binary_structure(2, 2))
+    wrapped = np.zeros(num+1, dtype=bool)
+    if (periodic) and (num > 0):
+      labels, num, wrapped = _join_periodic(labels, num)
+
+    # clusters smaller than min_size are dropped
+    size = np.bincount(labels.ravel(), minlength=num+1)
+    if (min_size > 1):
+      keep = (size >= min_size)
+      keep[0] = False
+      relabel = np.zeros(num+1, dtype=labels.dtype)
+      relabel[keep] = np.arange(1, keep.sum()+1)
+      labels = relabel[labels]
+      size = np.r_[0, size[keep]]
+      wrapped = np.r_[False, wrapped[keep]]
+      num = int(keep.sum())
+
+    rows, cols = np.nonzero(labels)
+    point_label = labels[rows, cols]
+    xyz = lat_lon_to_xyz(np.asarray(latGrid)[rows, cols], np.asarray(lonGrid)[rows, cols])
+
+    # centroid on the sphere
+    center = np.zeros((num+1, 3))
+    for axis in range(3):
+      center[:, axis] = np.bincount(point_label, weights=xyz[:, axis], minlength=num+1)
+    center[1:] /= np.maximum(np.linalg.norm(center[1:], axis=1, keepdims=True), 1e-12)
+
+    radius = np.zeros(num+1)
+    np.maximum.at(radius, point_label, np.linalg.norm(xyz - center[point_label], axis=1))
+
+    row_min = np.full(num+1, labels.shape[0])
+    row_max = np.full(num+1, -1)
+    col_min = np.full(num+1, labels.shape[1])
+    col_max = np.full(num+1, -1)
+    np.minimum.at(row_min, point_label, rows)
+    np.maximum.at(row_max, point_label, rows)
+    np.minimum.at(col_min, point_label, cols)
+    np.maximum.at(col_max, point_label, cols)
+    col_min[wrapped] = 0
+    col_max[wrapped] = labels.shape[1] - 1
+
+    c_lat, c_lon = xyz_to_lat_lon(center[1:])
+    return {
+      'labels': labels,
+      'num': num,
+      'size': size[1:],
+      'lat': c_lat,
+      'lon': c_lon,
+      'xyz': center[1:],
+      'radius': chord_to_km(radius[1:]),
+      'row_min': row_min[1:],
+      'row_max': row_max[1:],
+      'col_min': col_min[1:],
+      'col_max': col_max[1:],
+    }
+
+class ClusterIndex(object):
+    ''' spatial index of the clusters of one time step (front_clusters), KD tree of the centroids '''
+
+    def __init__(self, clusters):
+        self.clusters = clusters
+        self.tree = cKDTree(clusters['xyz']) if (clusters['num'] > 0) else None
+        self.max_radius = float(clusters['radius'].max()) if (clusters['num'] > 0) else 0.
+
+    def candidates(self, clusters, max_dist=500., margin=2, cell_km=111.2):
+        ''' pairs (index in this step, index in clusters) of the clusters whose bounding boxes (grown by margin cells)
+        overlap or whose centroids are less than max_dist (km) apart, with the centroid distance (km)
+        cell_km is the largest grid cell size (km), for the margin '''
+
+        empty = (np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))
+        if (self.tree is None) or (clusters['num'] == 0):
+          return empty
+
+        # boxes can only overlap if the centroids are closer than the two radii (+ the margin)
+        search = max_dist + clusters['radius'] + self.max_radius + 2*margin*cell_km
+        near = self.tree.query_ball_point(clusters['xyz'], km_to_chord(search))
+        cur = np.repeat(np.arange(clusters['num']), [len(n) for n in near])
+        prev = np.asarray([i for n in near for i in n], dtype=int)
+        if (prev.size == 0):
+          return empty
+
+        mine = self.clusters
+        dist = chord_to_km(np.linalg.norm(mine['xyz'][prev] - clusters['xyz'][cur], axis=1))
+        overlap = ((mine['row_min'][prev] - margin <= clusters['row_max'][cur]) & (clusters['row_min'][cur] <= mine['row_max'][prev] + margin)
+            & (mine['col_min'][prev] - margin <= clusters['col_max'][cur]) & (clusters['col_min'][cur] <= mine['col_max'][prev] + margin))
+        keep = overlap | (dist <= max_dist)
+        return prev[keep], cur[keep], dist[keep]
+
+def match_clusters(prev_clusters, index, clusters, max_dist=500., margin=2, cell_km=111.2):
+    ''' one to one matches (prev, cur) between the clusters of two time steps, from the candidates of the
+    ClusterIndex of the previous step: the pairs sharing the most grid cells first, then the nearest '''
+
+    prev, cur, dist = index.candidates(clusters, max_dist=max_dist, margin=margin, cell_km=cell_km)
+    if (prev.size == 0):
+      return prev, cur, dist
+
+    # grid cells shared by each candidate pair
+    both = (prev_clusters['labels'] > 0) & (clusters['labels'] > 0)
+    shared_keys, shared_count = np.unique((prev_clusters['labels'][both].astype(np.int64) - 1)*clusters['num']
+        + clusters['labels'][both] - 1, return_counts=True)
+    pair_key = prev.astype(np.int64)*clusters['num'] + cur
+    shared = np.zeros(prev.size, dtype=np.int64)
+    if (shared_keys.size > 0):
+      pos = np.minimum(np.searchsorted(shared_keys, pair_key), shared_keys.size - 1)
+      hit = (shared_keys[pos] == pair_key)
+      shared[hit] = shared_count[pos[hit]]
+
+    # greedy, best pairs first
+    order = np.lexsort((dist, -shared))
+    prev_used = np.zeros(prev_clusters['num'], dtype=bool)
+    cur_used = np.zeros(clusters['num'], dtype=bool)
+    matches = []
+    for i in order:
+      if (prev_used[prev[i]]) or (cur_used[cur[i]]):
+        continue
+      prev_used[prev[i]] = True
+      cur_used[cur[i]] = True
+      matches.append(i)
+    matches = np.asarray(matches, dtype=int)
+    return prev[matches], cur[matches], dist[matches]
+
+class FrontTracker(object):
+    ''' links the front clusters of consecutive time steps into tracks, see the module doc
+    max_dist (km) is the largest move of a front between two time steps, min_size the smallest cluster tracked
+    update() returns, for each front type, the labels of the step and the track id of each cluster (label - 1) '''
+
+    def __init__(self, latGrid, lonGrid, max_dist=500., min_size=3, margin=2, periodic=True, types=('wf', 'cf'), out_file=None):
+        self.lat = np.asarray(latGrid)
+        self.lon = np.asarray(lonGrid)
+        self.max_dist = max_dist
+        self.min_size = min_size
+        self.margin = margin
+        self.periodic = periodic
+        self.types = types
+        # largest grid cell (km), for the bounding box margin
+        self.cell_km = 111.2*max(np.abs(np.diff(self.lat, axis=0)).max(initial=0), np.abs(np.diff(self.lon, axis=1)).max(initial=0))
+
+        self.next_id = 0
+        self.num_finished = 0
+        self.finished = []
+        self.prev_date = None
+        # clusters, index and active tracks (one per cluster) of the last time step, for each type
+        self.state = {}
+
+        self.out = None
+        if (out_file):
+          self.out = open(out_file, 'w', newline='')
+          self.writer = csv.writer(self.out)
+          self.writer.writerow(TRACK_COLUMNS)
+
+    def _finish(self, f_type, tracks, ind):
+        # writes (or keeps) the tracks ind that ended
+        for i in ind:
+          hours = (tracks['end'][i] - tracks['start'][i]).total_seconds()/3600. if (tracks['num_steps'][i] > 1) else 0.
+          row = [int(tracks['track_id'][i]), f_type, tracks['start'][i], tracks['end'][i], int(tracks['num_steps'][i]),
+              tracks['start_lat'][i], tracks['start_lon'][i], tracks['end_lat'][i], tracks['end_lon'][i],
+              tracks['distance'][i], tracks['distance'][i]/hours if (hours > 0) else np.nan, int(tracks['max_size'][i])]
+          if (self.out is not None):
+            self.writer.writerow(row)
+          else:
+            self.finished.append(dict(zip(TRACK_COLUMNS, row)))
+          self.num_finished += 1
+
+    def update(self, date, fronts):
+        ''' adds the fronts (dict of (lat, lon) masks for types) of the next time step
+        returns a dict type -> {'labels': (lat, lon) cluster labels, 'track_id': track id of each cluster} '''
+
+        out = {}
+        for f_type in self.types:
+          clusters = front_clusters(fronts[f_type], self.lat, self.lon, min_size=self.min_size, periodic=self.periodic)
+          num = clusters['num']
+
+          tracks = {
+            'track_id': np.full(num, -1, dtype=np.int64),
+            'start': np.full(num, date, dtype=object),
+            'end': np.full(num, date, dtype=object),
+            'num_steps': np.ones(num, dtype=int),
+            'start_lat': clusters['lat'].copy(),
+            'start_lon': clusters['lon'].copy(),
+            'end_lat': clusters['lat'],
+            'end_lon': clusters['lon'],
+            'distance': np.zeros(num),
+            'max_size': clusters['size'].copy(),
+          }
+
+          prev_state = self.state.get(f_type)
+          ended = np.zeros(0, dtype=int)
+          if (prev_state is not None):
+            prev, cur, dist = match_clusters(prev_state['clusters'], prev_state['index'], clusters,
+                max_dist=self.max_dist, margin=self.margin, cell_km=self.cell_km)
+            prev_tracks = prev_state['tracks']
+            # the matched clusters continue the tracks of the previous step
+            for name in ('track_id', 'start', 'start_lat', 'start_lon'):
+              tracks[name][cur] = prev_tracks[name][prev]
+            tracks['num_steps'][cur] = prev_tracks['num_steps'][prev] + 1
+            tracks['distance'][cur] = prev_tracks['distance'][prev] + dist
+            tracks['max_size'][cur] = np.maximum(prev_tracks['max_size'][prev], clusters['size'][cur])
+
+            matched = np.zeros(prev_state['clusters']['num'], dtype=bool)
+            matched[prev] = True
+            ended = np.where(~matched)[0]
+            self._finish(f_type, prev_tracks, ended)
+
+          # new tracks
+          new = np.where(tracks['track_id'] < 0)[0]
+          tracks['track_id'][new] = self.next_id + np.arange(new.size)
+          self.next_id += new.size
+
+          self.state[f_type] = {'clusters': clusters, 'index': ClusterIndex(clusters), 'tracks': tracks}
+          out[f_type] = {'labels': clusters['labels'], 'track_id': tracks['track_id'], 'genesis': new.size, 'lysis': ended.size}
+
+        self.prev_date = date
+        return out
+
+    def close(self):
+        ''' ends all the active tracks '''
+        for f_type, state in self.state.items():
+          self._finish(f_type, state['tracks'], range(state['clusters']['num']))
+        self.state = {}
+        if (self.out is not None):
+          self.out.close()
+          self.out = None